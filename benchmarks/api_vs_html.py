@@ -0,0 +1,96 @@
+"""
+Compare the CPU time per request of the polls HTML pages and their JSON API
+counterparts.
+
+Every page is requested `--requests` times through the WSGI application,
+after a warm-up request, against a fresh test database holding
+`--questions` questions of four choices each. Reports the mean CPU time
+of a request and the size of the response.
+
+Usage, from the project root:
+
+    python benchmarks/api_vs_html.py --requests 2000
+
+DJANGO_SETTINGS_MODULE picks the settings, django_tutorial.settings by
+default.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup(questions):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_tutorial.settings')
+    os.environ['POLLS_ASYNC_VIEWS'] = 'False'
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    settings.ALLOWED_HOSTS = ['*']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    from django.utils import timezone
+    from polls.models import Choice, Question
+
+    now = timezone.now()
+    for number in range(questions):
+        question = Question.objects.create(
+            question_text='Question %d?' % number, pub_date=now)
+        Choice.objects.bulk_create([
+            Choice(question=question, choice_text='Choice %d' % choice)
+            for choice in range(4)])
+    return Question.objects.values_list('pk', flat=True).first()
+
+
+def measure(path, count):
+    from django.core.wsgi import get_wsgi_application
+    from wsgiref.util import setup_testing_defaults
+
+    application = get_wsgi_application()
+
+    def get():
+        path_info, _, query_string = path.partition('?')
+        environ = {'PATH_INFO': path_info, 'QUERY_STRING': query_string,
+                   'REQUEST_METHOD': 'GET'}
+        setup_testing_defaults(environ)
+        status = []
+        body = application(environ, lambda s, h, e=None: status.append(s))
+        content = b''.join(body)
+        body.close()
+        if not status[0].startswith('200'):
+            raise RuntimeError('%s returned %s' % (path, status[0]))
+        return len(content)
+
+    size = get()
+    started = time.process_time()
+    for _ in range(count):
+        get()
+    return (time.process_time() - started) / count, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=100)
+    args = parser.parse_args()
+    pk = setup(args.questions)
+    pairs = [
+        ('/polls/', '/polls/api/questions/?limit=5'),
+        ('/polls/%d/' % pk, '/polls/api/questions/%d/' % pk),
+        ('/polls/%d/results/' % pk, '/polls/api/questions/%d/results/' % pk),
+    ]
+    print('%-38s %12s %10s' % ('path', 'CPU us/req', 'bytes'))
+    for html, api in pairs:
+        for path in (html, api):
+            cpu, size = measure(path, args.requests)
+            print('%-38s %12.1f %10d' % (path, cpu * 1000000, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare keyset and OFFSET pagination of the polls archive at growing page
+depths.
+
+A fresh test database is filled with `--questions` published questions,
+then pages of the archive are fetched at each depth, both by seeking to
+the cursor of the previous page, as the archive view does, and with
+LIMIT/OFFSET. Reports the median time per page.
+
+Usage, from the project root:
+
+    python benchmarks/archive_pagination.py --questions 1000000
+
+DJANGO_SETTINGS_MODULE picks the settings, django_tutorial.settings by
+default.
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup(questions):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_tutorial.settings')
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    from django.utils import timezone
+    from polls.models import Question
+
+    now = timezone.now()
+    batch = 10000
+    for start in range(0, questions, batch):
+        Question.objects.bulk_create([
+            Question(question_text='Question %d?' % number, choice_count=4,
+                     pub_date=now - datetime.timedelta(minutes=number // 3))
+            for number in range(start, min(start + batch, questions))])
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE TABLE polls_question')
+
+
+def time_page(fetch, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fetch()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--questions', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    setup(args.questions)
+
+    from django.test import RequestFactory
+    from polls.models import Question
+    from polls.views import ARCHIVE_PAGE_SIZE, archive_page, encode_cursor
+
+    visible = Question.objects.visible().order_by('-pub_date', '-id').values(
+            'id', 'question_text', 'pub_date')
+    pages = args.questions // ARCHIVE_PAGE_SIZE
+    depths = sorted({1, 10, 100, 1000, 10000, pages // 2, pages - 1} &
+                    set(range(1, pages)))
+    print('%8s %12s %12s' % ('page', 'keyset ms', 'offset ms'))
+    for depth in depths:
+        offset = depth * ARCHIVE_PAGE_SIZE
+        # The cursor a reader following the 'Older' links would hold.
+        request = RequestFactory().get('/polls/archive/', {
+            'before': encode_cursor(visible[offset - 1])})
+
+        def keyset():
+            return [question.id for question in
+                    archive_page(request)['question_list']]
+
+        def offset_page():
+            return [question['id'] for question in
+                    visible[offset:offset + ARCHIVE_PAGE_SIZE + 1]]
+
+        assert keyset() == offset_page()[:ARCHIVE_PAGE_SIZE]
+        print('%8d %12.2f %12.2f' % (
+            depth, time_page(keyset, args.repeat),
+            time_page(offset_page, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
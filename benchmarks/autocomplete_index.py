@@ -0,0 +1,132 @@
+"""
+Measure the memory and lookup latency of the autocomplete index.
+
+A fresh test database is filled with `--questions` questions made of
+words drawn from a vocabulary of `--words` made-up words, the index is
+built from it, saved to a snapshot and loaded back, then queries are looked up
+as they'd be typed, every few letters. Reports the memory the index takes,
+the build and load times, and the latency percentiles of the index
+lookups and of the whole suggestions, which check the questions are
+visible.
+
+Usage, from the project root:
+
+    python benchmarks/autocomplete_index.py --questions 1000000
+
+DJANGO_SETTINGS_MODULE picks the settings, django_tutorial.settings by
+default.
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(LETTERS) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def setup(questions, words, rng):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_tutorial.settings')
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    from django.utils import timezone
+    from polls.models import Question
+
+    now = timezone.now()
+    # Zipf-like word frequencies, as in real text.
+    words = rng.sample(words, len(words))
+    weights = list(itertools.accumulate(
+        1 / (rank + 1) for rank in range(len(words))))
+    batch = 10000
+    for start in range(0, questions, batch):
+        Question.objects.bulk_create([
+            Question(question_text=' '.join(rng.choices(
+                         words, cum_weights=weights,
+                         k=rng.randint(3, 10))).capitalize() + '?',
+                     choice_count=1,
+                     pub_date=now - datetime.timedelta(minutes=number))
+            for number in range(start, min(start + batch, questions))])
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return tuple(timings[int(len(timings) * p)] * 1000 for p in (0.5, 0.99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--questions', type=int, default=1000000)
+    parser.add_argument('--words', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(42)
+    words = vocabulary(args.words, rng)
+    setup(args.questions, words, rng)
+
+    from polls.autocomplete import PrefixIndex, suggest
+    from polls.models import Question
+    import polls.autocomplete
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = PrefixIndex.build(args.questions)
+    build = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'autocomplete.snapshot')
+        index.save(path)
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        index = PrefixIndex.load(path)
+        load = time.perf_counter() - started
+    polls.autocomplete._index = index
+    polls.autocomplete._refreshed = time.monotonic()
+    print('%d questions, %d distinct words' % (args.questions, len(index)))
+    print('index memory %.1f MB, snapshot %.1f MB' % (memory / 2 ** 20, size / 2 ** 20))
+    print('build %.1f s, snapshot load %.2f s' % (build, load))
+
+    # The first two words of random questions, as typed so far.
+    texts = list(Question.objects.order_by('?').values_list(
+        'question_text', flat=True)[:args.queries // 5])
+    queries = []
+    for text in texts:
+        typed = ' '.join(text.lower().rstrip('?').split()[:2])
+        queries.extend(typed[:n] for n in range(2, len(typed) + 1, 3))
+    lookups, suggestions = [], []
+    for query in queries[:args.queries]:
+        started = time.perf_counter()
+        index.candidates(query, 10)
+        lookups.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        suggest(query, 10)
+        suggestions.append(time.perf_counter() - started)
+    print('%d queries' % len(lookups))
+    print('index lookup   p50 %.3f ms  p99 %.3f ms  mean %.3f ms' % (
+        percentiles(lookups) + (statistics.mean(lookups) * 1000,)))
+    print('suggestions    p50 %.3f ms  p99 %.3f ms  mean %.3f ms' % (
+        percentiles(suggestions) + (statistics.mean(suggestions) * 1000,)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Load-test the live results WebSocket with in-process clients.
+
+`--clients` WebSocket clients each subscribe to `--per-client` random
+questions out of `--questions`, through in-memory queues rather than a
+network server, while votes are published to the results feed at
+`--rate` votes per second for `--seconds` seconds. Reports the frames and
+bytes delivered, the delay between a vote and the frame carrying it, and
+the CPU time spent.
+
+Usage, from the project root:
+
+    python benchmarks/ws_results_load.py --clients 2000 --rate 5000
+
+DJANGO_SETTINGS_MODULE picks the settings, django_tutorial.settings by
+default.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup(questions):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_tutorial.settings')
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    from django.utils import timezone
+    from polls.models import Choice, Question
+
+    now = timezone.now()
+    for number in range(questions):
+        question = Question.objects.create(
+            question_text='Question %d?' % number, pub_date=now)
+        Choice.objects.bulk_create([
+            Choice(question=question, choice_text='Choice %d' % choice)
+            for choice in range(4)])
+    return {
+        question_id: [choice.pk for choice in Choice.objects.filter(
+            question_id=question_id)]
+        for question_id in Question.objects.values_list('pk', flat=True)}
+
+
+async def client(question_ids, published, stats, ready):
+    from polls.websocket import LocalWebSocket, results_socket
+
+    socket = LocalWebSocket(results_socket)
+    await socket.connect()
+    await socket.send_json({'subscribe': question_ids})
+    await socket.receive_json()
+    ready.release()
+    try:
+        while True:
+            frame = await socket.receive_json()
+            received = time.perf_counter()
+            stats['frames'] += 1
+            stats['bytes'] += len(str(frame))
+            if 'd' in frame:
+                stats['delays'].append(received - published[0])
+    finally:
+        await socket.close()
+
+
+async def voter(choices, rate, seconds):
+    from polls.changefeed import results_feed
+
+    question_ids = list(choices)
+    deadline = time.perf_counter() + seconds
+    step = 0.01
+    votes = 0
+    while time.perf_counter() < deadline:
+        for _ in range(max(1, int(rate * step))):
+            question_id = random.choice(question_ids)
+            results_feed.publish(question_id, random.choice(choices[question_id]))
+            votes += 1
+        await asyncio.sleep(step)
+    return votes
+
+
+def track_ticks(published):
+    """
+    Keep in published[0] the start of the tick whose votes are being
+    delivered, i.e. the time of the oldest vote a delta frame can carry.
+    """
+    from polls.changefeed import results_feed
+
+    flush = results_feed.flush
+    last = [time.perf_counter()]
+
+    def timed_flush():
+        published[0], last[0] = last[0], time.perf_counter()
+        flush()
+    results_feed.flush = timed_flush
+
+
+async def main(args, choices):
+    question_ids = list(choices)
+    stats = {'frames': 0, 'bytes': 0, 'delays': []}
+    published = [None]
+    track_ticks(published)
+    ready = asyncio.Semaphore(0)
+    clients = [
+        asyncio.get_running_loop().create_task(client(
+            random.sample(question_ids, args.per_client), published, stats,
+            ready))
+        for _ in range(args.clients)]
+    for _ in clients:
+        await ready.acquire()
+    stats['frames'] = stats['bytes'] = 0
+    cpu = time.process_time()
+    started = time.perf_counter()
+    votes = await voter(choices, args.rate, args.seconds)
+    await asyncio.sleep(0.5)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+    for task in clients:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    return votes, elapsed, cpu, stats
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--questions', type=int, default=100)
+    parser.add_argument('--per-client', type=int, default=10)
+    parser.add_argument('--rate', type=int, default=2000,
+                        help='Votes published per second.')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+    choices = setup(args.questions)
+    votes, elapsed, cpu, stats = asyncio.run(main(args, choices))
+    delays = sorted(stats['delays']) or [0]
+    print('votes published   %10d' % votes)
+    print('frames sent       %10d (%.0f/s)' % (
+        stats['frames'], stats['frames'] / elapsed))
+    print('payload           %10.1f KB/s' % (stats['bytes'] / elapsed / 1024))
+    print('delay p50         %10.1f ms' % (statistics.median(delays) * 1000))
+    print('delay p99         %10.1f ms' % (
+        delays[int(len(delays) * 0.99) - 1] * 1000))
+    print('CPU               %10.1f %%' % (cpu / elapsed * 100))
+    print('max RSS           %10.1f MB' % (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == '__main__':
+    run()
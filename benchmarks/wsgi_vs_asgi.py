@@ -0,0 +1,206 @@
+"""
+Compare the WSGI and ASGI deployments of the polls pages under concurrent
+readers.
+
+Each deployment runs in a subprocess of its own, against a fresh test
+database, and serves the detail and results pages of a set of questions to
+`--concurrency` simultaneous readers. WSGI readers each tie up one thread
+of a fixed-size pool of `--concurrency` threads, like a threaded worker;
+ASGI readers are coroutines driving the ASGI application, with the polls
+async views. Every query is slowed down by `--latency` milliseconds to
+stand in for a remote MySQL server.
+
+Usage, from the project root:
+
+    python benchmarks/wsgi_vs_asgi.py --concurrency 50 --requests 2000
+
+DJANGO_SETTINGS_MODULE picks the settings, django_tutorial.settings by
+default.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup(mode, latency, questions):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_tutorial.settings')
+    os.environ['POLLS_ASYNC_VIEWS'] = str(mode == 'asgi')
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+    from django.test.utils import setup_test_environment
+
+    settings.ALLOWED_HOSTS = ['*']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    from django.utils import timezone
+    from polls.models import Choice, Question
+
+    now = timezone.now()
+    for number in range(questions):
+        question = Question.objects.create(
+            question_text='Question %d?' % number, pub_date=now)
+        Choice.objects.bulk_create([
+            Choice(question=question, choice_text='Choice %d' % choice)
+            for choice in range(4)])
+
+    def slow_down(execute, sql, params, many, context):
+        time.sleep(latency / 1000)
+        return execute(sql, params, many, context)
+
+    def add_latency(sender, connection, **kwargs):
+        connection.execute_wrappers.append(slow_down)
+    connection_created.connect(add_latency, weak=False)
+    return list(Question.objects.values_list('pk', flat=True))
+
+
+def paths(question_ids, count):
+    pages = ['/polls/%d/', '/polls/%d/results/']
+    return [pages[i % 2] % question_ids[i % len(question_ids)]
+            for i in range(count)]
+
+
+def run_wsgi(urls, concurrency):
+    from django.core.wsgi import get_wsgi_application
+    from wsgiref.util import setup_testing_defaults
+
+    application = get_wsgi_application()
+
+    def get(path):
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}
+        setup_testing_defaults(environ)
+        started = time.perf_counter()
+        status = []
+        body = application(environ, lambda s, h, e=None: status.append(s))
+        b''.join(body)
+        body.close()
+        if not status[0].startswith('200'):
+            raise RuntimeError('%s returned %s' % (path, status[0]))
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(get, urls))
+    return latencies
+
+
+def run_asgi(urls, concurrency):
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+
+    async def get(path):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path':
+            path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+        started = time.perf_counter()
+        await application(scope, receive, send)
+        if messages[0]['status'] != 200:
+            raise RuntimeError('%s returned %s' % (path, messages[0]['status']))
+        return time.perf_counter() - started
+
+    async def reader(queue, latencies):
+        while queue:
+            latencies.append(await get(queue.pop()))
+
+    async def main():
+        queue = list(reversed(urls))
+        latencies = []
+        await asyncio.gather(*[
+            reader(queue, latencies) for _ in range(concurrency)])
+        return latencies
+
+    return asyncio.run(main())
+
+
+class ThreadCounter(threading.Thread):
+    """
+    Sample the number of live threads, keeping the highest one seen.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = 0
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(0.005):
+            self.peak = max(self.peak, threading.active_count() - 1)
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+
+def measure(mode, args):
+    question_ids = setup(mode, args.latency, args.questions)
+    urls = paths(question_ids, args.requests)
+    run = run_wsgi if mode == 'wsgi' else run_asgi
+    run(urls[:args.concurrency], args.concurrency)  # warm up
+    threads = ThreadCounter()
+    threads.start()
+    started = time.perf_counter()
+    latencies = run(urls, args.concurrency)
+    elapsed = time.perf_counter() - started
+    threads.stop()
+    latencies.sort()
+    return {
+        'mode': mode,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'peak_threads': threads.peak,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=2,
+                        help='Milliseconds added to every query.')
+    parser.add_argument('--mode', choices=['wsgi', 'asgi'],
+                        help='Run a single deployment and print JSON.')
+    args = parser.parse_args()
+    if args.mode:
+        print(json.dumps(measure(args.mode, args)))
+        return
+    print('%-5s %10s %9s %9s %8s %8s' % (
+        'mode', 'req/s', 'p50 ms', 'p99 ms', 'threads', 'RSS MB'))
+    for mode in ('wsgi', 'asgi'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode] + sys.argv[1:],
+            check=True, stdout=subprocess.PIPE).stdout
+        result = json.loads(output.decode().splitlines()[-1])
+        print('%-5s %10.1f %9.2f %9.2f %8d %8.1f' % (
+            mode, result['requests_per_second'], result['p50_ms'],
+            result['p99_ms'], result['peak_threads'], result['max_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+ASGI config for django_tutorial project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Unless POLLS_ASYNC_VIEWS says otherwise, the polls pages are served by
+their async views. WebSocket connections to /polls/ws/results/ go to the
+live results socket, other WebSocket connections are refused. The
+autocomplete index starts loading at the lifespan startup event.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_tutorial.settings')
+os.environ.setdefault('POLLS_ASYNC_VIEWS', 'True')
+
+django_application = get_asgi_application()
+
+from polls import autocomplete, websocket  # noqa: E402 (needs the app registry)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] != 'websocket':
+        await django_application(scope, receive, send)
+    elif scope['path'] == websocket.PATH:
+        await websocket.results_socket(scope, receive, send)
+    else:
+        await receive()
+        await send({'type': 'websocket.close'})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            autocomplete.warm_up()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
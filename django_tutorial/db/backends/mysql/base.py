@@ -0,0 +1,12 @@
+from django.db.backends.mysql import base
+
+from django_tutorial.db.backends.pooled import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """
+    The MySQL backend, with pooled connections.
+    """
+
+    def check_pooled_connection(self, connection):
+        connection.ping()
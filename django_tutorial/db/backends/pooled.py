@@ -0,0 +1,57 @@
+from django_tutorial.db.pool import get_pool
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Take the connections of a Django database backend from a ConnectionPool
+    and give them back to it instead of closing them.
+
+    The pool is configured by the 'POOL' dict of the database settings:
+    SIZE (0 turns pooling off), MAX_LIFETIME, TIMEOUT and CHECK_AFTER, in
+    seconds, see ConnectionPool.
+    """
+
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        if self.pool is None:
+            return super().get_new_connection(conn_params)
+        return self.pool.acquire()
+
+    def get_pool(self, conn_params):
+        options = self.settings_dict.get('POOL') or {}
+        if not options.get('SIZE', 10):
+            return None
+        key = (self.alias,) + tuple(
+                self.settings_dict.get(name) for name in
+                ('NAME', 'USER', 'HOST', 'PORT'))
+        return get_pool(
+            key,
+            connect=lambda: super(PooledDatabaseWrapperMixin, self)
+            .get_new_connection(conn_params),
+            size=options.get('SIZE', 10),
+            max_lifetime=options.get('MAX_LIFETIME', 1800),
+            timeout=options.get('TIMEOUT', 10),
+            check_after=options.get('CHECK_AFTER', 30),
+            health_check=self.check_pooled_connection,
+        )
+
+    def check_pooled_connection(self, connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.pool is None:
+            return super()._close()
+        # A connection closed in the middle of a transaction, or after a
+        # database error, isn't trusted with the next request.
+        with self.wrap_database_errors:
+            self.pool.release(
+                self.connection,
+                discard=self.in_atomic_block or self.errors_occurred)
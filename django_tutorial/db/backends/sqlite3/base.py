@@ -0,0 +1,17 @@
+from django.db.backends.sqlite3 import base
+
+from django_tutorial.db.backends.pooled import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """
+    The SQLite backend, with pooled connections.
+
+    In-memory databases aren't pooled: their connection is never closed,
+    so it would never go back to the pool.
+    """
+
+    def get_pool(self, conn_params):
+        if self.is_in_memory_db():
+            return None
+        return super().get_pool(conn_params)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+POOLED_ENGINES = 'django_tutorial.db.backends.'
+
+
+@register()
+def check_pool_settings(app_configs, **kwargs):
+    """
+    Warn about pooled databases whose threads keep their connection
+    between requests: each thread holds one of the pool's connections, so
+    past the pool's SIZE threads the others wait for one and time out.
+    """
+    warnings = []
+    for alias, options in settings.DATABASES.items():
+        size = (options.get('POOL') or {}).get('SIZE', 10)
+        if (not options.get('ENGINE', '').startswith(POOLED_ENGINES) or
+                not size or options.get('CONN_MAX_AGE', 0) == 0):
+            continue
+        warnings.append(Warning(
+            "DATABASES['%s'] keeps connections open between requests "
+            "(CONN_MAX_AGE=%s) while pooling them: at most %d threads per "
+            "process can use the database." % (
+                alias, options.get('CONN_MAX_AGE'), size),
+            hint='Set CONN_MAX_AGE to 0 so connections go back to the pool '
+                 'after each request.',
+            id='django_tutorial.W001',
+        ))
+    return warnings
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+from .routers import pin_to_primary, wrote_to_primary
+
+PIN_COOKIE = 'pin_primary'
+
+
+class PrimaryPinMiddleware(MiddlewareMixin):
+    """
+    Keep a client on the primary database for a few seconds after one of
+    its requests wrote to it, so it reads its own writes (like its vote on
+    the results page it is redirected to) despite replication lag.
+    """
+
+    def process_request(self, request):
+        pin_to_primary(PIN_COOKIE in request.COOKIES)
+
+    def process_response(self, request, response):
+        if wrote_to_primary():
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.DATABASE_PRIMARY_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        pin_to_primary(False)
+        return response
@@ -0,0 +1,182 @@
+"""
+A process-wide pool of database connections, shared by the threads of a
+worker, so a request doesn't pay a new TCP connection and authentication
+handshake every time Django opens a connection.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Hand out at most `size` connections made by `connect()`.
+
+    Connections older than `max_lifetime` seconds are closed when they
+    come back or before they are handed out again. A connection that sat
+    idle for more than `check_after` seconds is checked with
+    `health_check(connection)`, which returns False or raises when the
+    connection is unusable, before it is handed out. acquire() waits up to
+    `timeout` seconds for a connection when all of them are in use.
+    """
+
+    def __init__(self, connect, size=10, max_lifetime=1800, timeout=10,
+                 check_after=30, health_check=None):
+        self.connect = connect
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.check_after = check_after
+        self.health_check = health_check
+        self._idle = deque()
+        self._born = {}
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.created = 0
+        self.reconnects = 0
+        self.discarded = 0
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self.checkouts += 1
+            waited = False
+            while not self._idle and self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        'No database connection freed up within %s seconds.'
+                        % self.timeout)
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            idle = self._idle.pop() if self._idle else None
+        try:
+            if idle is not None:
+                conn, released_at = idle
+                if self._usable(conn, released_at):
+                    return conn
+                self._discard(conn)
+                with self._cond:
+                    self.reconnects += 1
+            conn = self.connect()
+        except BaseException:
+            self._give_back_slot()
+            raise
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self.created += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Return `conn` to the pool, or close it if `discard` is true, it has
+        outlived max_lifetime, or its transaction can't be rolled back.
+        """
+        if not discard and not self._expired(conn):
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        else:
+            discard = True
+        if discard:
+            self._discard(conn)
+            self._give_back_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._in_use -= 1
+            self._cond.notify()
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'reconnects': self.reconnects,
+                'discarded': self.discarded,
+            }
+
+    def _usable(self, conn, released_at):
+        if self._expired(conn):
+            return False
+        if self.health_check is None or \
+                time.monotonic() - released_at < self.check_after:
+            return True
+        try:
+            return self.health_check(conn) is not False
+        except Exception:
+            return False
+
+    def _expired(self, conn):
+        born = self._born.get(id(conn))
+        return born is None or time.monotonic() - born > self.max_lifetime
+
+    def _discard(self, conn):
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _give_back_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, **kwargs):
+    """
+    Return this process' pool for `key`, creating it with `kwargs` first.
+    """
+    key = (os.getpid(), key)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(**kwargs)
+    return pool
+
+
+def pool_stats():
+    """
+    Return the statistics of this process' pools, by pool key.
+    """
+    pid = os.getpid()
+    return {
+        '/'.join(str(part) for part in key[1]): pool.stats()
+        for key, pool in list(_pools.items()) if key[0] == pid
+    }
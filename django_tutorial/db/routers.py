@@ -0,0 +1,60 @@
+import random
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Per request under both WSGI and ASGI: asgiref's Local follows a request
+# from its async code into the threads its ORM calls run in.
+_state = Local()
+
+
+def pin_to_primary(pinned=True):
+    """
+    Send the reads of the current request or thread to the primary database.
+    """
+    _state.pinned = pinned
+    _state.wrote = False
+
+
+def wrote_to_primary():
+    """
+    Return True if the current request or thread wrote to the primary since
+    it was last pinned or unpinned.
+    """
+    return getattr(_state, 'wrote', False)
+
+
+class ReplicaRouter:
+    """
+    Read the polls models from the databases listed in
+    ``settings.DATABASE_REPLICAS`` and write them to the primary.
+
+    Reads go to the primary too once the thread wrote something, while it
+    is pinned (see PrimaryPinMiddleware) and inside transactions.
+    """
+    app_label = 'polls'
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if (model._meta.app_label != self.app_label or not replicas or
+                getattr(_state, 'pinned', False) or wrote_to_primary() or
+                connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = [DEFAULT_DB_ALIAS] + list(
+                getattr(settings, 'DATABASE_REPLICAS', []))
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in getattr(settings, 'DATABASE_REPLICAS', []):
+            return False
+        return None
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -49,6 +49,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'django_tutorial.db.middleware.PrimaryPinMiddleware',
+    'polls.middleware.PollsPageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'django_tutorial.urls'
@@ -75,14 +77,30 @@ WSGI_APPLICATION = 'django_tutorial.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+# The MySQL backend of django_tutorial.db keeps a pool of connections per
+# worker process, see django_tutorial/db/pool.py. DB_POOL_SIZE=0 turns the
+# pool off; CONN_MAX_AGE then keeps each thread's connection open. With the
+# pool on, CONN_MAX_AGE defaults to 0 so connections go back to the pool
+# after each request: a thread keeping one between requests holds a slot of
+# the pool, and past DB_POOL_SIZE such threads the others wait for one.
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'django_tutorial.db.backends.mysql',
         'NAME': config('DB_NAME'),
         'USER': config('DB_USER'),
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': '',
+        'CONN_MAX_AGE': config(
+            'DB_CONN_MAX_AGE', default=0 if DB_POOL_SIZE else 60, cast=int),
+        'POOL': {
+            'SIZE': DB_POOL_SIZE,
+            'MAX_LIFETIME': config('DB_POOL_MAX_LIFETIME', default=1800, cast=int),
+            'TIMEOUT': config('DB_POOL_TIMEOUT', default=10, cast=int),
+            'CHECK_AFTER': config('DB_POOL_CHECK_AFTER', default=30, cast=int),
+        },
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
         }
@@ -91,6 +109,39 @@ DATABASES = {
 
 
 
+# Read replicas of the default database, as DB_REPLICA_HOSTS=host1,host2.
+# The polls models are read from them, see django_tutorial/db/routers.py.
+DATABASE_REPLICAS = []
+for number, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), 1):
+    alias = 'replica%d' % number
+    DATABASES[alias] = dict(
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['django_tutorial.db.routers.ReplicaRouter']
+
+# After a write, a client reads from the primary for this many seconds.
+DATABASE_PRIMARY_PIN_SECONDS = config('DB_PRIMARY_PIN_SECONDS', default=5, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The polls caches hold the results versions and the invalidations of the
+# cached results and pages, which every worker process must see: a shared
+# cache (Redis, or Memcached with CACHE_BACKEND and CACHE_LOCATION) is
+# required. A per-process cache would keep serving other processes' stale
+# results.
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND', default='django.core.cache.backends.redis.RedisCache'),
+        'LOCATION': config('CACHE_LOCATION', default='redis://127.0.0.1:6379/0'),
+        'KEY_PREFIX': 'django_tutorial',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -119,8 +170,6 @@ TIME_ZONE = 'America/Sao_Paulo'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = True
 
 
@@ -128,3 +177,92 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
+# Polls
+
+# How a vote picks the counter shard of a sharded question: 'random', or
+# 'worker' to keep every worker thread on its own shard.
+POLLS_VOTE_SHARD_PICK = config('POLLS_VOTE_SHARD_PICK', default='random')
+
+# 'direct' writes every vote to the database as it comes in, 'buffered'
+# collects them in memory and writes them in batches from a background
+# thread, 'log' only inserts them in the vote log for rollup_votes to count.
+POLLS_VOTE_MODE = config('POLLS_VOTE_MODE', default='direct')
+
+# A buffered vote reaches the database after at most this many
+# milliseconds, or as soon as this many votes are waiting.
+POLLS_VOTE_BUFFER_INTERVAL = config('POLLS_VOTE_BUFFER_INTERVAL', default=200, cast=int)
+POLLS_VOTE_BUFFER_MAX_VOTES = config('POLLS_VOTE_BUFFER_MAX_VOTES', default=1000, cast=int)
+# Upper bound, in milliseconds, on how far the results can lag behind.
+POLLS_VOTE_BUFFER_MAX_LAG = config('POLLS_VOTE_BUFFER_MAX_LAG', default=1000, cast=int)
+
+# Logged votes younger than this many seconds are left for the next rollup.
+POLLS_VOTE_LOG_SETTLE = config('POLLS_VOTE_LOG_SETTLE', default=5, cast=int)
+
+# Serve cached poll results for up to this many seconds after new votes
+# came in, instead of recomputing them on every vote. 0 turns it off.
+POLLS_RESULTS_MAX_STALENESS = config('POLLS_RESULTS_MAX_STALENESS', default=0, cast=int)
+
+# Cached poll results are recomputed at least this often, votes or not, in
+# case an invalidation got lost.
+POLLS_RESULTS_CACHE_TTL = config('POLLS_RESULTS_CACHE_TTL', default=3600, cast=int)
+
+# Likewise for the front page snapshot.
+POLLS_INDEX_CACHE_TTL = config('POLLS_INDEX_CACHE_TTL', default=3600, cast=int)
+
+# Serve the polls pages with polls.async_views. On by default under ASGI,
+# see django_tutorial/asgi.py.
+POLLS_ASYNC_VIEWS = config('POLLS_ASYNC_VIEWS', default=False, cast=bool)
+
+# Live results streams send the votes cast at most every this many
+# milliseconds, a keepalive after this many idle seconds, and a full
+# snapshot of the counts every this many seconds.
+POLLS_LIVE_RESULTS_TICK = config('POLLS_LIVE_RESULTS_TICK', default=500, cast=int)
+POLLS_LIVE_RESULTS_HEARTBEAT = config('POLLS_LIVE_RESULTS_HEARTBEAT', default=15, cast=int)
+POLLS_LIVE_RESULTS_RESYNC = config('POLLS_LIVE_RESULTS_RESYNC', default=60, cast=int)
+
+# The most questions a live results WebSocket can subscribe to.
+POLLS_LIVE_RESULTS_MAX_QUESTIONS = config('POLLS_LIVE_RESULTS_MAX_QUESTIONS', default=100, cast=int)
+
+# Tokens accepted by the bulk vote ingestion endpoint, the most records it
+# takes per request, and the most votes a record can carry.
+POLLS_INGEST_TOKENS = config('POLLS_INGEST_TOKENS', default='', cast=Csv())
+POLLS_INGEST_MAX_RECORDS = config('POLLS_INGEST_MAX_RECORDS', default=10000, cast=int)
+POLLS_INGEST_MAX_COUNT = config('POLLS_INGEST_MAX_COUNT', default=1000, cast=int)
+
+# Rendered polls pages stay cached for at most this many seconds, and results
+# pages of polls that got votes for at least this many.
+POLLS_PAGE_CACHE_TTL = config('POLLS_PAGE_CACHE_TTL', default=300, cast=int)
+POLLS_PAGE_CACHE_RESULTS_TTL = config('POLLS_PAGE_CACHE_RESULTS_TTL', default=5, cast=int)
+
+# How eagerly cached values with a lifetime are recomputed before they
+# expire: 0 never, 1 by default, higher earlier.
+POLLS_CACHE_EARLY_EXPIRY_BETA = config('POLLS_CACHE_EARLY_EXPIRY_BETA', default=1.0, cast=float)
+
+# The autocomplete index is loaded from this snapshot file if it exists
+# (see manage.py autocomplete_snapshot), or built from the newest this many
+# questions, and never holds more, and catches up with the edits of other
+# processes every this many seconds.
+POLLS_AUTOCOMPLETE_SNAPSHOT = config('POLLS_AUTOCOMPLETE_SNAPSHOT', default='')
+POLLS_AUTOCOMPLETE_MAX_QUESTIONS = config('POLLS_AUTOCOMPLETE_MAX_QUESTIONS', default=1000000, cast=int)
+POLLS_AUTOCOMPLETE_REFRESH = config('POLLS_AUTOCOMPLETE_REFRESH', default=60, cast=int)
+
+# Trending questions are ranked by their votes, each counting half as much
+# every this many seconds. Processes keep the top this many in memory, and
+# share their votes through the database every this many seconds.
+POLLS_TRENDING_HALF_LIFE = config('POLLS_TRENDING_HALF_LIFE', default=3600, cast=int)
+POLLS_TRENDING_SIZE = config('POLLS_TRENDING_SIZE', default=100, cast=int)
+POLLS_TRENDING_CHECKPOINT = config('POLLS_TRENDING_CHECKPOINT', default=10, cast=int)
+
+# Vote counts per minute are written every this many seconds, folded into
+# hourly counts after this many hours, and those dropped after this many
+# days (0 keeps them); see manage.py compact_vote_history.
+POLLS_VOTE_HISTORY_FLUSH = config('POLLS_VOTE_HISTORY_FLUSH', default=10, cast=int)
+POLLS_VOTE_HISTORY_MINUTES = config('POLLS_VOTE_HISTORY_MINUTES', default=48, cast=int)
+POLLS_VOTE_HISTORY_DAYS = config('POLLS_VOTE_HISTORY_DAYS', default=365, cast=int)
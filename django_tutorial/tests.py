@@ -0,0 +1,294 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+from unittest import mock
+
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from polls.models import Question
+from polls.websocket import LocalWebSocket
+
+from .asgi import application
+from .db.checks import check_pool_settings
+from .db.middleware import PIN_COOKIE, PrimaryPinMiddleware
+from .db.pool import ConnectionPool, PoolTimeout
+from .db.routers import ReplicaRouter, pin_to_primary
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, **kwargs):
+        pool = ConnectionPool(
+            lambda: sqlite3.connect(':memory:', check_same_thread=False),
+            **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_connections_are_reused(self):
+        """
+        A released connection is handed out again instead of a new one.
+        """
+        pool = self.make_pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        stats = pool.stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['in_use'], 1)
+
+    def test_size_limit_waits(self):
+        """
+        When every connection is in use, acquire() waits for one to be
+        released, and gives up after the timeout.
+        """
+        pool = self.make_pool(size=1, timeout=0.05)
+        conn = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        threading.Timer(0.01, pool.release, (conn,)).start()
+        pool.timeout = 5
+        self.assertIs(pool.acquire(), conn)
+        stats = pool.stats()
+        self.assertEqual(stats['waits'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+
+    def test_max_lifetime(self):
+        """
+        Connections older than max_lifetime are replaced.
+        """
+        pool = self.make_pool(max_lifetime=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIsNot(pool.acquire(), conn)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+    def test_failed_health_check_reconnects(self):
+        """
+        An idle connection that fails its health check is replaced.
+        """
+        pool = self.make_pool(check_after=0, health_check=lambda conn: False)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIsNot(pool.acquire(), conn)
+        self.assertEqual(pool.stats()['reconnects'], 1)
+
+    def test_discard(self):
+        """
+        A connection released with discard=True is closed, not pooled.
+        """
+        pool = self.make_pool()
+        conn = pool.acquire()
+        pool.release(conn, discard=True)
+        stats = pool.stats()
+        self.assertEqual((stats['idle'], stats['in_use']), (0, 0))
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+
+
+class PooledBackendTests(SimpleTestCase):
+    def setUp(self):
+        fd, self.name = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, self.name)
+
+    def make_connections(self, size, name=None):
+        # A handler of its own, apart from the test database connections.
+        connections = ConnectionHandler({'default': {
+            'ENGINE': 'django_tutorial.db.backends.sqlite3',
+            'NAME': name or self.name,
+            'POOL': {'SIZE': size},
+        }})
+        self.addCleanup(connections.close_all)
+        return connections
+
+    def test_closed_connections_go_back_to_the_pool(self):
+        """
+        Closing a Django connection returns it to the pool, and the next
+        connection of any thread reuses it.
+        """
+        connections = self.make_connections(2)
+        connection = connections['default']
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        raw = connection.connection
+        connection.close()
+        self.assertEqual(connection.pool.stats()['idle'], 1)
+
+        used = []
+
+        def query():
+            other = connections['default']
+            with other.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            used.append(other.connection)
+            other.close()
+
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+        self.assertEqual(used, [raw])
+        stats = connection.pool.stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['created'], 1)
+
+    def test_pool_can_be_turned_off(self):
+        """
+        With a pool size of 0 connections are opened and closed as usual.
+        """
+        connection = self.make_connections(0)['default']
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertIsNone(connection.pool)
+        connection.close()
+
+    def test_in_memory_databases_are_not_pooled(self):
+        """
+        In-memory SQLite connections are never closed, so never released.
+        """
+        connection = self.make_connections(1, name=':memory:')['default']
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertIsNone(connection.pool)
+
+
+class PoolSettingsCheckTests(SimpleTestCase):
+    def databases_settings(self, **options):
+        return {'default': dict({
+            'ENGINE': 'django_tutorial.db.backends.mysql',
+            'POOL': {'SIZE': 10},
+            'CONN_MAX_AGE': 0,
+        }, **options)}
+
+    def test_persistent_pooled_connections(self):
+        """
+        Pooled connections kept between requests are warned about.
+        """
+        with self.settings(DATABASES=self.databases_settings(CONN_MAX_AGE=60)):
+            self.assertEqual(
+                [warning.id for warning in check_pool_settings(None)],
+                ['django_tutorial.W001'])
+        with self.settings(DATABASES=self.databases_settings()):
+            self.assertEqual(check_pool_settings(None), [])
+        with self.settings(DATABASES=self.databases_settings(
+                CONN_MAX_AGE=60, POOL={'SIZE': 0})):
+            self.assertEqual(check_pool_settings(None), [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        pin_to_primary(False)
+        self.addCleanup(pin_to_primary, False)
+
+    def test_reads_go_to_replicas(self):
+        self.assertIn(
+            self.router.db_for_read(Question), ['replica1', 'replica2'])
+
+    def test_other_apps_read_from_primary(self):
+        self.assertEqual(self.router.db_for_read(Session), 'default')
+
+    def test_writes_go_to_primary(self):
+        """
+        Writes go to the primary, and so do the thread's reads afterwards.
+        """
+        self.assertEqual(self.router.db_for_write(Question), 'default')
+        self.assertEqual(self.router.db_for_read(Question), 'default')
+
+    def test_pinned_reads_go_to_primary(self):
+        pin_to_primary()
+        self.assertEqual(self.router.db_for_read(Question), 'default')
+
+    def test_no_replicas(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(Question), 'default')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertIs(self.router.allow_migrate('replica1', 'polls'), False)
+        self.assertIsNone(self.router.allow_migrate('default', 'polls'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class PrimaryPinTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def read_db(self, request):
+        """
+        Run `request` through the middleware, returning the response and
+        the database its view reads polls from.
+        """
+        used = []
+
+        def view(request):
+            used.append(self.router.db_for_read(Question))
+            return HttpResponse()
+        response = PrimaryPinMiddleware(view)(request)
+        return response, used[0]
+
+    def test_write_pins_the_client(self):
+        """
+        A request that writes sets the pin cookie, and the client's next
+        requests read from the primary.
+        """
+        def view(request):
+            self.router.db_for_write(Question)
+            return HttpResponse()
+        response = PrimaryPinMiddleware(view)(self.factory.post('/'))
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        response, db = self.read_db(request)
+        self.assertEqual(db, 'default')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_unpinned_client_reads_replicas(self):
+        _, db = self.read_db(self.factory.get('/'))
+        self.assertEqual(db, 'replica1')
+
+    def test_reads_in_transactions_go_to_primary(self):
+        def view(request):
+            with transaction.atomic():
+                used.append(self.router.db_for_read(Question))
+            return HttpResponse()
+        used = []
+        PrimaryPinMiddleware(view)(self.factory.get('/'))
+        self.assertEqual(used, ['default'])
+
+
+class ASGIApplicationTests(SimpleTestCase):
+    def test_websocket_routing(self):
+        async def connect(path):
+            socket = LocalWebSocket(application, path)
+            accepted = await socket.connect()
+            if accepted:
+                await socket.close()
+            return accepted
+        self.assertTrue(asyncio.run(connect('/polls/ws/results/')))
+        self.assertFalse(asyncio.run(connect('/polls/ws/other/')))
+
+    def test_lifespan_loads_the_autocomplete_index(self):
+        async def lifespan():
+            messages = asyncio.Queue()
+            for event in ('startup', 'shutdown'):
+                messages.put_nowait({'type': 'lifespan.%s' % event})
+            sent = []
+
+            async def send(message):
+                sent.append(message['type'])
+            await application({'type': 'lifespan'}, messages.get, send)
+            return sent
+        with mock.patch('polls.autocomplete.warm_up') as warm_up:
+            sent = asyncio.run(lifespan())
+        warm_up.assert_called_once_with()
+        self.assertEqual(
+            sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
@@ -2,6 +2,7 @@
 WSGI config for django_tutorial project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+The autocomplete index starts loading as soon as it's imported.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
@@ -14,3 +15,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_tutorial.settings')
 
 application = get_wsgi_application()
+
+from polls import autocomplete  # noqa: E402 (needs the app registry)
+
+autocomplete.warm_up()
@@ -1,11 +1,17 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import SEARCH_VAR
 
 from .models import Question, Choice
+from .search import search_questions
 
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 3
+    readonly_fields = ['total_votes']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
 
 
 class QuestionAdmin(admin.ModelAdmin):
@@ -15,8 +21,27 @@ class QuestionAdmin(admin.ModelAdmin):
     fieldsets = [
         ('Date information', {'fields': ['pub_date'], 'classes': ['collapse']}),
         ('Question', {'fields': ['question_text']}),
+        ('Vote counting', {'fields': ['vote_shards'], 'classes': ['collapse']}),
     ]
     inlines = [ChoiceInline]
 
+    def get_ordering(self, request):
+        """
+        Newest first, the order of the (-pub_date, -id) index, except for
+        search results, which keep their relevance order.
+        """
+        if request.GET.get(SEARCH_VAR):
+            return []
+        return ['-pub_date', '-id']
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search the question texts through the search index rather than
+        with LIKE '%term%' scans.
+        """
+        if not search_term:
+            return queryset, False
+        return search_questions(search_term, queryset), False
+
 
 admin.site.register(Question, QuestionAdmin)
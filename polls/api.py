@@ -0,0 +1,268 @@
+"""
+JSON endpoints for the polls, under /polls/api/.
+
+The read-only ones read plain dicts with .values() and the results cache
+rather than model instances, and answer conditional requests with 304 Not
+Modified.
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare, md5
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .autocomplete import suggest
+from .cache import get_many_results, get_results
+from .history import oldest_history, vote_history
+from .models import Choice, Question
+from .search import search_questions, tokenize
+from .services import ingest_votes
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_BATCH_RESULTS = 200
+MAX_SEARCH_RESULTS = 50
+MAX_SUGGESTIONS = 20
+HISTORY_POINTS = 120
+MAX_HISTORY_POINTS = 1000
+
+
+@require_GET
+def question_list(request):
+    """
+    List the published questions, newest first, `limit` at a time from
+    `offset`. 'next' links to the following page, if any.
+    """
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        return json_error('limit and offset must be integers.')
+    if not 0 < limit <= MAX_PAGE_SIZE or offset < 0:
+        return json_error(
+            'limit must be between 1 and %d, offset positive.' % MAX_PAGE_SIZE)
+    questions = list(Question.objects.visible().order_by(
+            '-pub_date', '-pk').values(
+            'id', 'question_text', 'pub_date')[offset:offset + limit + 1])
+    next_url = None
+    if len(questions) > limit:
+        questions.pop()
+        next_url = '%s?%s' % (request.path, urlencode({
+            'limit': limit, 'offset': offset + limit}))
+    return json_response(request, {'results': questions, 'next': next_url})
+
+
+@require_GET
+def question_detail(request, pk):
+    """
+    A published question with its choices.
+    """
+    question = Question.objects.visible().filter(pk=pk).values(
+            'id', 'question_text', 'pub_date').first()
+    if question is None:
+        return json_error('Question not found.', status=404)
+    question['choices'] = list(Choice.objects.filter(
+            question_id=pk).order_by('pk').values('id', 'choice_text'))
+    question['results'] = reverse('polls:api_results', args=(pk,))
+    return json_response(request, question)
+
+
+@require_GET
+def question_results(request, pk):
+    """
+    The vote totals of a published question, from the results cache.
+    """
+    results = get_results(pk)
+    if results is None:
+        return json_error('Question not found.', status=404)
+    # The results version changes whenever the totals may have, so the
+    # ETag is known without serializing anything.
+    etag = '"r%s-%s"' % (pk, results['version'])
+    return json_response(request, results_data(results), etag=etag)
+
+
+@require_GET
+def question_history(request, pk):
+    """
+    The votes of each choice of a published question over time, between
+    `since` and `until` (ISO 8601, the last day by default), in at most
+    `points` counts per choice.
+    """
+    if not Question.objects.visible().filter(pk=pk).exists():
+        return json_error('Question not found.', status=404)
+    try:
+        until = _parse_time(request.GET.get('until')) or timezone.now()
+        since = _parse_time(request.GET.get('since'))
+        points = int(request.GET.get('points', HISTORY_POINTS))
+    except ValueError:
+        return json_error('since and until must be ISO 8601 times, '
+                          'points an integer.')
+    # Nothing older is kept, and far-off times would overflow.
+    oldest = oldest_history()
+    until = max(until, oldest)
+    since = max(since or until - datetime.timedelta(days=1), oldest)
+    if since >= until or not 0 < points <= MAX_HISTORY_POINTS:
+        return json_error('since must be before until, and points between '
+                          '1 and %d.' % MAX_HISTORY_POINTS)
+    history = vote_history(pk, since, until, points)
+    history['counts'] = [
+        {'id': choice_id, 'counts': counts}
+        for choice_id, counts in sorted(history['counts'].items())]
+    return json_response(request, history)
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+@require_GET
+def results_batch(request):
+    """
+    The vote totals of up to MAX_BATCH_RESULTS published questions, given
+    as comma-separated `ids`. Ids of questions that aren't published are
+    listed under 'missing'.
+    """
+    try:
+        question_ids = list(dict.fromkeys(
+            int(pk) for pk in request.GET.get('ids', '').split(',') if pk))
+    except ValueError:
+        return json_error('ids must be comma-separated integers.')
+    if not 0 < len(question_ids) <= MAX_BATCH_RESULTS:
+        return json_error(
+            'Between 1 and %d ids are needed.' % MAX_BATCH_RESULTS)
+    results = get_many_results(question_ids)
+    etag = '"b%s"' % md5(','.join(
+        '%s-%s' % (pk, results[pk]['version']) if pk in results else str(pk)
+        for pk in question_ids).encode()).hexdigest()
+    return json_response(request, {
+        'results': [results_data(results[pk])
+                    for pk in question_ids if pk in results],
+        'missing': [pk for pk in question_ids if pk not in results],
+    }, etag=etag)
+
+
+@require_GET
+def question_search(request):
+    """
+    The published questions matching the words of `q`, most relevant
+    first, at most `limit` of them.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+    except ValueError:
+        return json_error('limit must be an integer.')
+    if not query or not 0 < limit <= MAX_SEARCH_RESULTS:
+        return json_error(
+            'q is needed, and limit between 1 and %d.' % MAX_SEARCH_RESULTS)
+    if not tokenize(query):
+        # Nothing in q is indexed, such as one-letter words: no match.
+        return json_response(request, {'results': []})
+    questions = search_questions(query, Question.objects.visible()).values(
+            'id', 'question_text', 'pub_date', 'rank')[:limit]
+    return json_response(request, {'results': list(questions)})
+
+
+@require_GET
+def question_autocomplete(request):
+    """
+    Up to `limit` published questions matching `q` as typed so far, the
+    newest first.
+    """
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        return json_error('limit must be an integer.')
+    if not 0 < limit <= MAX_SUGGESTIONS:
+        return json_error('limit must be between 1 and %d.' % MAX_SUGGESTIONS)
+    return json_response(
+        request, {'results': suggest(request.GET.get('q', ''), limit)})
+
+
+@csrf_exempt
+@require_POST
+def vote_batch(request):
+    """
+    Add the votes collected offline, posted as
+    ``{"votes": [[question_id, choice_id, count], ...]}`` with an
+    ``Authorization: Token <token>`` header naming one of
+    ``POLLS_INGEST_TOKENS``. Valid records are added in one transaction
+    and the others reported under 'errors' by their index.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme != 'Token' or not any(
+            constant_time_compare(token, allowed)
+            for allowed in settings.POLLS_INGEST_TOKENS):
+        return json_error('A valid ingestion token is needed.', status=401)
+    try:
+        records = json.loads(request.body)['votes']
+    except (ValueError, KeyError, TypeError):
+        return json_error('Expected {"votes": [[question_id, choice_id, count], ...]}.')
+    if not isinstance(records, list):
+        return json_error('votes must be a list.')
+    limit = settings.POLLS_INGEST_MAX_RECORDS
+    if len(records) > limit:
+        return json_error('At most %d records per request.' % limit)
+    votes, errors = ingest_votes(records)
+    return HttpResponse(json.dumps({
+        'votes': votes,
+        'records': len(records) - len(errors),
+        'errors': [{'index': index, 'error': message}
+                   for index, message in errors],
+    }, separators=(',', ':')), content_type='application/json')
+
+
+def results_data(results):
+    """
+    Return the public part of a results cache entry.
+    """
+    question = results['question']
+    return {
+        'id': question['id'],
+        'question_text': question['question_text'],
+        'choices': [{
+            'id': choice['id'],
+            'choice_text': choice['choice_text'],
+            'votes': choice['votes'],
+        } for choice in results['choices']],
+    }
+
+
+def json_response(request, data, etag=None):
+    """
+    Return `data` as compact JSON, or a 304 response if the client already
+    has it. Without an `etag`, the ETag is a hash of the body.
+    """
+    body = None
+    if etag is None:
+        body = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+        etag = '"%s"' % md5(body.encode()).hexdigest()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if body is None:
+            body = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+def json_error(message, status=400):
+    return HttpResponse(
+        json.dumps({'error': message}), status=status,
+        content_type='application/json')
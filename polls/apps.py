@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class PollsConfig(AppConfig):
     name = 'polls'
+
+    def ready(self):
+        from django_tutorial.db import checks  # noqa: F401
+
+        from . import signals  # noqa: F401
@@ -0,0 +1,194 @@
+"""
+Async versions of the polls views, for ASGI deployments.
+
+They serve the same templates as polls.views; the database and cache
+work runs in worker threads through sync_to_async, so a slow query
+doesn't hold up the event loop.
+"""
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse)
+from django.shortcuts import get_object_or_404, render
+from django.db.models import prefetch_related_objects
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views import View
+
+from .cache import get_latest_questions, get_results
+from .changefeed import results_feed
+from .models import Choice, Question, choices_in_order
+from .services import record_vote
+from .views import (
+    archive_page, cached_results, detail_etag, results_etag,
+    trending_questions, visible_question)
+
+
+class IndexView(View):
+    async def get(self, request):
+        """
+        Show the last five published questions.
+        """
+        questions = await sync_to_async(get_latest_questions)()
+        return render(request, 'polls/index.html', {
+            'latest_question_list': [Question(**q) for q in questions],
+        })
+
+
+class ArchiveView(View):
+    async def get(self, request):
+        """
+        Show a page of the published questions, newest first.
+        """
+        context = await sync_to_async(archive_page)(request)
+        return render(request, 'polls/archive.html', context)
+
+
+class TrendingView(View):
+    async def get(self, request):
+        """
+        Show the published questions getting the most votes lately.
+        """
+        questions = await sync_to_async(trending_questions)()
+        return render(request, 'polls/trending.html', {
+            'question_list': questions,
+        })
+
+
+class DetailView(View):
+    async def get(self, request, pk):
+        """
+        Show a published question and its choices, unless the client's copy
+        is still current.
+        """
+        validators = await sync_to_async(check_validators)(
+                request, pk, detail_etag)
+        if validators['response'] is not None:
+            return set_validators(validators['response'], validators)
+        question = await sync_to_async(visible_question)(request, pk)
+        if question is None:
+            raise Http404('No question found matching the query')
+        await sync_to_async(prefetch_related_objects)(
+                [question], choices_in_order())
+        return set_validators(
+            render(request, 'polls/detail.html', {'question': question}),
+            validators)
+
+
+class ResultsView(View):
+    async def get(self, request, pk):
+        """
+        Show the vote totals of a published question, from the results
+        cache, unless the client's copy is still current.
+        """
+        validators = await sync_to_async(check_validators)(
+                request, pk, results_etag)
+        if validators['response'] is not None:
+            return set_validators(validators['response'], validators)
+        results = await sync_to_async(cached_results)(request, pk)
+        if results is None:
+            raise Http404('No question found matching the query')
+        return set_validators(render(request, 'polls/results.html', {
+            'question': Question(**results['question']),
+            'choices': results['choices'],
+        }), validators)
+
+
+def check_validators(request, pk, etag_func):
+    """
+    Compute a page's ETag like the condition() decorator of the sync
+    views, and the 304 response to send instead of the page if the
+    client's copy is current.
+    """
+    etag = etag_func(request, pk)
+    etag = quote_etag(etag) if etag is not None else None
+    response = None
+    if request.method in ('GET', 'HEAD'):
+        response = get_conditional_response(request, etag=etag)
+    return {'etag': etag, 'response': response}
+
+
+def set_validators(response, validators):
+    if validators['etag'] is not None:
+        response.headers.setdefault('ETag', validators['etag'])
+    return response
+
+
+async def vote(request, question_id):
+    try:
+        await sync_to_async(record_vote)(
+                question_id, request.POST['choice'],
+                voter_key=request.session.session_key or '')
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        # Redisplay the question voting form.
+        question = await sync_to_async(get_object_or_404)(
+                Question.objects.with_choices(), pk=question_id)
+        return render(request, 'polls/detail.html', {
+            'question': question,
+            'error_message': "You didn't select a choice.",
+        })
+    return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
+
+
+async def results_stream(request, pk):
+    """
+    Stream the vote counts of a published question as Server-Sent Events.
+
+    A 'snapshot' event carries every choice's total, then 'delta' events
+    carry the votes cast since the previous event, at most once per
+    POLLS_LIVE_RESULTS_TICK. A fresh snapshot is sent every
+    POLLS_LIVE_RESULTS_RESYNC seconds to catch up with votes recorded by
+    other processes. Only available under ASGI.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(
+            'Live results need the ASGI deployment.', status=501,
+            content_type='text/plain')
+    results = await sync_to_async(get_results)(pk)
+    if results is None:
+        raise Http404('No question found matching the query')
+    response = StreamingHttpResponse(
+            result_events(pk, results), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def result_events(pk, results):
+    """
+    Generate the Server-Sent Events of results_stream(), starting from the
+    already loaded `results`.
+    """
+    subscription = results_feed.subscribe([pk])
+    try:
+        yield _event('snapshot', _totals(results))
+        synced = time.monotonic()
+        while True:
+            timeout = settings.POLLS_LIVE_RESULTS_HEARTBEAT
+            batch = await subscription.get(timeout)
+            if time.monotonic() - synced >= settings.POLLS_LIVE_RESULTS_RESYNC:
+                results = await sync_to_async(get_results)(pk)
+                if results is None:
+                    return
+                yield _event('snapshot', _totals(results))
+                synced = time.monotonic()
+            elif batch:
+                yield _event('delta', batch[pk])
+            else:
+                yield ': keepalive\n\n'
+    finally:
+        subscription.close()
+
+
+def _totals(results):
+    return {choice['id']: choice['votes'] for choice in results['choices']}
+
+
+def _event(name, data):
+    return 'event: %s\ndata: %s\n\n' % (
+        name, json.dumps(data, separators=(',', ':')))
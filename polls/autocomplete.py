@@ -0,0 +1,525 @@
+"""
+Search-as-you-type suggestions over the question texts.
+
+Each process keeps a PrefixIndex in memory: the sorted list of the words
+of the question texts, and for each word the sorted array of the ids of
+the questions using it. A query's complete words are looked up exactly,
+its last, partial word by bisecting the word list for the words it
+starts. Matching ids come out newest question first. The index also
+keeps the text, publication date and number of choices of each question,
+so suggestions are served without a database query.
+
+The index is loaded at startup (see warm_up(), called by the WSGI and
+ASGI applications), or else on first use, from the POLLS_AUTOCOMPLETE_SNAPSHOT
+file, if there is one (see `manage.py autocomplete_snapshot`), or built
+from the newest POLLS_AUTOCOMPLETE_MAX_QUESTIONS questions, and keeps to
+that many, dropping the oldest as new ones come in. The Question
+and Choice signals keep it up to date with the edits of its own process,
+and every POLLS_AUTOCOMPLETE_REFRESH seconds it catches up with those of
+others, which it may lag behind until then.
+"""
+import base64
+import bisect
+import datetime
+import heapq
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Question
+from .search import MAX_TOKEN_LENGTH, MIN_TOKEN_LENGTH, tokenize, words
+
+SNAPSHOT_FORMAT = 'polls-autocomplete'
+SNAPSHOT_VERSION = 3
+# The Question fields kept by the index.
+FIELDS = ('pk', 'question_text', 'pub_date', 'choice_count')
+# The most words a partial word is expanded to, the most ids looked at
+# and gathered per lookup, which bound the time a lookup takes.
+MAX_EXPANSIONS = 32
+MAX_SCANNED = 20000
+MAX_GATHERED = 4096
+CHUNK_SIZE = 256
+
+_PARTIAL = re.compile(r'\w$')
+
+logger = logging.getLogger(__name__)
+
+
+def parse_query(query):
+    """
+    Split `query` into the set of its complete words and its last word if
+    it's still being typed, '' otherwise.
+    """
+    query_words = words(query)
+    prefix = query_words.pop() if _PARTIAL.search(query) else ''
+    complete = {word[:MAX_TOKEN_LENGTH] for word in query_words
+                if len(word) >= MIN_TOKEN_LENGTH}
+    return complete, prefix[:MAX_TOKEN_LENGTH]
+
+
+def _contains(ids, pk):
+    i = bisect.bisect_left(ids, pk)
+    return i < len(ids) and ids[i] == pk
+
+
+def _matching(pks, ids, first, last):
+    """
+    Return the ids of the set `pks`, all between `first` and `last`, that
+    are also in the sorted `ids`.
+    """
+    lo = bisect.bisect_left(ids, first)
+    hi = bisect.bisect_right(ids, last, lo)
+    if hi - lo > 8 * len(pks):
+        # Looking each id up is cheaper than going through the range.
+        return {pk for pk in pks
+                if bisect.bisect_left(ids, pk, lo, hi) < hi and
+                ids[bisect.bisect_left(ids, pk, lo, hi)] == pk}
+    return pks.intersection(ids[lo:hi])
+
+
+def _intersect(driver, all_of, any_of, before, limit):
+    """
+    Return up to `limit` of the ids of the sorted `driver` below `before`
+    that are also in each of `all_of` and in one of `any_of`, if any,
+    highest first. `driver` is walked down a chunk at a time, matching
+    each chunk against the ids of the others in its range.
+    """
+    found = []
+    hi = bisect.bisect_left(driver, before)
+    stop = max(0, hi - MAX_SCANNED)
+    while hi > stop and len(found) < limit:
+        lo = max(stop, hi - CHUNK_SIZE)
+        chunk = driver[lo:hi]
+        hits = set(chunk)
+        for ids in all_of:
+            hits = _matching(hits, ids, chunk[0], chunk[-1])
+        if any_of:
+            pending, hits = hits, set()
+            for ids in any_of:
+                if not pending:
+                    break
+                matched = _matching(pending, ids, chunk[0], chunk[-1])
+                hits |= matched
+                pending -= matched
+        found.extend(sorted(hits, reverse=True)[:limit - len(found)])
+        hi = lo
+    return found
+
+
+def _descending(ids, before):
+    for i in range(bisect.bisect_left(ids, before) - 1, -1, -1):
+        yield ids[i]
+
+
+class PrefixIndex:
+    """
+    An in-memory index of question ids by the words of their texts, for
+    prefix lookups.
+    """
+
+    def __init__(self, max_questions=None):
+        self._tokens = []
+        self._postings = {}
+        # The (text, pub_date timestamp, choice_count) of each question,
+        # and their sorted ids.
+        self._questions = {}
+        self._ids = array('I')
+        # Past this many questions, the oldest are dropped.
+        self.max_questions = max_questions
+        self._lock = threading.Lock()
+        # The highest question id seen, and when the index last caught up.
+        self.last_pk = 0
+        self.synced_at = None
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def add(self, pk, text, pub_date=None, choice_count=None):
+        """
+        Index the question `pk` under the words of `text`, instead of the
+        ones it was indexed under before. `pub_date` and `choice_count` are
+        kept as they were if not given.
+        """
+        with self._lock:
+            previous = self._questions.get(pk)
+            if previous is not None:
+                self._unindex(pk, previous[0])
+            elif self._is_full() and pk < self._ids[0]:
+                # Older than every question the index has room for.
+                return
+            elif not self._ids or self._ids[-1] < pk:
+                self._ids.append(pk)
+            else:
+                self._ids.insert(bisect.bisect_left(self._ids, pk), pk)
+            published = choices = None
+            if previous is not None:
+                _, published, choices = previous
+            if pub_date is not None:
+                published = pub_date.timestamp()
+            if choice_count is not None:
+                choices = choice_count
+            self._questions[pk] = (text, published, choices or 0)
+            for token in tokenize(text):
+                ids = self._postings.get(token)
+                if ids is None:
+                    bisect.insort(self._tokens, token)
+                    self._postings[token] = array('I', [pk])
+                elif not ids or ids[-1] < pk:
+                    ids.append(pk)
+                elif not _contains(ids, pk):
+                    ids.insert(bisect.bisect_left(ids, pk), pk)
+            self.last_pk = max(self.last_pk, pk)
+            self._evict()
+
+    def remove(self, pk):
+        """
+        Unindex the question `pk`.
+        """
+        with self._lock:
+            question = self._questions.pop(pk, None)
+            if question is not None:
+                self._unindex(pk, question[0])
+                del self._ids[bisect.bisect_left(self._ids, pk)]
+
+    def _is_full(self):
+        return (self.max_questions is not None and
+                len(self._ids) >= self.max_questions)
+
+    def _evict(self):
+        # Drop the oldest questions past max_questions.
+        if self.max_questions is None:
+            return
+        excess = len(self._ids) - self.max_questions
+        if excess <= 0:
+            return
+        for pk in self._ids[:excess]:
+            self._unindex(pk, self._questions.pop(pk)[0])
+        del self._ids[:excess]
+
+    def _unindex(self, pk, text):
+        for token in tokenize(text):
+            ids = self._postings.get(token)
+            if ids is None or not _contains(ids, pk):
+                continue
+            del ids[bisect.bisect_left(ids, pk)]
+            if not ids:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def count_choices(self, pk, choices):
+        """
+        Add `choices` to the number of choices of the question `pk`.
+        """
+        with self._lock:
+            question = self._questions.get(pk)
+            if question is not None:
+                text, published, count = question
+                self._questions[pk] = (text, published, max(0, count + choices))
+
+    def visible(self, pks, now=None):
+        """
+        Return a dict mapping the published questions with choices out of
+        `pks` to their text.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            questions = [(pk, self._questions.get(pk)) for pk in pks]
+        return {
+            pk: question[0] for pk, question in questions
+            if question is not None and question[1] is not None and
+            question[1] <= now and question[2] > 0}
+
+    def candidates(self, query, limit, before=None):
+        """
+        Return the ids of up to `limit` questions whose words include the
+        complete words of `query` and one starting with its last word, if
+        it's partial, newest first, and below `before` if given.
+        """
+        complete, prefix = parse_query(query)
+        if not complete and not prefix:
+            return []
+        if before is None:
+            before = self.last_pk + 1
+        with self._lock:
+            required = [self._postings.get(token) for token in complete]
+            if None in required:
+                return []
+            required.sort(key=len)
+            expansions = []
+            if prefix:
+                start = bisect.bisect_left(self._tokens, prefix)
+                expansions = [
+                    self._postings[token] for token in
+                    self._tokens[start:start + MAX_EXPANSIONS]
+                    if token.startswith(prefix)]
+                if not expansions:
+                    return []
+                # The commonest first, as they match the most questions.
+                expansions.sort(key=len, reverse=True)
+            if not required:
+                # Every id of the expansions matches.
+                found = []
+                for pk in heapq.merge(
+                        *(_descending(ids, before) for ids in expansions),
+                        reverse=True):
+                    if not found or pk != found[-1]:
+                        found.append(pk)
+                        if len(found) == limit:
+                            break
+                return found
+            # Walk the ids of the rarest complete word, checking the others,
+            # unless the partial word's expansions are rarer still, and few
+            # enough to gather up front.
+            if expansions and sum(map(len, expansions)) < min(
+                    len(required[0]), MAX_GATHERED):
+                driver = array('I', sorted(set().union(*expansions)))
+                expansions = []
+            else:
+                driver = required.pop(0)
+            return _intersect(driver, required, expansions, before, limit)
+
+    def catch_up(self):
+        """
+        Index the questions added or edited since the index last caught up,
+        and unindex the deleted ones.
+        """
+        now = timezone.now()
+        changed = Q(pk__gt=self.last_pk)
+        if self.synced_at is not None:
+            changed |= Q(updated_at__gte=self.synced_at)
+        for pk, *fields in Question.objects.filter(changed).values_list(
+                *FIELDS).iterator():
+            self.add(pk, *fields)
+        self._drop_deleted()
+        self.synced_at = now
+
+    def _drop_deleted(self):
+        # Deletions leave no trace to catch up from, but they change the
+        # number of questions in the range of the indexed ids.
+        with self._lock:
+            if not self._ids:
+                return
+            indexed = len(self._ids)
+            oldest = self._ids[0]
+        in_range = Question.objects.filter(pk__gte=oldest, pk__lte=self.last_pk)
+        if in_range.count() == indexed:
+            return
+        existing = set(in_range.values_list('pk', flat=True).iterator())
+        with self._lock:
+            deleted = [pk for pk in self._questions if pk not in existing]
+            missing = existing.difference(self._questions)
+        for pk in deleted:
+            self.remove(pk)
+        # Questions committed after the index caught up past their id.
+        for pk, *fields in in_range.filter(pk__in=missing).values_list(
+                *FIELDS).iterator():
+            self.add(pk, *fields)
+
+    @classmethod
+    def build(cls, max_questions):
+        """
+        Return an index of the newest `max_questions` questions, that
+        keeps to that many.
+        """
+        index = cls(max_questions)
+        index.synced_at = timezone.now()
+        postings = {}
+        questions = Question.objects.order_by('-pk').values_list(
+                *FIELDS)[:max_questions]
+        for pk, text, pub_date, choice_count in questions.iterator(chunk_size=10000):
+            index.last_pk = max(index.last_pk, pk)
+            index._questions[pk] = (text, pub_date.timestamp(), choice_count)
+            for token in tokenize(text):
+                postings.setdefault(token, []).append(pk)
+        index._postings = {
+            token: array('I', reversed(ids)) for token, ids in postings.items()}
+        index._tokens = sorted(index._postings)
+        index._ids = array('I', sorted(index._questions))
+        return index
+
+    def save(self, path):
+        """
+        Write the index to the snapshot file `path`, as JSON.
+        """
+        with self._lock:
+            state = {
+                'format': SNAPSHOT_FORMAT,
+                'version': SNAPSHOT_VERSION,
+                'itemsize': self._ids.itemsize,
+                'last_pk': self.last_pk,
+                'synced_at': self.synced_at and self.synced_at.isoformat(),
+                'questions': [[pk, *self._questions[pk]] for pk in self._ids],
+                'postings': {
+                    token: _encode_ids(ids)
+                    for token, ids in self._postings.items()},
+            }
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(
+                'w', encoding='utf-8', dir=directory, delete=False) as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path, max_questions=None):
+        """
+        Return the index of the snapshot file `path`, keeping to
+        `max_questions` questions if given, or None if it isn't one.
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+            if (state.get('format') != SNAPSHOT_FORMAT or
+                    state.get('version') != SNAPSHOT_VERSION or
+                    state.get('itemsize') != array('I').itemsize):
+                return None
+            index = cls(max_questions)
+            index._questions = {
+                int(pk): (str(text), published, int(choices))
+                for pk, text, published, choices in state['questions']}
+            index._postings = {
+                str(token): _decode_ids(ids)
+                for token, ids in state['postings'].items()}
+            index.last_pk = int(state['last_pk'])
+            if state['synced_at'] is not None:
+                index.synced_at = datetime.datetime.fromisoformat(
+                    state['synced_at'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        index._tokens = sorted(index._postings)
+        index._ids = array('I', sorted(index._questions))
+        index._evict()
+        return index
+
+
+def _encode_ids(ids):
+    # Little-endian whatever the platform, so snapshots can be shared.
+    if sys.byteorder == 'big':
+        ids = array(ids.typecode, ids)
+        ids.byteswap()
+    return base64.b64encode(ids.tobytes()).decode('ascii')
+
+
+def _decode_ids(encoded):
+    ids = array('I')
+    ids.frombytes(base64.b64decode(encoded, validate=True))
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+_index = None
+_index_lock = threading.Lock()
+_refreshed = None
+
+
+def get_index():
+    """
+    Return the autocomplete index of this process, loading or building it
+    on first use and catching it up every POLLS_AUTOCOMPLETE_REFRESH
+    seconds.
+    """
+    global _index, _refreshed
+    refresh = settings.POLLS_AUTOCOMPLETE_REFRESH
+    index = _index
+    if index is None or time.monotonic() - _refreshed > refresh:
+        with _index_lock:
+            index = _index
+            if index is None:
+                index = _load_or_build()
+                index.catch_up()
+                # Set before publishing the index, which other threads
+                # check without the lock.
+                _refreshed = time.monotonic()
+                _index = index
+            elif time.monotonic() - _refreshed > refresh:
+                index.catch_up()
+                _refreshed = time.monotonic()
+    return index
+
+
+def _load_or_build():
+    path = settings.POLLS_AUTOCOMPLETE_SNAPSHOT
+    if path and os.path.exists(path):
+        index = PrefixIndex.load(
+            path, settings.POLLS_AUTOCOMPLETE_MAX_QUESTIONS)
+        if index is not None:
+            return index
+    return PrefixIndex.build(settings.POLLS_AUTOCOMPLETE_MAX_QUESTIONS)
+
+
+def warm_up():
+    """
+    Load or build the autocomplete index of this process in a background
+    thread, at startup, rather than in the first lookup. Lookups made
+    before it's ready wait for it. Return the thread.
+    """
+    thread = threading.Thread(
+        target=_warm_up, name='autocomplete-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def _warm_up():
+    try:
+        get_index()
+    except Exception:
+        # The first lookup tries again.
+        logger.exception('Could not load the autocomplete index.')
+    finally:
+        connections.close_all()
+
+
+def loaded_index():
+    """
+    Return the autocomplete index of this process if it was loaded, None
+    otherwise.
+    """
+    return _index
+
+
+def reset_index():
+    """
+    Drop the autocomplete index of this process; the next lookup loads it
+    again.
+    """
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def suggest(query, limit):
+    """
+    Return up to `limit` published questions matching `query` as typed so
+    far, newest first, as dicts of their id and text.
+    """
+    index = get_index()
+    suggestions = []
+    before = None
+    now = time.time()
+    # Hidden questions are rare among the candidates, a few rounds are
+    # plenty.
+    for _ in range(3):
+        ids = index.candidates(query, limit, before)
+        if not ids:
+            break
+        texts = index.visible(ids, now)
+        for pk in ids:
+            if pk in texts:
+                suggestions.append({'id': pk, 'question_text': texts[pk]})
+                if len(suggestions) == limit:
+                    return suggestions
+        if len(ids) < limit:
+            break
+        before = ids[-1]
+    return suggestions
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaBuffer:
+    """
+    Accumulate counter deltas in memory and hand them in batches to `apply`.
+
+    `apply` is called with a dict mapping each key to the sum of its deltas.
+    A background thread flushes the buffer every `interval` seconds, as
+    soon as `max_pending` deltas have piled up, and the caller of add()
+    flushes it itself if the oldest pending delta is older than `max_lag`
+    seconds, so readers never lag further behind than that.
+    """
+
+    def __init__(self, apply, interval=0.2, max_pending=1000, max_lag=1.0):
+        self.apply = apply
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_lag = max_lag
+        self._pending = {}
+        self._pending_count = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flushed = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def add(self, key, delta=1):
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + delta
+            self._pending_count += abs(delta)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = self._pending_count >= self.max_pending
+            late = time.monotonic() - self._oldest > self.max_lag
+        self.start()
+        if late:
+            self.flush()
+        elif full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Apply every pending delta. Return the number of keys applied.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._pending_count = 0
+                self._oldest = None
+            if not batch:
+                return 0
+            started = time.monotonic()
+            try:
+                self.apply(batch)
+            except Exception:
+                self.failed_flushes += 1
+                logger.exception('Could not flush %d buffered keys', len(batch))
+                self._restore(batch)
+                return 0
+            elapsed = time.monotonic() - started
+            self.flushes += 1
+            self.flushed += sum(abs(delta) for delta in batch.values())
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            return len(batch)
+
+    def _restore(self, batch):
+        with self._lock:
+            for key, delta in batch.items():
+                self._pending[key] = self._pending.get(key, 0) + delta
+                self._pending_count += abs(delta)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(
+                        target=self._run, name='polls-delta-buffer', daemon=True)
+                self._thread.start()
+
+    def stop(self, flush=True):
+        """
+        Stop the background thread and flush whatever is still pending, or
+        drop it if `flush` is false.
+        """
+        self._stopping = True
+        if not flush:
+            with self._lock:
+                self._pending = {}
+                self._pending_count = 0
+                self._oldest = None
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self.flush():
+                close_old_connections()
+
+    def stats(self):
+        with self._lock:
+            depth = len(self._pending)
+            pending = self._pending_count
+            oldest = self._oldest
+        return {
+            'depth': depth,
+            'pending': pending,
+            'oldest_age_seconds':
+                time.monotonic() - oldest if oldest is not None else 0.0,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'flushed': self.flushed,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+        }
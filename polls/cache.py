@@ -0,0 +1,313 @@
+import math
+import time
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.utils import timezone
+
+from .models import Choice, Question
+from .singleflight import SingleFlight, expires_early
+
+RESULTS_KEY = 'polls:results:%s'
+RESULTS_VERSION_KEY = 'polls:results-version:%s'
+RESULTS_REFRESH_KEY = 'polls:results-refresh:%s'
+RESULTS_REFRESH_LEASE = 30
+INDEX_KEY = 'polls:index'
+VOTE_SHARDS_KEY = 'polls:vote-shards:%s'
+SURROGATE_KEY = 'polls:surrogate:%s'
+INDEX_SIZE = 5
+
+results_flight = SingleFlight()
+index_flight = SingleFlight()
+
+
+def get_latest_questions():
+    """
+    Return the last five published questions, as dicts of their fields.
+
+    They come from a snapshot of the front page that is rebuilt when a
+    question or choice is saved or deleted, as soon as the next
+    future-dated question gets published, and at least every
+    ``POLLS_INDEX_CACHE_TTL`` seconds.
+    """
+    snapshot = cache.get(INDEX_KEY)
+    if snapshot is None or (snapshot['valid_until'] is not None and
+                            snapshot['valid_until'] <= timezone.now()):
+        # Concurrent requests wait for a single rebuild.
+        snapshot = index_flight.do(INDEX_KEY, refresh_latest_questions)
+    return snapshot['questions']
+
+
+def refresh_latest_questions():
+    """
+    Rebuild and cache the front page snapshot, and return it. It's read
+    from the primary database: a snapshot built from a lagging replica
+    would be cached until the next edit.
+    """
+    now = timezone.now()
+    questions = list(Question.objects.using(DEFAULT_DB_ALIAS).visible(
+            now).order_by('-pub_date').values(
+            'id', 'question_text', 'pub_date')[:INDEX_SIZE])
+    valid_until = Question.objects.using(DEFAULT_DB_ALIAS).filter(
+            pub_date__gt=now, choice_count__gt=0).order_by(
+            'pub_date').values_list('pub_date', flat=True).first()
+    snapshot = {'questions': questions, 'valid_until': valid_until}
+    timeout = settings.POLLS_INDEX_CACHE_TTL
+    if valid_until is not None:
+        timeout = min(timeout, max(1, math.ceil((valid_until - now).total_seconds())))
+    cache.set(INDEX_KEY, snapshot, timeout)
+    return snapshot
+
+
+def latest_questions_valid_until():
+    """
+    Return when the front page snapshot stops being current: the pub_date
+    of the next question to be published, or None.
+    """
+    snapshot = cache.get(INDEX_KEY)
+    if snapshot is None:
+        snapshot = index_flight.do(INDEX_KEY, refresh_latest_questions)
+    return snapshot['valid_until']
+
+
+def invalidate_latest_questions():
+    """
+    Drop the front page snapshot, after a question or choice changed.
+    """
+    _after_write(cache.delete, INDEX_KEY)
+    purge_pages('polls-index')
+
+
+def get_results(question_id):
+    """
+    Return the results of the question `question_id` as a dict with the
+    question's fields under 'question' and its choices, with their vote
+    totals, under 'choices'. Return None if the question isn't visible.
+
+    Results are cached along with the question's results version, and
+    recomputed once the version moved on. With
+    ``POLLS_RESULTS_MAX_STALENESS`` set, cached results keep being served
+    for that many seconds after the version changed.
+    """
+    return get_many_results([question_id]).get(question_id)
+
+
+def get_many_results(question_ids):
+    """
+    Return a dict mapping the visible questions out of `question_ids` to
+    their results, as returned by get_results().
+
+    Cached results are read with a single multi-get; the others are
+    computed together, with one query for the questions and one for their
+    choices, and cached with a single multi-set.
+
+    Concurrent misses on a question wait for a single computation. Once
+    the cached results of a question are outdated, one request recomputes
+    them while the others keep getting the outdated ones; with
+    ``POLLS_RESULTS_MAX_STALENESS`` they're refreshed a little before
+    they grow too old, at random, so busy questions don't all expire at
+    the same moment.
+    """
+    cached = cache.get_many(
+            [RESULTS_KEY % question_id for question_id in question_ids] +
+            [RESULTS_VERSION_KEY % question_id for question_id in question_ids])
+    found = {}
+    missing = {}
+    refreshing = []
+    for question_id in question_ids:
+        entry = cached.get(RESULTS_KEY % question_id)
+        version = cached.get(RESULTS_VERSION_KEY % question_id)
+        if entry is not None and _is_fresh(entry, version):
+            found[question_id] = entry
+            continue
+        if version is None:
+            version = _init_version(question_id)
+        if entry is not None:
+            # Stale while revalidating: only the request that gets the
+            # refresh lease recomputes the results.
+            if (results_flight.in_flight(question_id) or
+                    not cache.add(RESULTS_REFRESH_KEY % question_id, True,
+                                  RESULTS_REFRESH_LEASE)):
+                found[question_id] = entry
+                continue
+            refreshing.append(question_id)
+        missing[question_id] = version
+    if missing:
+        try:
+            computed = results_flight.do_many(
+                    list(missing), lambda ids: _store_results(
+                        {question_id: missing[question_id] for question_id in ids}))
+        finally:
+            cache.delete_many([
+                RESULTS_REFRESH_KEY % question_id for question_id in refreshing])
+        found.update({
+            question_id: entry for question_id, entry in computed.items()
+            if entry is not None})
+    now = timezone.now()
+    return {
+        question_id: entry for question_id, entry in found.items()
+        if entry['question']['pub_date'] <= now and
+        entry['question']['choice_count']}
+
+
+def _is_fresh(entry, version):
+    if entry['version'] == version:
+        return True
+    max_staleness = getattr(settings, 'POLLS_RESULTS_MAX_STALENESS', 0)
+    return bool(max_staleness) and not expires_early(
+            entry['at'] + max_staleness, entry.get('cost', 0),
+            settings.POLLS_CACHE_EARLY_EXPIRY_BETA)
+
+
+def _store_results(versions):
+    started = time.monotonic()
+    computed = _compute_results(versions)
+    cost = time.monotonic() - started
+    for entry in computed.values():
+        entry['cost'] = cost
+    cache.set_many({
+        RESULTS_KEY % question_id: entry
+        for question_id, entry in computed.items()},
+        settings.POLLS_RESULTS_CACHE_TTL)
+    return computed
+
+
+def _compute_results(versions):
+    """
+    Compute the results of the questions in `versions`, a dict mapping
+    question ids to the results version to record. They're read from the
+    primary database, as the version recorded must not be newer than the
+    data.
+    """
+    questions = Question.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk__in=versions).values(
+            'id', 'question_text', 'pub_date', 'choice_count', 'updated_at')
+    choices = {}
+    # Sorted here rather than by the database, which would sort the
+    # grouped rows in a temporary table.
+    for choice in sorted(Choice.objects.using(DEFAULT_DB_ALIAS).with_totals().filter(
+            question_id__in=versions).order_by().values(
+            'question_id', 'id', 'choice_text', 'votes', 'shard_votes'),
+            key=itemgetter('id')):
+        choices.setdefault(choice['question_id'], []).append({
+            'id': choice['id'],
+            'choice_text': choice['choice_text'],
+            'votes': choice['votes'] + choice['shard_votes'],
+        })
+    at = time.time()
+    return {
+        question['id']: {
+            'version': versions[question['id']],
+            'at': at,
+            'question': question,
+            'choices': choices.get(question['id'], []),
+        } for question in questions}
+
+
+def results_version(question_id):
+    """
+    Return the current results version of the question `question_id`.
+    """
+    version = cache.get(RESULTS_VERSION_KEY % question_id)
+    if version is None:
+        version = _init_version(question_id)
+    return version
+
+
+def _init_version(question_id):
+    return _init_counter(RESULTS_VERSION_KEY % question_id)
+
+
+def _init_counter(key):
+    # Start from the clock rather than from 1, so a value lost with an
+    # evicted key is never handed out again for different data.
+    cache.add(key, int(time.time() * 1000000), None)
+    return cache.get(key)
+
+
+def bump_results_version(question_id):
+    """
+    Move the results of the question `question_id` to a new version.
+
+    Inside a transaction the version is bumped once more on commit, so
+    results computed from the data before the commit don't stay cached.
+    """
+    _after_write(_bump, question_id)
+
+
+def invalidate_results(question_id):
+    """
+    Drop the cached results of the question `question_id`, even in
+    ``POLLS_RESULTS_MAX_STALENESS`` mode. Used when a question or its
+    choices are edited rather than voted on.
+    """
+    _after_write(_drop, question_id)
+    purge_pages('polls-question-%s' % question_id)
+
+
+def get_vote_shards(question_id):
+    """
+    Return the `vote_shards` of the question `question_id`, 0 if it has
+    none or doesn't exist. It's cached until the question is saved or
+    deleted, so votes don't read the question row.
+    """
+    shards = cache.get(VOTE_SHARDS_KEY % question_id)
+    if shards is None:
+        shards = Question.objects.using(DEFAULT_DB_ALIAS).filter(
+                pk=question_id).values_list('vote_shards', flat=True).first() or 0
+        cache.add(VOTE_SHARDS_KEY % question_id, shards, None)
+    return shards
+
+
+def invalidate_vote_shards(question_id):
+    """
+    Drop the cached `vote_shards` of the question `question_id`.
+    """
+    _after_write(cache.delete, VOTE_SHARDS_KEY % question_id)
+
+
+def surrogate_generations(surrogate_keys):
+    """
+    Return a dict mapping each of `surrogate_keys` to its current
+    generation. A cached page tagged with the keys is valid as long as
+    their generations don't change.
+    """
+    cache_keys = {SURROGATE_KEY % key: key for key in surrogate_keys}
+    generations = {
+        cache_keys[cache_key]: generation
+        for cache_key, generation in cache.get_many(cache_keys).items()}
+    for key in surrogate_keys:
+        if key not in generations:
+            generations[key] = _init_counter(SURROGATE_KEY % key)
+    return generations
+
+
+def purge_pages(surrogate_key):
+    """
+    Invalidate every cached page tagged with `surrogate_key`.
+    """
+    _after_write(_bump_counter, SURROGATE_KEY % surrogate_key)
+
+
+def _after_write(func, *args):
+    func(*args)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: func(*args))
+
+
+def _bump(question_id):
+    _bump_counter(RESULTS_VERSION_KEY % question_id)
+
+
+def _bump_counter(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        _init_counter(key)
+
+
+def _drop(question_id):
+    cache.delete(RESULTS_KEY % question_id)
+    _bump(question_id)
@@ -0,0 +1,129 @@
+"""
+An in-process feed of vote count changes, for the live results streams.
+
+Votes are published from whatever thread records them. Every `tick`
+seconds the feed hands the deltas gathered since the last tick to the
+subscriptions of the questions they belong to, all in the event loop, so
+an idle subscriber costs a pending asyncio wait rather than a thread.
+The feed only sees the votes of its own process.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+
+
+class Subscription:
+    """
+    The deltas of a set of questions, as delivered to one subscriber.
+
+    Deltas that arrive while the subscriber is busy are merged into the
+    next batch, so a slow subscriber gets fewer, larger batches.
+    """
+
+    def __init__(self, feed, question_ids):
+        self.feed = feed
+        self.question_ids = set()
+        self._batch = {}
+        self._ready = asyncio.Event()
+        self.add(question_ids)
+
+    def add(self, question_ids):
+        for question_id in set(question_ids) - self.question_ids:
+            self.question_ids.add(question_id)
+            self.feed._subscribers.setdefault(question_id, set()).add(self)
+        self.feed._start_ticker()
+
+    def remove(self, question_ids):
+        for question_id in set(question_ids) & self.question_ids:
+            self.question_ids.discard(question_id)
+            self._batch.pop(question_id, None)
+            subscribers = self.feed._subscribers.get(question_id)
+            subscribers.discard(self)
+            if not subscribers:
+                del self.feed._subscribers[question_id]
+
+    def drop(self, question_ids):
+        """
+        Drop the deltas of `question_ids` not delivered yet.
+        """
+        for question_id in question_ids:
+            self._batch.pop(question_id, None)
+
+    def close(self):
+        self.remove(list(self.question_ids))
+
+    def push(self, question_id, deltas):
+        batch = self._batch.setdefault(question_id, {})
+        for choice_id, delta in deltas.items():
+            batch[choice_id] = batch.get(choice_id, 0) + delta
+        self._ready.set()
+
+    async def get(self, timeout=None):
+        """
+        Wait for the next batch of deltas, as a dict mapping question ids to
+        dicts of choice id to delta. Return an empty dict after `timeout`
+        seconds without any.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._ready.clear()
+        batch, self._batch = self._batch, {}
+        return batch
+
+
+class ChangeFeed:
+
+    def __init__(self, tick=None):
+        self.tick = tick
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._ticker = None
+
+    def publish(self, question_id, choice_id, delta=1):
+        """
+        Record that `delta` votes went to the choice `choice_id`. Safe to
+        call from any thread.
+        """
+        if question_id not in self._subscribers:
+            return
+        with self._lock:
+            deltas = self._pending.setdefault(question_id, {})
+            deltas[choice_id] = deltas.get(choice_id, 0) + delta
+
+    def subscribe(self, question_ids):
+        """
+        Return a Subscription to the questions `question_ids`. Must be
+        called from the event loop the subscriber runs in.
+        """
+        return Subscription(self, question_ids)
+
+    def flush(self):
+        """
+        Hand the pending deltas to the subscribers of their questions.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for question_id, deltas in pending.items():
+            for subscription in self._subscribers.get(question_id, ()):
+                subscription.push(question_id, deltas)
+
+    def _start_ticker(self):
+        loop = asyncio.get_running_loop()
+        if (self._ticker is None or self._ticker.done() or
+                self._ticker.get_loop() is not loop):
+            self._ticker = loop.create_task(self._run())
+
+    async def _run(self):
+        while self._subscribers:
+            await asyncio.sleep(self.tick or
+                                settings.POLLS_LIVE_RESULTS_TICK / 1000)
+            self.flush()
+        with self._lock:
+            self._pending = {}
+
+
+results_feed = ChangeFeed()
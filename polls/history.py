@@ -0,0 +1,209 @@
+"""
+The vote counts of the choices over time.
+
+Votes are counted in memory per choice and minute, and written every
+POLLS_VOTE_HISTORY_FLUSH seconds as VoteBucket rows, one per choice and
+minute, with a few grouped statements. `manage.py compact_vote_history`
+folds the minute buckets older than POLLS_VOTE_HISTORY_MINUTES hours into
+hour buckets, and drops the hour buckets older than
+POLLS_VOTE_HISTORY_DAYS days.
+"""
+import atexit
+import datetime
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from .buffer import DeltaBuffer
+from .models import Choice, VoteBucket
+
+MINUTE = 60
+HOUR = 3600
+# The widths, in seconds, history series are downsampled to.
+STEPS = (60, 300, 900, HOUR, 3 * HOUR, 6 * HOUR, 24 * HOUR, 7 * 24 * HOUR)
+# Buckets added per UPDATE statement.
+BATCH_SIZE = 500
+# Pending counts take room per choice and minute rather than per vote, so
+# flushing on the number of votes is only a safety net.
+MAX_PENDING_VOTES = 100000
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+_history_buffer = None
+_history_buffer_lock = threading.Lock()
+
+
+def record_history(question_id, choice_id, count=1, at=None):
+    """
+    Count `count` votes for the choice `choice_id` in the minute of `at`,
+    a time.time() timestamp, now by default.
+    """
+    at = time.time() if at is None else at
+    get_history_buffer().add(
+        (question_id, choice_id, int(at // MINUTE * MINUTE)), count)
+
+
+def get_history_buffer():
+    """
+    Return the vote history buffer of this process, creating it on first
+    use. Its thread flushes it every POLLS_VOTE_HISTORY_FLUSH seconds, and
+    one last time when the process exits.
+    """
+    global _history_buffer
+    if _history_buffer is None:
+        with _history_buffer_lock:
+            if _history_buffer is None:
+                flush = settings.POLLS_VOTE_HISTORY_FLUSH
+                _history_buffer = DeltaBuffer(
+                    apply_history_deltas,
+                    interval=flush,
+                    max_pending=MAX_PENDING_VOTES,
+                    # Voters only flush it if the thread falls behind.
+                    max_lag=2 * flush,
+                )
+                atexit.register(_history_buffer.stop)
+    return _history_buffer
+
+
+def reset_history_buffer():
+    """
+    Drop the vote history buffer of this process, and its pending counts.
+    """
+    global _history_buffer
+    with _history_buffer_lock:
+        if _history_buffer is not None:
+            atexit.unregister(_history_buffer.stop)
+            _history_buffer.stop(flush=False)
+        _history_buffer = None
+
+
+def apply_history_deltas(deltas):
+    """
+    Add ``deltas[question_id, choice_id, minute]`` votes to the minute
+    buckets, `minute` being a timestamp.
+    """
+    add_to_buckets(MINUTE, deltas)
+
+
+def add_to_buckets(resolution, deltas):
+    """
+    Add ``deltas[question_id, choice_id, start]`` votes to the buckets of
+    `resolution` seconds starting at `start`, a timestamp, creating the
+    missing ones. Deltas for choices that are gone are dropped.
+    """
+    with transaction.atomic():
+        owners = dict(Choice.objects.filter(
+                pk__in={choice_id for _, choice_id, _ in deltas}).values_list(
+                'pk', 'question_id'))
+        deltas = {
+            (choice_id, _to_datetime(start)): delta
+            for (question_id, choice_id, start), delta in deltas.items()
+            if delta and owners.get(choice_id) == question_id}
+        VoteBucket.objects.bulk_create([
+            VoteBucket(question_id=owners[choice_id], choice_id=choice_id,
+                       resolution=resolution, start=start, count=0)
+            for choice_id, start in deltas], ignore_conflicts=True)
+        deltas = list(deltas.items())
+        for i in range(0, len(deltas), BATCH_SIZE):
+            batch = deltas[i:i + BATCH_SIZE]
+            buckets = Q()
+            whens = []
+            for (choice_id, start), delta in batch:
+                buckets |= Q(choice_id=choice_id, start=start)
+                whens.append(When(choice_id=choice_id, start=start,
+                                  then=Value(delta)))
+            VoteBucket.objects.filter(buckets, resolution=resolution).update(
+                count=F('count') + Case(
+                    *whens, default=Value(0), output_field=IntegerField()))
+
+
+def compact_history(now=None):
+    """
+    Fold the minute buckets older than POLLS_VOTE_HISTORY_MINUTES hours
+    into hour buckets, and drop the hour buckets older than
+    POLLS_VOTE_HISTORY_DAYS days, if set. Return the numbers of minute
+    buckets folded and of hour buckets dropped.
+    """
+    now = time.time() if now is None else now
+    cutoff = _to_datetime(
+        (now - settings.POLLS_VOTE_HISTORY_MINUTES * HOUR) // HOUR * HOUR)
+    with transaction.atomic():
+        minutes = VoteBucket.objects.filter(resolution=MINUTE, start__lt=cutoff)
+        hours = {}
+        for question_id, choice_id, start, count in minutes.values_list(
+                'question_id', 'choice_id', 'start', 'count').iterator():
+            key = (question_id, choice_id,
+                   _to_timestamp(start) // HOUR * HOUR)
+            hours[key] = hours.get(key, 0) + count
+        add_to_buckets(HOUR, hours)
+        folded, _ = minutes.delete()
+    dropped = 0
+    if settings.POLLS_VOTE_HISTORY_DAYS:
+        dropped, _ = VoteBucket.objects.filter(
+            resolution=HOUR, start__lt=_to_datetime(
+                now - settings.POLLS_VOTE_HISTORY_DAYS * 24 * HOUR)).delete()
+    return folded, dropped
+
+
+def oldest_history():
+    """
+    Return the datetime before which no vote history is kept: hour buckets
+    are dropped after POLLS_VOTE_HISTORY_DAYS days, if set.
+    """
+    days = settings.POLLS_VOTE_HISTORY_DAYS
+    if not days:
+        return _EPOCH
+    return max(_EPOCH, datetime.datetime.now(datetime.timezone.utc) -
+               datetime.timedelta(days=days))
+
+
+def vote_history(question_id, since, until, points):
+    """
+    Return the votes of each choice of the question `question_id` between
+    the datetimes `since` and `until`, as a dict of its `start`, `step`
+    (in seconds) and `counts`, a dict mapping each choice id to the list
+    of its votes per step from `start`.
+
+    The step is the shortest of STEPS giving at most `points` counts, and
+    no shorter than the buckets covering the range: ranges reaching past
+    the minute buckets get hourly counts at least. Votes not flushed yet
+    are left out.
+    """
+    since, until = _to_timestamp(since), _to_timestamp(until)
+    oldest_minute = time.time() - settings.POLLS_VOTE_HISTORY_MINUTES * HOUR
+    shortest = MINUTE if since >= oldest_minute else HOUR
+    step = next(
+        (step for step in STEPS if step >= shortest and
+         math.ceil((until - since // step * step) / step) <= points),
+        None)
+    if step is None:
+        # A step longer than the range divided by points - 1 can't give more
+        # than points counts, wherever the range starts.
+        step = math.ceil(
+            (until - since) / max(1, points - 1) / STEPS[-1]) * STEPS[-1]
+    start = since // step * step
+    slots = math.ceil((until - start) / step)
+    counts = {
+        choice_id: [0] * slots for choice_id in Choice.objects.filter(
+            question_id=question_id).values_list('pk', flat=True)}
+    buckets = VoteBucket.objects.filter(
+            question_id=question_id, start__gte=_to_datetime(start),
+            start__lt=_to_datetime(until)).values_list(
+            'choice_id', 'start', 'count')
+    for choice_id, bucket_start, count in buckets:
+        if choice_id in counts:
+            slot = int(_to_timestamp(bucket_start) - start) // step
+            counts[choice_id][slot] += count
+    return {'start': _to_datetime(start), 'step': step, 'counts': counts}
+
+
+def _to_datetime(timestamp):
+    return _EPOCH + datetime.timedelta(seconds=timestamp)
+
+
+def _to_timestamp(value):
+    return int((value - _EPOCH).total_seconds())
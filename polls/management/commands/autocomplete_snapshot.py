@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.autocomplete import PrefixIndex
+
+
+class Command(BaseCommand):
+    help = ('Build the autocomplete index of the question texts and save it '
+            'to a snapshot file, for the processes to load at startup.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=settings.POLLS_AUTOCOMPLETE_SNAPSHOT,
+            help='Snapshot file to write, POLLS_AUTOCOMPLETE_SNAPSHOT by default.')
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError('No snapshot file given.')
+        index = PrefixIndex.build(settings.POLLS_AUTOCOMPLETE_MAX_QUESTIONS)
+        try:
+            index.save(options['path'])
+        except OSError as e:
+            raise CommandError(e)
+        self.stdout.write('Saved %d words, up to question %d.' % (
+            len(index), index.last_pk))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F
+
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Check that Question.choice_count matches the actual choices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Recount the choices of the questions that are off.')
+
+    def handle(self, *args, **options):
+        wrong = Question.objects.annotate(
+                actual=Count('choice')).exclude(choice_count=F('actual'))
+        wrong_ids = list(wrong.values_list('pk', flat=True))
+        if not wrong_ids:
+            self.stdout.write('All choice counts are correct.')
+            return
+        if not options['fix']:
+            raise CommandError('%d questions have a wrong choice count: %s' % (
+                len(wrong_ids), ', '.join(map(str, wrong_ids))))
+        Question.objects.filter(pk__in=wrong_ids).sync_choice_counts()
+        self.stdout.write('Fixed %d choice counts.' % len(wrong_ids))
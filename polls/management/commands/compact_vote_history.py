@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from polls.history import compact_history
+
+
+class Command(BaseCommand):
+    help = ('Fold the old per-minute vote counts into hourly ones, and drop '
+            'the hourly counts past their retention.')
+
+    def handle(self, *args, **options):
+        folded, dropped = compact_history()
+        self.stdout.write(
+            'Folded %d minute buckets, dropped %d hour buckets.' % (folded, dropped))
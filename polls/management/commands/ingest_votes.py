@@ -0,0 +1,57 @@
+import csv
+import itertools
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.services import ingest_votes
+
+
+def parse_row(row):
+    """
+    Return the integers of the CSV `row`, or the row as is if they aren't
+    all integers, for ingest_votes() to report.
+    """
+    try:
+        return [int(value) for value in row]
+    except ValueError:
+        return row
+
+
+class Command(BaseCommand):
+    help = ('Add the votes of a CSV file of question_id,choice_id,count '
+            'rows to the counts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file to read, or '-' for stdin.")
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of rows added per transaction.')
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            self.ingest(sys.stdin, options['batch_size'])
+            return
+        try:
+            with open(options['path'], newline='') as f:
+                self.ingest(f, options['batch_size'])
+        except OSError as e:
+            raise CommandError(e)
+
+    def ingest(self, f, batch_size):
+        rows = csv.reader(f)
+        votes = failed = line = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            added, errors = ingest_votes([parse_row(row) for row in batch])
+            votes += added
+            failed += len(errors)
+            for index, message in errors:
+                self.stderr.write('Line %d: %s' % (line + index + 1, message))
+            line += len(batch)
+        self.stdout.write('Added %d votes from %d rows, skipped %d rows.' % (
+            votes, line - failed, failed))
+        if failed:
+            raise CommandError('%d rows could not be ingested.' % failed)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Question
+from polls.search import index_questions, uses_fulltext
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the SearchToken index of the question texts, used for '
+            'searches where the database has no full-text index.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of questions indexed per batch.')
+
+    def handle(self, *args, **options):
+        if uses_fulltext():
+            self.stdout.write('The database indexes the question texts itself.')
+            return
+        chunk = []
+        indexed = 0
+        for question in Question.objects.only('question_text').iterator(
+                chunk_size=options['chunk_size']):
+            chunk.append(question)
+            if len(chunk) == options['chunk_size']:
+                index_questions(chunk)
+                indexed += len(chunk)
+                chunk = []
+        index_questions(chunk)
+        indexed += len(chunk)
+        self.stdout.write('Indexed %d questions.' % indexed)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.services import fold_vote_log, fold_vote_shards, rebuild_vote_counts
+
+
+class Command(BaseCommand):
+    help = ('Fold the votes waiting in the counter shards and in the vote '
+            'log into Choice.votes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Number of vote log rows folded per transaction.')
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Recompute every count from the whole vote log instead. '
+                 'Votes not in the log, recorded while POLLS_VOTE_MODE '
+                 "wasn't 'log', are lost, so this is refused in other "
+                 'modes unless --force is given.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Rebuild even though POLLS_VOTE_MODE isn't 'log'.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            try:
+                counted = rebuild_vote_counts(
+                    options['chunk_size'], force=options['force'])
+            except ValueError as e:
+                raise CommandError('%s Use --force to rebuild anyway.' % e)
+            self.stdout.write('Rebuilt the counts from %d logged votes.' % counted)
+            return
+        folded = fold_vote_shards()
+        self.stdout.write('Folded %d shard votes.' % folded)
+        folded = fold_vote_log(options['chunk_size'])
+        self.stdout.write('Folded %d logged votes.' % folded)
@@ -0,0 +1,135 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import md5
+from django.utils.deprecation import MiddlewareMixin
+
+from django_tutorial.db.middleware import PIN_COOKIE
+from django_tutorial.db.routers import pin_to_primary
+
+from .cache import (
+    RESULTS_VERSION_KEY, SURROGATE_KEY, latest_questions_valid_until,
+    results_version, surrogate_generations)
+from .singleflight import expires_early
+
+PAGE_KEY = 'polls:page:%s'
+
+
+class PollsPageCacheMiddleware(MiddlewareMixin):
+    """
+    Cache the rendered index, detail and results pages of the polls.
+
+    Pages are tagged with surrogate keys ('polls-index',
+    'polls-question-<id>'), sent along in a Surrogate-Key header for CDNs.
+    Saving or deleting a question or choice purges the pages tagged with
+    its keys, see polls.cache.purge_pages(). Pages and generations live in
+    the default cache, which must be shared by the worker processes for a
+    purge to reach them all.
+
+    The index expires when the next future-dated question gets published,
+    other pages after POLLS_PAGE_CACHE_TTL seconds. A results page is also
+    recomputed once its question got votes, though no more often than
+    every POLLS_PAGE_CACHE_RESULTS_TTL seconds, so the pages of busy polls
+    stay cached for short spells and quiet ones for long.
+
+    Detail pages embed a CSRF token, so they are cached per CSRF cookie,
+    and not at all for visitors without one. Visitors pinned to the
+    primary database after a vote always get fresh pages. Pages to be
+    cached are rendered from the primary, as one rendered from a lagging
+    replica would be stored with the current generations.
+    """
+
+    PAGES = {'index', 'detail', 'results'}
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if (request.method not in ('GET', 'HEAD') or
+                match.namespace != 'polls' or match.url_name not in self.PAGES or
+                PIN_COOKIE in request.COOKIES):
+            return None
+        csrf_cookie = ''
+        if match.url_name == 'detail':
+            csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+            if not csrf_cookie:
+                return None
+        pk = view_kwargs.get('pk')
+        surrogate_keys = (
+            ['polls-index'] if pk is None else ['polls-question-%s' % pk])
+        page_key = PAGE_KEY % md5(('%s:%s:%s' % (
+            request.get_host(), request.get_full_path(), csrf_cookie
+            )).encode()).hexdigest()
+        cache_keys = [page_key] + [SURROGATE_KEY % key for key in surrogate_keys]
+        if match.url_name == 'results':
+            cache_keys.append(RESULTS_VERSION_KEY % pk)
+        cached = cache.get_many(cache_keys)
+        generations = {
+            key: cached.get(SURROGATE_KEY % key) for key in surrogate_keys}
+        version = cached.get(RESULTS_VERSION_KEY % pk) if pk else None
+        entry = cached.get(page_key)
+        if entry is not None and self._is_fresh(entry, generations, version):
+            response = entry['response']
+            return get_conditional_response(
+                    request, etag=response.get('ETag'),
+                    response=response) or response
+        # Take the generations before rendering, so a page rendered while
+        # a purge goes through is stored as already stale.
+        if None in generations.values():
+            generations = surrogate_generations(surrogate_keys)
+        if match.url_name == 'results' and version is None:
+            version = results_version(pk)
+        request._polls_page = {
+            'key': page_key,
+            'page': match.url_name,
+            'surrogate_keys': surrogate_keys,
+            'generations': generations,
+            'version': version,
+            'started': time.monotonic(),
+        }
+        pin_to_primary()
+        return None
+
+    def _is_fresh(self, entry, generations, version):
+        if entry['generations'] != generations:
+            return False
+        if entry['expires'] is not None and entry['expires'] <= timezone.now():
+            return False
+        # Re-render pages a little before they expire, at random, so that
+        # a popular page isn't re-rendered by every request at once.
+        if expires_early(entry['at'] + entry['timeout'], entry['cost'],
+                         settings.POLLS_CACHE_EARLY_EXPIRY_BETA):
+            return False
+        return (entry['version'] == version or
+                time.time() - entry['at'] < settings.POLLS_PAGE_CACHE_RESULTS_TTL)
+
+    def process_response(self, request, response):
+        page = getattr(request, '_polls_page', None)
+        if page is None:
+            return response
+        response['Surrogate-Key'] = ' '.join(page['surrogate_keys'])
+        if (response.status_code != 200 or response.streaming or
+                response.cookies or 'private' in response.get('Cache-Control', '')):
+            return response
+        timeout = settings.POLLS_PAGE_CACHE_TTL
+        expires = None
+        if page['page'] == 'index':
+            # The index changes as soon as the next question is published.
+            expires = latest_questions_valid_until()
+            if expires is not None:
+                seconds = (expires - timezone.now()).total_seconds()
+                if seconds <= 0:
+                    return response
+                timeout = min(timeout, math.ceil(seconds))
+        cache.set(page['key'], {
+            'response': response,
+            'generations': page['generations'],
+            'version': page['version'],
+            'expires': expires,
+            'at': time.time(),
+            'timeout': timeout,
+            'cost': time.monotonic() - page['started'],
+        }, timeout)
+        return response
@@ -0,0 +1,31 @@
+# Generated by Django 2.1.2 on 2026-10-15 09:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='vote_shards',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Spread the votes of each choice over this many counter rows. Use it for very popular polls; 0 disables sharding.', verbose_name='vote counter shards'),
+        ),
+        migrations.CreateModel(
+            name='ChoiceVoteShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='polls.Choice')),
+            ],
+            options={
+                'unique_together': {('choice', 'shard')},
+            },
+        ),
+    ]
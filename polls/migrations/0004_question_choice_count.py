@@ -0,0 +1,33 @@
+# Generated by Django 2.1.2 on 2026-10-15 09:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_choices(apps, schema_editor):
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    choices = Choice.objects.filter(question=OuterRef('pk')).order_by(
+            ).values('question').annotate(n=Count('pk')).values('n')
+    Question.objects.update(choice_count=Coalesce(Subquery(choices), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_vote_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='choice_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_choices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['pub_date', 'choice_count'], name='polls_question_visible_idx'),
+        ),
+    ]
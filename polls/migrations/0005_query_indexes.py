@@ -0,0 +1,21 @@
+# Generated by Django 2.1.2 on 2026-10-15 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_question_choice_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='choice',
+            index=models.Index(fields=['question', 'id'], name='polls_choice_question_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-pub_date'], name='polls_question_pub_desc_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.16 on 2026-10-15 09:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='last edited'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-15 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_question_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-pub_date', '-id'], name='polls_question_archive_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='question',
+            name='polls_question_pub_desc_idx',
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.16 on 2026-10-15 09:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from polls.search import tokenize
+
+
+def build_search_index(apps, schema_editor):
+    """
+    Add a FULLTEXT index on MySQL, fill the SearchToken table elsewhere.
+    """
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX polls_question_text_ft '
+            'ON polls_question (question_text)')
+        return
+    Question = apps.get_model('polls', 'Question')
+    SearchToken = apps.get_model('polls', 'SearchToken')
+    db = schema_editor.connection.alias
+    tokens = []
+    for pk, text in Question.objects.using(db).values_list(
+            'pk', 'question_text').iterator():
+        tokens.extend(
+            SearchToken(token=token, question_id=pk) for token in tokenize(text))
+        if len(tokens) >= 10000:
+            SearchToken.objects.using(db).bulk_create(tokens)
+            tokens = []
+    SearchToken.objects.using(db).bulk_create(tokens)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'DROP INDEX polls_question_text_ft ON polls_question')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_archive_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+            options={
+                'unique_together': {('token', 'question')},
+            },
+        ),
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-15 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['updated_at'], name='polls_question_updated_idx'),
+        ),
+    ]
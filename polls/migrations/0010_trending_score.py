@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2026-10-15 09:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_question_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='polls.question')),
+                ('score', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score'], name='polls_trending_score_idx')],
+            },
+        ),
+    ]
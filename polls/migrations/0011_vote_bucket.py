@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-15 10:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_trending_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField()),
+                ('start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'start'], name='polls_votebucket_question_idx'), models.Index(fields=['resolution', 'start'], name='polls_votebucket_start_idx')],
+                'unique_together': {('choice', 'resolution', 'start')},
+            },
+        ),
+    ]
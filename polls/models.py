@@ -1,15 +1,81 @@
 import datetime
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+class QuestionQuerySet(models.QuerySet):
+    def visible(self, now=None):
+        """
+        Questions that are published (by `now`, if given) and have at least
+        one choice.
+        """
+        return self.filter(pub_date__lte=now or timezone.now(),
+                           choice_count__gt=0)
+
+    def with_choices(self):
+        """
+        Prefetch the choices of the questions, in order, in one query.
+        """
+        return self.prefetch_related(choices_in_order())
+
+    def sync_choice_counts(self):
+        """
+        Recount the choices of every question, for the write paths that
+        bypass the Choice signals (raw SQL, QuerySet.update()...).
+        """
+        choices = Choice.objects.filter(question=OuterRef('pk')).order_by(
+                ).values('question').annotate(n=Count('pk')).values('n')
+        return self.update(choice_count=Coalesce(Subquery(choices), 0))
+
+
+def choices_in_order():
+    """
+    The prefetch of a question's choices, by id; see also
+    django.db.models.prefetch_related_objects().
+    """
+    return models.Prefetch('choice_set', queryset=Choice.objects.order_by('pk'))
 
 
 class Question(models.Model):
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published')
+    vote_shards = models.PositiveSmallIntegerField(
+        'vote counter shards', default=0,
+        help_text='Spread the votes of each choice over this many counter '
+                  'rows. Use it for very popular polls; 0 disables sharding.')
+    # Maintained by the Choice signals, see polls.signals.
+    choice_count = models.PositiveIntegerField(default=0, editable=False)
+    # Also moved by the Choice signals, when the choices are edited.
+    updated_at = models.DateTimeField('last edited', auto_now=True)
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pub_date', 'choice_count'],
+                         name='polls_question_visible_idx'),
+            models.Index(fields=['-pub_date', '-id'],
+                         name='polls_question_archive_idx'),
+            # For polls.autocomplete to catch up with the edits.
+            models.Index(fields=['updated_at'],
+                         name='polls_question_updated_idx'),
+        ]
 
     def __str__(self):
         return self.question_text
 
+    def save(self, *args, **kwargs):
+        # Never write back a choice_count that may have gone stale while
+        # this instance was around, the signals keep the column right.
+        if not self._state.adding and not kwargs.get('force_insert') \
+                and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'choice_count']
+        super().save(*args, **kwargs)
+
     def was_published_recently(self):
         now = timezone.now()
         return now - datetime.timedelta(days=1) <= self.pub_date <= now
@@ -19,10 +85,163 @@ class Question(models.Model):
     was_published_recently.short_description = 'Published recently?'
 
 
+class ChoiceQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate each choice with the votes still held in its counter shards.
+        """
+        return self.annotate(shard_votes=Coalesce(Sum('shards__count'), 0))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        _choices_changed({obj.question_id for obj in objs})
+        return objs
+
+    def update(self, **kwargs):
+        if 'question' not in kwargs and 'question_id' not in kwargs:
+            return super().update(**kwargs)
+        target = kwargs.get('question', kwargs.get('question_id'))
+        with transaction.atomic(using=self.db):
+            moved = dict(self.values_list('pk', 'question_id'))
+            affected = set(moved.values())
+            updated = super().update(**kwargs)
+            if hasattr(target, 'resolve_expression'):
+                # An expression, as bulk_update() uses: the questions the
+                # choices moved to are only known once they're updated.
+                affected.update(self.model._base_manager.using(self.db).filter(
+                        pk__in=moved).values_list('question_id', flat=True))
+            else:
+                affected.add(getattr(target, 'pk', target))
+            _choices_changed(affected)
+        return updated
+
+
+def _choices_changed(question_ids):
+    from .cache import invalidate_latest_questions, invalidate_results
+
+    questions = Question.objects.filter(pk__in=question_ids)
+    questions.sync_choice_counts()
+    questions.update(updated_at=timezone.now())
+    invalidate_latest_questions()
+    for question_id in question_ids:
+        invalidate_results(question_id)
+
+
 class Choice(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
     votes = models.IntegerField(default=0)
 
+    objects = ChoiceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['question', 'id'],
+                         name='polls_choice_question_id_idx'),
+        ]
+
     def __str__(self):
         return self.choice_text
+
+    @property
+    def total_votes(self):
+        """
+        Votes already folded into `votes` plus the ones waiting in the shards.
+        """
+        shard_votes = getattr(self, 'shard_votes', None)
+        if shard_votes is None:
+            shard_votes = self.shards.aggregate(n=Sum('count'))['n'] or 0
+        return self.votes + shard_votes
+
+
+class ChoiceVoteShard(models.Model):
+    choice = models.ForeignKey(
+            Choice, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('choice', 'shard')
+
+    def __str__(self):
+        return '%s #%d' % (self.choice, self.shard)
+
+
+class Vote(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
+    voter_key = models.CharField(max_length=64, blank=True)
+
+    def __str__(self):
+        return '%s @ %s' % (self.choice, self.timestamp)
+
+
+class RollupState(models.Model):
+    """
+    How far a rollup job got through the log it folds, by log row id, or
+    in time, in seconds since the epoch.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '%s: %d' % (self.name, self.position)
+
+
+class SearchToken(models.Model):
+    """
+    A word of a question's text, for the search index used where the
+    database has no full-text index of its own; see polls.search.
+    """
+    token = models.CharField(max_length=64)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('token', 'question')
+
+    def __str__(self):
+        return self.token
+
+
+class TrendingScore(models.Model):
+    """
+    The vote count of a question, each vote decayed by its age; see
+    polls.trending.
+    """
+    question = models.OneToOneField(
+            Question, on_delete=models.CASCADE, primary_key=True)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='polls_trending_score_idx'),
+        ]
+
+    def __str__(self):
+        return '%s: %g' % (self.question, self.score)
+
+
+class VoteBucket(models.Model):
+    """
+    The votes a choice got in a minute or an hour; see polls.history.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    # The length of the bucket, in seconds.
+    resolution = models.PositiveIntegerField()
+    start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('choice', 'resolution', 'start')
+        indexes = [
+            models.Index(fields=['question', 'start'],
+                         name='polls_votebucket_question_idx'),
+            models.Index(fields=['resolution', 'start'],
+                         name='polls_votebucket_start_idx'),
+        ]
+
+    def __str__(self):
+        return '%s @ %s: %d' % (self.choice, self.start, self.count)
@@ -0,0 +1,102 @@
+"""
+Full-text search over the question texts.
+
+On MySQL, questions are found through the FULLTEXT index on
+question_text. Elsewhere they're found through SearchToken, an inverted
+index of the words of each question kept up to date by the Question
+signals. Either way a search costs index lookups for its words rather
+than a scan of every question, and results are ranked by relevance.
+"""
+import re
+import unicodedata
+
+from django.db import connections, router
+from django.db.models import Count, FloatField, Func
+
+from .models import Question, SearchToken
+
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 64
+
+_WORD = re.compile(r'\w+')
+
+
+def words(text):
+    """
+    Return the list of the words of `text`, lowercased and stripped of
+    accents.
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _WORD.findall(text)
+
+
+def tokenize(text):
+    """
+    Return the set of searchable words of `text`.
+    """
+    return {
+        word[:MAX_TOKEN_LENGTH] for word in words(text)
+        if len(word) >= MIN_TOKEN_LENGTH}
+
+
+def uses_fulltext(using=None):
+    """
+    Tell whether searches on the database `using` go through its own
+    full-text index rather than SearchToken.
+    """
+    return connections[using or router.db_for_read(Question)].vendor == 'mysql'
+
+
+class Match(Func):
+    """
+    MySQL's relevance of `expression` against a natural language `query`.
+    """
+    template = '%(function)s (%(expressions)s) AGAINST (%%s IN NATURAL LANGUAGE MODE)'
+    function = 'MATCH'
+    output_field = FloatField()
+
+    def __init__(self, expression, query):
+        super().__init__(expression)
+        self.query = query
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, **extra_context)
+        return sql, params + [self.query]
+
+
+def search_questions(query, queryset=None):
+    """
+    Return the questions of `queryset` (all of them by default) whose text
+    matches the words of `query`, annotated with their `rank` and ordered
+    by it, most relevant first, then newest first.
+    """
+    if queryset is None:
+        queryset = Question.objects.all()
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.none()
+    if uses_fulltext(queryset.db):
+        queryset = queryset.annotate(
+                rank=Match('question_text', ' '.join(sorted(tokens)))
+                ).filter(rank__gt=0)
+    else:
+        # Rank by the number of the query's words found in the question.
+        queryset = queryset.filter(searchtoken__token__in=tokens).annotate(
+                rank=Count('searchtoken'))
+    return queryset.order_by('-rank', '-pub_date', '-pk')
+
+
+def index_questions(questions):
+    """
+    Bring the SearchToken rows of `questions` up to date with their text.
+    Does nothing where the database indexes the texts itself.
+    """
+    questions = list(questions)
+    if not questions or uses_fulltext(router.db_for_write(Question)):
+        return
+    SearchToken.objects.filter(question__in=questions).delete()
+    SearchToken.objects.bulk_create([
+        SearchToken(token=token, question=question)
+        for question in questions
+        for token in tokenize(question.question_text)], batch_size=1000)
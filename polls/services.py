@@ -0,0 +1,322 @@
+import atexit
+import datetime
+import itertools
+import os
+import random
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Min, Value, When
+from django.utils import timezone
+
+from .buffer import DeltaBuffer
+from .cache import bump_results_version, get_vote_shards
+from .changefeed import results_feed
+from .history import record_history
+from .models import Choice, ChoiceVoteShard, Question, RollupState, Vote
+from .trending import get_trending
+
+VOTE_LOG = 'vote_log'
+
+_vote_buffer = None
+_vote_buffer_lock = threading.Lock()
+
+
+def record_vote(question_id, choice_id, voter_key=''):
+    """
+    Add one vote to the choice `choice_id` of the question `question_id`.
+
+    With ``POLLS_VOTE_MODE = 'buffered'`` the vote is only added to the
+    process' vote buffer, which writes it to the database a moment later.
+    With ``POLLS_VOTE_MODE = 'log'`` a Vote row is inserted and the rollup
+    job adds it to the counts later on; `voter_key` is kept with it.
+    Otherwise the increment is done by the database in a single
+    ``UPDATE ... SET votes = votes + 1`` statement, so concurrent voters
+    never overwrite each other's counts and the choice row is never read
+    beforehand. Questions with `vote_shards` set, as cached by
+    get_vote_shards(), increment one of the choice's counter shards
+    instead of the choice row itself.
+    Every vote recorded is published to the live results feed, and
+    counted in the trending scores and the vote history.
+    Raise Choice.DoesNotExist if the choice doesn't belong to the question.
+    """
+    _write_vote(question_id, choice_id, voter_key)
+    results_feed.publish(int(question_id), int(choice_id))
+    get_trending().record(int(question_id))
+    record_history(int(question_id), int(choice_id))
+
+
+def _write_vote(question_id, choice_id, voter_key):
+    mode = getattr(settings, 'POLLS_VOTE_MODE', 'direct')
+    if mode == 'buffered':
+        _check_choice(question_id, choice_id)
+        get_vote_buffer().add((int(question_id), int(choice_id)))
+        return
+    if mode == 'log':
+        _check_choice(question_id, choice_id)
+        Vote.objects.create(
+                question_id=question_id, choice_id=choice_id,
+                voter_key=voter_key)
+        return
+    shards = get_vote_shards(question_id)
+    if shards:
+        _record_sharded_vote(question_id, choice_id, pick_shard(shards))
+    elif not Choice.objects.filter(
+            pk=choice_id, question_id=question_id
+            ).update(votes=F('votes') + 1):
+        raise Choice.DoesNotExist
+    bump_results_version(question_id)
+
+
+def _check_choice(question_id, choice_id):
+    if not Choice.objects.filter(pk=choice_id, question_id=question_id).exists():
+        raise Choice.DoesNotExist
+
+
+def get_vote_buffer():
+    """
+    Return the vote buffer of this process, creating it on first use.
+
+    The buffer is flushed one last time when the process exits.
+    """
+    global _vote_buffer
+    if _vote_buffer is None:
+        with _vote_buffer_lock:
+            if _vote_buffer is None:
+                _vote_buffer = DeltaBuffer(
+                    apply_vote_deltas,
+                    interval=settings.POLLS_VOTE_BUFFER_INTERVAL / 1000,
+                    max_pending=settings.POLLS_VOTE_BUFFER_MAX_VOTES,
+                    max_lag=settings.POLLS_VOTE_BUFFER_MAX_LAG / 1000,
+                )
+                atexit.register(_vote_buffer.stop)
+    return _vote_buffer
+
+
+def apply_vote_deltas(deltas):
+    """
+    Add ``deltas[question_id, choice_id]`` votes to each choice in one
+    transaction.
+    """
+    with transaction.atomic():
+        add_to_field(Choice.objects.all(), 'votes', {
+            choice_id: delta for (_, choice_id), delta in deltas.items()})
+        for question_id in {question_id for question_id, _ in deltas}:
+            bump_results_version(question_id)
+
+
+def ingest_votes(records):
+    """
+    Add the votes of `records`, a list of (question_id, choice_id, count)
+    tuples, to the counts in one transaction.
+
+    Records must be lists or tuples of three integers, with counts of at
+    most ``POLLS_INGEST_MAX_COUNT``. Choices are checked to belong to their
+    question with a single query, and counts are added with grouped UPDATE
+    statements, or as Vote rows in log mode. Invalid records are skipped.
+    Return the number of votes added and a list of (index, message) tuples
+    for the records skipped.
+    """
+    max_count = settings.POLLS_INGEST_MAX_COUNT
+    errors = []
+    valid = []
+    for index, record in enumerate(records):
+        if not (isinstance(record, (list, tuple)) and len(record) == 3 and all(
+                isinstance(value, int) and not isinstance(value, bool)
+                for value in record)):
+            errors.append((index, 'Expected question_id, choice_id, count.'))
+            continue
+        question_id, choice_id, count = record
+        if not 0 < count <= max_count:
+            errors.append((index, 'count must be between 1 and %d.' % max_count))
+            continue
+        valid.append((index, question_id, choice_id, count))
+    owners = dict(Choice.objects.filter(
+            pk__in={choice_id for _, _, choice_id, _ in valid}).values_list(
+            'pk', 'question_id'))
+    deltas = {}
+    for index, question_id, choice_id, count in valid:
+        if owners.get(choice_id) != question_id:
+            errors.append((index, 'Choice %d is not a choice of question %d.' % (
+                choice_id, question_id)))
+            continue
+        key = (question_id, choice_id)
+        deltas[key] = deltas.get(key, 0) + count
+    if getattr(settings, 'POLLS_VOTE_MODE', 'direct') == 'log':
+        votes = (
+            Vote(question_id=question_id, choice_id=choice_id)
+            for (question_id, choice_id), count in deltas.items()
+            for _ in range(count))
+        with transaction.atomic():
+            # A batch at a time, rather than every Vote row at once.
+            for batch in iter(lambda: list(itertools.islice(votes, 1000)), []):
+                Vote.objects.bulk_create(batch)
+    else:
+        apply_vote_deltas(deltas)
+    for (question_id, choice_id), count in deltas.items():
+        results_feed.publish(question_id, choice_id, count)
+        get_trending().record(question_id, count)
+        record_history(question_id, choice_id, count)
+    errors.sort()
+    return sum(deltas.values()), errors
+
+
+def pick_shard(shards):
+    """
+    Return the counter shard, out of `shards`, a vote should go to.
+
+    With ``POLLS_VOTE_SHARD_PICK = 'worker'`` every thread of every process
+    sticks to its own shard, otherwise shards are picked at random.
+    """
+    if getattr(settings, 'POLLS_VOTE_SHARD_PICK', 'random') == 'worker':
+        return hash((os.getpid(), threading.get_ident())) % shards
+    return random.randrange(shards)
+
+
+def _record_sharded_vote(question_id, choice_id, shard):
+    shard_votes = ChoiceVoteShard.objects.filter(
+            choice_id=choice_id, shard=shard)
+    if shard_votes.filter(choice__question_id=question_id).update(
+            count=F('count') + 1):
+        return
+    # First vote on this shard: make sure the choice is valid, then
+    # create the counter row (or bump it if another voter just did).
+    _check_choice(question_id, choice_id)
+    try:
+        with transaction.atomic():
+            ChoiceVoteShard.objects.create(
+                    choice_id=choice_id, shard=shard, count=1)
+    except IntegrityError:
+        shard_votes.update(count=F('count') + 1)
+
+
+def add_to_field(queryset, field, deltas):
+    """
+    Add ``deltas[pk]`` to `field` of every row of `queryset` listed in
+    `deltas`, with a single grouped UPDATE statement.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    whens = [When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()]
+    return queryset.filter(pk__in=deltas).update(**{
+        field: F(field) + Case(*whens, default=Value(0),
+                               output_field=IntegerField()),
+    })
+
+
+def fold_vote_shards():
+    """
+    Move the votes held in the counter shards into `Choice.votes`.
+
+    Return the number of votes folded.
+    """
+    with transaction.atomic():
+        shards = list(ChoiceVoteShard.objects.select_for_update().filter(
+                count__gt=0).values_list(
+                'pk', 'choice__question_id', 'choice_id', 'count'))
+        per_choice = {}
+        for _, question_id, choice_id, count in shards:
+            key = (question_id, choice_id)
+            per_choice[key] = per_choice.get(key, 0) + count
+        apply_vote_deltas(per_choice)
+        add_to_field(ChoiceVoteShard.objects.all(), 'count',
+                     {pk: -count for pk, _, _, count in shards})
+    return sum(per_choice.values())
+
+
+def fold_vote_log(chunk_size=10000):
+    """
+    Add the votes logged since the last rollup to `Choice.votes`.
+
+    Votes are folded in chunks of `chunk_size` log rows, each in its own
+    transaction that also advances the rollup's high-water mark. The run
+    stops at the first vote younger than ``POLLS_VOTE_LOG_SETTLE``
+    seconds, so that rows whose transaction commits late aren't skipped;
+    as the high-water mark is a vote id, no vote past it is folded, even
+    an older one. Return the number of votes folded.
+    """
+    cutoff = timezone.now() - datetime.timedelta(
+            seconds=getattr(settings, 'POLLS_VOTE_LOG_SETTLE', 5))
+    folded = 0
+    position = RollupState.objects.filter(name=VOTE_LOG).values_list(
+            'position', flat=True).first() or 0
+    unsettled = Vote.objects.filter(
+            pk__gt=position, timestamp__gt=cutoff).aggregate(
+            first=Min('pk'))['first']
+    while True:
+        with transaction.atomic():
+            state = _lock_rollup_state(VOTE_LOG)
+            pending = Vote.objects.filter(pk__gt=state.position)
+            if unsettled is not None:
+                pending = pending.filter(pk__lt=unsettled)
+            upper = _chunk_end(pending, chunk_size)
+            if upper is None:
+                return folded
+            folded += _fold_votes(pending.filter(pk__lte=upper))
+            state.position = upper
+            state.save(update_fields=['position'])
+
+
+def rebuild_vote_counts(chunk_size=10000, force=False):
+    """
+    Recompute every `Choice.votes` from the vote log.
+
+    The log is read in chunks of `chunk_size` rows, aggregated by the
+    database, so it is never loaded into memory at once. Counter shards
+    are cleared, and the rollup's high-water mark is moved to the end of
+    the log. Only votes recorded in log mode are counted, so unless
+    `force` is set, raise ValueError when POLLS_VOTE_MODE isn't 'log':
+    the votes counted some other way would be lost.
+    Return the number of votes counted.
+    """
+    if not force and getattr(settings, 'POLLS_VOTE_MODE', 'direct') != 'log':
+        raise ValueError(
+            "Rebuilding the counts from the vote log drops the votes not "
+            "logged, and POLLS_VOTE_MODE isn't 'log'.")
+    counted = 0
+    with transaction.atomic():
+        state = _lock_rollup_state(VOTE_LOG)
+        Choice.objects.update(votes=0)
+        ChoiceVoteShard.objects.update(count=0)
+        position = 0
+        while True:
+            pending = Vote.objects.filter(pk__gt=position)
+            upper = _chunk_end(pending, chunk_size)
+            if upper is None:
+                break
+            counted += _fold_votes(pending.filter(pk__lte=upper))
+            position = upper
+        state.position = position
+        state.save(update_fields=['position'])
+        for question_id in Question.objects.values_list(
+                'pk', flat=True).iterator():
+            bump_results_version(question_id)
+    return counted
+
+
+def _lock_rollup_state(name):
+    RollupState.objects.get_or_create(name=name)
+    return RollupState.objects.select_for_update().get(name=name)
+
+
+def _chunk_end(votes, chunk_size):
+    """
+    Return the id of the last vote in the first chunk of `votes`.
+    """
+    last = votes.order_by('pk').values_list('pk', flat=True)[
+            chunk_size - 1:chunk_size].first()
+    if last is None:
+        last = votes.aggregate(last=Max('pk'))['last']
+    return last
+
+
+def _fold_votes(votes):
+    per_choice = {
+        (question_id, choice_id): n
+        for question_id, choice_id, n in votes.order_by().values(
+            'question', 'choice').annotate(n=Count('pk')).values_list(
+            'question', 'choice', 'n')}
+    apply_vote_deltas(per_choice)
+    return sum(per_choice.values())
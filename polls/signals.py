@@ -0,0 +1,91 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .autocomplete import loaded_index
+from .cache import (
+    invalidate_latest_questions, invalidate_results, invalidate_vote_shards)
+from .models import Choice, Question
+from .search import index_questions
+
+
+@receiver(pre_save, sender=Choice)
+def remember_choice_question(sender, instance, **kwargs):
+    """
+    Note which question a saved choice belonged to, in case it moves.
+    """
+    if instance.pk is None:
+        instance._previous_question_id = None
+    else:
+        instance._previous_question_id = Choice.objects.filter(
+                pk=instance.pk).values_list('question_id', flat=True).first()
+
+
+@receiver(post_save, sender=Choice)
+def count_saved_choice(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_question_id', None)
+    if created:
+        _touch(instance.question_id, choices=1)
+    elif previous is not None and previous != instance.question_id:
+        _touch(previous, choices=-1)
+        _touch(instance.question_id, choices=1)
+        invalidate_results(previous)
+    else:
+        _touch(instance.question_id)
+    if created or previous != instance.question_id:
+        invalidate_latest_questions()
+    invalidate_results(instance.question_id)
+
+
+@receiver(post_delete, sender=Choice)
+def count_deleted_choice(sender, instance, **kwargs):
+    _touch(instance.question_id, choices=-1)
+    invalidate_latest_questions()
+    invalidate_results(instance.question_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_latest_questions()
+        invalidate_results(instance.pk)
+        invalidate_vote_shards(instance.pk)
+
+
+@receiver(post_save, sender=Question)
+def index_saved_question(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and (update_fields is None or 'question_text' in update_fields):
+        index_questions([instance])
+
+
+@receiver(post_save, sender=Question)
+def autocomplete_saved_question(sender, instance, created=False, raw=False, **kwargs):
+    index = loaded_index()
+    if index is not None and not raw:
+        # The choice_count of an instance kept around may be stale, only
+        # a new one's is sure.
+        index.add(instance.pk, instance.question_text, instance.pub_date,
+                  instance.choice_count if created else None)
+
+
+@receiver(post_delete, sender=Question)
+def autocomplete_deleted_question(sender, instance, **kwargs):
+    index = loaded_index()
+    if index is not None:
+        index.remove(instance.pk)
+
+
+def _touch(question_id, choices=0):
+    """
+    Mark the question `question_id` as edited, adding `choices` to its
+    choice count.
+    """
+    Question.objects.filter(pk=question_id).update(
+            choice_count=F('choice_count') + choices, updated_at=timezone.now())
+    index = loaded_index()
+    if index is not None and choices:
+        index.count_choices(question_id, choices)
@@ -0,0 +1,83 @@
+import math
+import random
+import threading
+import time
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent computations of the same keys within a process.
+
+    The first thread to ask for a key computes it; threads asking for it
+    meanwhile wait and share the result, or the exception raised.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, func):
+        """
+        Return func(), computed once however many threads ask for `key`
+        at the same time.
+        """
+        return self.do_many([key], lambda keys: {key: func()})[key]
+
+    def do_many(self, keys, func):
+        """
+        Return a dict mapping each of `keys` to its value. `func` is called
+        with the list of keys no other thread is computing, and returns a
+        dict of their values (keys left out get None); the other keys are
+        waited for.
+        """
+        with self._lock:
+            mine = {key: Flight() for key in keys if key not in self._flights}
+            theirs = {key: self._flights[key]
+                      for key in keys if key not in mine}
+            self._flights.update(mine)
+        results = {}
+        if mine:
+            try:
+                results = func(list(mine))
+            except BaseException as e:
+                for flight in mine.values():
+                    flight.error = e
+                raise
+            else:
+                for key, flight in mine.items():
+                    flight.result = results.get(key)
+            finally:
+                with self._lock:
+                    for key in mine:
+                        del self._flights[key]
+                for flight in mine.values():
+                    flight.done.set()
+        # Only wait once our own flights landed, so two threads sharing
+        # keys never wait for each other.
+        for key, flight in theirs.items():
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            results[key] = flight.result
+        return {key: results.get(key) for key in keys}
+
+    def in_flight(self, key):
+        return key in self._flights
+
+
+def expires_early(expires_at, cost, beta=1.0):
+    """
+    Tell whether a cached value expiring at `expires_at` (a time.time()
+    timestamp) that took `cost` seconds to compute should be recomputed
+    already, so that one request refreshes it before all of them miss at
+    once. The closer to expiry and the costlier the value, the likelier.
+    See Vattani et al., "Optimal Probabilistic Cache Stampede Prevention".
+    """
+    return time.time() - cost * beta * math.log(1 - random.random()) >= expires_at
@@ -1,10 +1,57 @@
+import asyncio
 import datetime
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import sqlite3
+import time
+import threading
+import unittest
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import F
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, modify_settings,
+    override_settings, skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.html import escape
+from django.utils.http import http_date
+from django.urls import include, path, reverse
 
-from .models import Question
+from django_tutorial.db.routers import pin_to_primary
+
+from . import api, async_views, autocomplete, cache as polls_cache, services, views
+from .buffer import DeltaBuffer
+from .cache import (
+    get_latest_questions, get_results, refresh_latest_questions,
+    results_version)
+from .changefeed import ChangeFeed, results_feed
+from .history import (
+    HOUR, MINUTE, compact_history, get_history_buffer, record_history,
+    reset_history_buffer)
+from .models import (
+    Choice, Question, RollupState, SearchToken, TrendingScore, Vote,
+    VoteBucket)
+from .urls import polls_patterns
+from .search import search_questions, tokenize
+from .websocket import LocalWebSocket, results_socket, vote_totals
+from .singleflight import SingleFlight, expires_early
+from .trending import TrendingBoard, reset_trending
+from .services import (
+    fold_vote_log, fold_vote_shards, ingest_votes, rebuild_vote_counts,
+    record_vote)
 
 
 class QuestionModelTests(TestCase):
@@ -53,6 +100,9 @@ def create_question(question_text, days, choice=None):
 
 
 class QuestionIndexViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_no_questions_index(self):
         """
         If no questions exist, an appropriate message is displayed.
@@ -60,7 +110,7 @@ class QuestionIndexViewTests(TestCase):
         response = self.client.get(reverse('polls:index'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "No polls are available.")
-        self.assertQuerysetEqual(response.context['latest_question_list'], [])
+        self.assertQuerySetEqual(response.context['latest_question_list'], [])
 
     def test_past_question_index(self):
         """
@@ -70,9 +120,10 @@ class QuestionIndexViewTests(TestCase):
         create_question(
             question_text="Past question.", days=-30, choice='Choice One')
         response = self.client.get(reverse('polls:index'))
-        self.assertQuerysetEqual(
+        self.assertQuerySetEqual(
             response.context['latest_question_list'],
-            ['<Question: Past question.>']
+            ['<Question: Past question.>'],
+            transform=repr,
         )
 
     def test_future_question_index(self):
@@ -84,7 +135,7 @@ class QuestionIndexViewTests(TestCase):
             question_text="Future question.", days=30, choice='Choice One')
         response = self.client.get(reverse('polls:index'))
         self.assertContains(response, "No polls are available.")
-        self.assertQuerysetEqual(response.context['latest_question_list'], [])
+        self.assertQuerySetEqual(response.context['latest_question_list'], [])
 
     def test_future_question_and_past_question_index(self):
         """
@@ -96,9 +147,10 @@ class QuestionIndexViewTests(TestCase):
         create_question(
             question_text="Future question.", days=30, choice='Choice Two')
         response = self.client.get(reverse('polls:index'))
-        self.assertQuerysetEqual(
+        self.assertQuerySetEqual(
             response.context['latest_question_list'],
-            ['<Question: Past question.>']
+            ['<Question: Past question.>'],
+            transform=repr,
         )
 
     def test_two_past_questions_index(self):
@@ -110,9 +162,10 @@ class QuestionIndexViewTests(TestCase):
         create_question(
             question_text="Past question 2.", days=-5, choice='Choice Two')
         response = self.client.get(reverse('polls:index'))
-        self.assertQuerysetEqual(
+        self.assertQuerySetEqual(
             response.context['latest_question_list'],
-            ['<Question: Past question 2.>', '<Question: Past question 1.>']
+            ['<Question: Past question 2.>', '<Question: Past question 1.>'],
+            transform=repr,
         )
 
     def test_no_choices_index(self):
@@ -124,7 +177,7 @@ class QuestionIndexViewTests(TestCase):
         response = self.client.get(reverse('polls:index'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "No polls are available.")
-        self.assertQuerysetEqual(response.context['latest_question_list'], [])
+        self.assertQuerySetEqual(response.context['latest_question_list'], [])
 
     def test_one_choice_index(self):
         """
@@ -134,13 +187,17 @@ class QuestionIndexViewTests(TestCase):
         create_question(
             question_text="Question with one choice", days=-5, choice='Choice One')
         response = self.client.get(reverse('polls:index'))
-        self.assertQuerysetEqual(
+        self.assertQuerySetEqual(
             response.context['latest_question_list'],
-            ['<Question: Question with one choice>']
+            ['<Question: Question with one choice>'],
+            transform=repr,
         )
 
 
 class QuestionDetailViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_future_question_detail(self):
         """
         The detail view of a question with a pub_date in the future
@@ -186,6 +243,9 @@ class QuestionDetailViewTests(TestCase):
         )
 
 class QuestionResultsViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_future_question_results(self):
         """
         The result view of a question with a pub_date in the future
@@ -230,3 +290,2104 @@ class QuestionResultsViewTests(TestCase):
             response.context['question'],
             one_choice
         )
+
+
+class VoteViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_vote_increments_choice(self):
+        """
+        Voting for a choice adds one vote to it and redirects to the
+        results page.
+        """
+        question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        choice = question.choice_set.get()
+        response = self.client.post(
+            reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertRedirects(
+            response, reverse('polls:results', args=(question.id,)))
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 1)
+
+    def test_vote_is_a_single_update(self):
+        """
+        Once the question's shard setting is cached, a vote only runs the
+        UPDATE of the choice.
+        """
+        question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        choice = question.choice_set.get()
+        record_vote(question.id, choice.id)
+        with self.assertNumQueries(1):
+            record_vote(question.id, choice.id)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 2)
+
+    def test_vote_without_choice(self):
+        """
+        Posting without a choice redisplays the form with an error message.
+        """
+        question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        response = self.client.post(reverse('polls:vote', args=(question.id,)))
+        self.assertContains(response, escape("You didn't select a choice."))
+
+    def test_vote_for_choice_of_another_question(self):
+        """
+        A choice can only be voted through its own question.
+        """
+        question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        other = create_question(
+            question_text='Other Question.', days=-5, choice='Choice Two')
+        choice = other.choice_set.get()
+        response = self.client.post(
+            reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertEqual(response.status_code, 200)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 0)
+
+    def test_vote_with_invalid_choice(self):
+        """
+        A choice id that isn't a number is treated as a missing choice.
+        """
+        question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        response = self.client.post(
+            reverse('polls:vote', args=(question.id,)), {'choice': 'abc'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_vote_unknown_question(self):
+        """
+        Voting on a question that doesn't exist returns a 404 not found.
+        """
+        response = self.client.post(reverse('polls:vote', args=(1,)), {'choice': 1})
+        self.assertEqual(response.status_code, 404)
+
+
+class ConcurrentVoteTests(TransactionTestCase):
+    def setUp(self):
+        # No vote history flush from an earlier test's thread meanwhile.
+        reset_history_buffer()
+        self.addCleanup(reset_history_buffer)
+
+    def test_parallel_votes_are_not_lost(self):
+        """
+        Votes recorded from many threads at once all end up in the counts.
+        """
+        question = create_question(
+            question_text='Popular question.', days=-1, choice='Choice One')
+        first = question.choice_set.get()
+        second = question.choice_set.create(choice_text='Choice Two')
+        ballots = [first.id] * 1200 + [second.id] * 800
+
+        def cast(choice_id):
+            try:
+                record_vote(question.id, choice_id)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(cast, ballots))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.votes, 1200)
+        self.assertEqual(second.votes, 800)
+
+
+class ShardedVoteTests(TestCase):
+    def setUp(self):
+        self.question = create_question(
+            question_text='Viral question.', days=-1, choice='Choice One')
+        self.question.vote_shards = 4
+        self.question.save()
+        self.choice = self.question.choice_set.get()
+
+    def test_sharded_votes_go_to_shards(self):
+        """
+        Votes on a sharded question land in the counter shards and are
+        counted in the choice's total.
+        """
+        for _ in range(20):
+            record_vote(self.question.id, self.choice.id)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 0)
+        self.assertLessEqual(self.choice.shards.count(), 4)
+        self.assertEqual(self.choice.total_votes, 20)
+
+    def test_sharded_vote_for_choice_of_another_question(self):
+        """
+        A sharded question rejects choices that belong to other questions.
+        """
+        other = create_question(
+            question_text='Other question.', days=-1, choice='Choice Two')
+        with self.assertRaises(Choice.DoesNotExist):
+            record_vote(self.question.id, other.choice_set.get().id)
+
+    def test_sharding_turned_on_later(self):
+        """
+        Saving the question drops its cached shard setting.
+        """
+        self.question.vote_shards = 0
+        self.question.save()
+        record_vote(self.question.id, self.choice.id)
+        self.question.vote_shards = 4
+        self.question.save()
+        record_vote(self.question.id, self.choice.id)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 1)
+        self.assertEqual(self.choice.total_votes, 2)
+
+    def test_fold_vote_shards(self):
+        """
+        Folding the shards moves their votes into Choice.votes.
+        """
+        for _ in range(7):
+            record_vote(self.question.id, self.choice.id)
+        self.assertEqual(fold_vote_shards(), 7)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 7)
+        self.assertEqual(self.choice.total_votes, 7)
+        self.assertEqual(fold_vote_shards(), 0)
+
+    def test_results_show_sharded_totals(self):
+        """
+        The results page counts the votes still held in the shards.
+        """
+        for _ in range(3):
+            record_vote(self.question.id, self.choice.id)
+        response = self.client.get(
+            reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Choice One: 3 votes')
+
+
+class DeltaBufferTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+        self.buffer = DeltaBuffer(self.batches.append, interval=60, max_lag=60)
+
+    def tearDown(self):
+        self.buffer.stop()
+
+    def test_flush_merges_deltas(self):
+        """
+        Deltas for the same key are merged into one entry per flush.
+        """
+        for key in [1, 2, 1, 1]:
+            self.buffer.add(key)
+        self.assertEqual(self.buffer.stats()['depth'], 2)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.batches, [{1: 3, 2: 1}])
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_flush_when_full(self):
+        """
+        The background thread flushes as soon as max_pending is reached.
+        """
+        self.buffer.max_pending = 5
+        for _ in range(5):
+            self.buffer.add('key')
+        for _ in range(100):
+            if self.batches:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.batches, [{'key': 5}])
+
+    def test_late_deltas_are_flushed_by_the_writer(self):
+        """
+        A delta older than max_lag makes add() flush the buffer itself.
+        """
+        self.buffer.max_lag = 0.01
+        self.buffer.add('key')
+        time.sleep(0.02)
+        self.buffer.add('key')
+        self.assertEqual(self.batches, [{'key': 2}])
+
+    def test_stop_without_flushing(self):
+        """
+        A buffer stopped without flushing drops its pending deltas.
+        """
+        self.buffer.add('key')
+        self.buffer.stop(flush=False)
+        self.assertEqual(self.batches, [])
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+
+    def test_failed_flush_keeps_deltas(self):
+        """
+        Deltas that couldn't be applied stay in the buffer for the next flush.
+        """
+        def apply(batch):
+            raise RuntimeError
+        self.buffer.apply = apply
+        self.buffer.add('key')
+        with self.assertLogs('polls.buffer', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.apply = self.batches.append
+        self.buffer.add('key')
+        self.buffer.flush()
+        self.assertEqual(self.batches, [{'key': 2}])
+        self.assertEqual(self.buffer.stats()['failed_flushes'], 1)
+
+    def test_stop_flushes(self):
+        """
+        Stopping the buffer writes out what is still pending.
+        """
+        self.buffer.add('key', 3)
+        self.buffer.stop()
+        self.assertEqual(self.batches, [{'key': 3}])
+
+
+@override_settings(POLLS_VOTE_MODE='buffered', POLLS_VOTE_BUFFER_INTERVAL=60000,
+                   POLLS_VOTE_BUFFER_MAX_LAG=60000)
+class BufferedVoteTests(TestCase):
+    def tearDown(self):
+        if services._vote_buffer is not None:
+            services._vote_buffer.stop()
+            services._vote_buffer = None
+
+    def test_buffered_votes_are_written_on_flush(self):
+        """
+        Buffered votes only reach Choice.votes when the buffer is flushed.
+        """
+        question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        choice = question.choice_set.get()
+        for _ in range(3):
+            response = self.client.post(
+                reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+            self.assertEqual(response.status_code, 302)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 0)
+        services.get_vote_buffer().flush()
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 3)
+
+    def test_buffered_vote_is_validated(self):
+        """
+        Votes for a choice of another question are rejected before buffering.
+        """
+        question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        other = create_question(
+            question_text='Other Question.', days=-5, choice='Choice Two')
+        with self.assertRaises(Choice.DoesNotExist):
+            record_vote(question.id, other.choice_set.get().id)
+        self.assertEqual(services.get_vote_buffer().stats()['depth'], 0)
+
+
+@override_settings(POLLS_VOTE_MODE='log', POLLS_VOTE_LOG_SETTLE=0)
+class VoteLogTests(TestCase):
+    def setUp(self):
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.first = self.question.choice_set.get()
+        self.second = self.question.choice_set.create(choice_text='Choice Two')
+
+    def test_vote_is_logged(self):
+        """
+        In log mode voting only inserts a Vote row.
+        """
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {'choice': self.first.id})
+        self.assertEqual(response.status_code, 302)
+        vote = Vote.objects.get()
+        self.assertEqual(vote.choice, self.first)
+        self.assertEqual(vote.question, self.question)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+
+    def test_rollup_folds_new_votes_once(self):
+        """
+        The rollup adds each logged vote to the counts exactly once.
+        """
+        for choice in [self.first, self.first, self.second]:
+            record_vote(self.question.id, choice.id)
+        self.assertEqual(fold_vote_log(chunk_size=2), 3)
+        record_vote(self.question.id, self.second.id)
+        self.assertEqual(fold_vote_log(chunk_size=2), 1)
+        self.assertEqual(fold_vote_log(chunk_size=2), 0)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (2, 2))
+        self.assertEqual(
+            RollupState.objects.get(name='vote_log').position,
+            Vote.objects.latest('pk').pk)
+
+    def test_rollup_leaves_unsettled_votes(self):
+        """
+        Votes younger than POLLS_VOTE_LOG_SETTLE wait for the next rollup.
+        """
+        record_vote(self.question.id, self.first.id)
+        with self.settings(POLLS_VOTE_LOG_SETTLE=60):
+            self.assertEqual(fold_vote_log(), 0)
+        self.assertEqual(fold_vote_log(), 1)
+
+    def test_rollup_waits_for_older_votes_logged_later(self):
+        """
+        A settled vote logged after an unsettled one waits along with it,
+        rather than being passed over by the high-water mark.
+        """
+        now = timezone.now()
+        for seconds in [4.9, 5.1]:
+            Vote.objects.create(
+                question=self.question, choice=self.first,
+                timestamp=now - datetime.timedelta(seconds=seconds))
+        with self.settings(POLLS_VOTE_LOG_SETTLE=5):
+            self.assertEqual(fold_vote_log(), 0)
+        self.assertEqual(fold_vote_log(), 2)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 2)
+
+    def test_rebuild_vote_counts(self):
+        """
+        Rebuilding recomputes the counts from the log after corruption.
+        """
+        for choice in [self.first, self.second, self.second]:
+            record_vote(self.question.id, choice.id)
+        fold_vote_log()
+        Choice.objects.update(votes=1000)
+        self.assertEqual(rebuild_vote_counts(chunk_size=2), 3)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (1, 2))
+        self.assertEqual(fold_vote_log(), 0)
+
+    def test_rebuild_needs_log_mode(self):
+        """
+        Outside log mode, rebuilding would drop the votes not logged.
+        """
+        record_vote(self.question.id, self.first.id)
+        with self.settings(POLLS_VOTE_MODE='direct'):
+            record_vote(self.question.id, self.second.id)
+            with self.assertRaises(CommandError):
+                call_command('rollup_votes', rebuild=True, stdout=StringIO())
+            self.second.refresh_from_db()
+            self.assertEqual(self.second.votes, 1)
+            out = StringIO()
+            call_command('rollup_votes', rebuild=True, force=True, stdout=out)
+        self.assertEqual(out.getvalue(), 'Rebuilt the counts from 1 logged votes.\n')
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.votes, 0)
+
+
+class ChoiceCountTests(TestCase):
+    def setUp(self):
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+
+    def choice_count(self, question):
+        return Question.objects.values_list(
+            'choice_count', flat=True).get(pk=question.pk)
+
+    def test_choice_create_and_delete(self):
+        """
+        Creating and deleting choices keeps choice_count up to date.
+        """
+        self.assertEqual(self.choice_count(self.question), 1)
+        choice = self.question.choice_set.create(choice_text='Choice Two')
+        self.assertEqual(self.choice_count(self.question), 2)
+        choice.delete()
+        self.question.choice_set.all().delete()
+        self.assertEqual(self.choice_count(self.question), 0)
+
+    def test_choice_moved_to_another_question(self):
+        """
+        Moving a choice updates the counts of both questions.
+        """
+        other = create_question(question_text='Other Question.', days=-5)
+        choice = self.question.choice_set.get()
+        choice.question = other
+        choice.save()
+        self.assertEqual(self.choice_count(self.question), 0)
+        self.assertEqual(self.choice_count(other), 1)
+        Choice.objects.filter(question=other).update(question=self.question)
+        self.assertEqual(self.choice_count(self.question), 1)
+        self.assertEqual(self.choice_count(other), 0)
+
+    def test_choices_moved_with_bulk_update(self):
+        """
+        Moving choices with bulk_update() updates the counts and drops the
+        cached results of the questions on both ends.
+        """
+        other = create_question(
+            question_text='Other Question.', days=-5, choice='Choice Two')
+        get_results(other.id)
+        choice = self.question.choice_set.get()
+        choice.question = other
+        with mock.patch.object(cache, 'delete', wraps=cache.delete) as delete:
+            Choice.objects.bulk_update([choice], ['question'])
+        self.assertEqual(self.choice_count(self.question), 0)
+        self.assertEqual(self.choice_count(other), 2)
+        self.assertEqual(
+            {call.args[0] for call in delete.call_args_list}, {
+                'polls:index', 'polls:results:%s' % self.question.id,
+                'polls:results:%s' % other.id})
+        self.assertEqual(len(get_results(other.id)['choices']), 2)
+
+    def test_bulk_create(self):
+        """
+        Choices created in bulk are counted.
+        """
+        Choice.objects.bulk_create([
+            Choice(question=self.question, choice_text='Choice %d' % i)
+            for i in range(3)])
+        self.assertEqual(self.choice_count(self.question), 4)
+
+    def test_question_save_keeps_count(self):
+        """
+        Saving a question instance with a stale choice_count doesn't
+        overwrite the maintained count.
+        """
+        stale = Question.objects.get(pk=self.question.pk)
+        self.question.choice_set.create(choice_text='Choice Two')
+        stale.question_text = 'Edited question.'
+        stale.save()
+        self.assertEqual(self.choice_count(self.question), 2)
+
+    def test_check_choice_counts(self):
+        """
+        check_choice_counts reports wrong counts and fixes them with --fix.
+        """
+        call_command('check_choice_counts', stdout=StringIO())
+        Question.objects.update(choice_count=7)
+        with self.assertRaises(CommandError):
+            call_command('check_choice_counts', stdout=StringIO())
+        call_command('check_choice_counts', '--fix', stdout=StringIO())
+        self.assertEqual(self.choice_count(self.question), 1)
+
+
+def query_plan_problems(sql):
+    """
+    Return the full table scans, and the sorts not served by an index, in
+    the database's query plan for the SELECT statement `sql`.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN FORMAT=JSON ' + sql)
+            problems = []
+
+            def walk(node):
+                if isinstance(node, dict):
+                    if node.get('access_type') == 'ALL':
+                        problems.append('full scan of %s' % node.get('table_name'))
+                    if node.get('using_filesort'):
+                        problems.append('filesort')
+                    for value in node.values():
+                        walk(value)
+                elif isinstance(node, list):
+                    for value in node:
+                        walk(value)
+            walk(json.loads(cursor.fetchone()[0]))
+            return problems
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        plan = '\n'.join(row[-1] for row in cursor.fetchall())
+    # Going through the rows of a subquery isn't a table scan.
+    return (re.findall(r'SCAN (?:TABLE )?(?!subquery$)\w+$', plan, re.MULTILINE) +
+            re.findall(r'USE TEMP B-TREE FOR ORDER BY', plan))
+
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+class QueryPlanTests(TestCase):
+    """
+    The queries the polls views, caches and admin run are served from
+    indexes. They're captured as the code runs them, so the plans checked
+    are those of the queries actually made.
+    """
+    def setUp(self):
+        cache.clear()
+        for days in range(-3, 3):
+            create_question(
+                question_text='Question %d.' % days, days=days, choice='Choice')
+        self.question = Question.objects.visible().first()
+        self.factory = RequestFactory()
+
+    def assertIndexed(self, func, *args):
+        """
+        Check the plans of the SELECT statements on the polls tables that
+        `func(*args)` runs.
+        """
+        if connection.vendor not in ('mysql', 'sqlite'):
+            self.skipTest('Query plans are only checked on MySQL and SQLite.')
+        with CaptureQueriesContext(connection) as queries:
+            func(*args)
+        statements = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'polls_' in query['sql']]
+        self.assertTrue(statements)
+        for sql in statements:
+            self.assertEqual(query_plan_problems(sql), [], sql)
+
+    def test_index_queries(self):
+        self.assertIndexed(refresh_latest_questions)
+
+    def test_detail_queries(self):
+        self.assertIndexed(
+            views.visible_question, self.factory.get('/'), self.question.pk)
+
+    def test_archive_queries(self):
+        cursor = views.encode_cursor(
+            {'pub_date': self.question.pub_date, 'id': self.question.pk})
+        for params in ({}, {'before': cursor}, {'after': cursor}):
+            with self.subTest(params=params):
+                self.assertIndexed(
+                    views.archive_page, self.factory.get('/', params))
+
+    def test_results_queries(self):
+        self.assertIndexed(get_results, self.question.pk)
+
+    def test_search_queries(self):
+        if connection.vendor == 'mysql':
+            self.skipTest('MySQL searches through its FULLTEXT index.')
+        with CaptureQueriesContext(connection) as queries:
+            api.question_search(self.factory.get('/', {'q': 'question'}))
+        statements = [query['sql'] for query in queries.captured_queries
+                      if 'polls_searchtoken' in query['sql']]
+        self.assertTrue(statements)
+        # The visible() filter, and the sort by rank, run over the few
+        # matching questions.
+        for sql in statements:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+            self.assertIn('polls_searchtoken_token_question_id', plan)
+
+    def test_admin_changelist_queries(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'))
+        now = timezone.now()
+        url = reverse('admin:polls_question_changelist')
+        for params in ({}, {
+                'pub_date__gte': (now - datetime.timedelta(days=7)).isoformat(),
+                'pub_date__lt': now.isoformat()}):
+            with self.subTest(params=params):
+                self.assertIndexed(self.client.get, url, params)
+
+
+class ResultsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.choice = self.question.choice_set.get()
+
+    def test_results_are_cached(self):
+        """
+        Results are only computed once until something changes.
+        """
+        get_results(self.question.id)
+        with self.assertNumQueries(0):
+            results = get_results(self.question.id)
+        self.assertEqual(results['question']['question_text'], 'Past Question.')
+        self.assertEqual(
+            results['choices'],
+            [{'id': self.choice.id, 'choice_text': 'Choice One', 'votes': 0}])
+
+    def test_vote_bumps_version(self):
+        """
+        A vote moves the results to a new version and they get recomputed.
+        """
+        get_results(self.question.id)
+        version = results_version(self.question.id)
+        record_vote(self.question.id, self.choice.id)
+        self.assertGreater(results_version(self.question.id), version)
+        self.assertEqual(get_results(self.question.id)['choices'][0]['votes'], 1)
+
+    def test_choice_edit_invalidates(self):
+        """
+        Editing a choice drops the cached results.
+        """
+        get_results(self.question.id)
+        self.choice.choice_text = 'Edited choice'
+        self.choice.save()
+        results = get_results(self.question.id)
+        self.assertEqual(results['choices'][0]['choice_text'], 'Edited choice')
+
+    def test_unpublished_question_is_not_found(self):
+        """
+        Cached results of a question without choices aren't served.
+        """
+        get_results(self.question.id)
+        self.choice.delete()
+        self.assertIsNone(get_results(self.question.id))
+        self.assertIsNone(get_results(self.question.id + 1))
+
+    @override_settings(POLLS_RESULTS_MAX_STALENESS=60)
+    def test_max_staleness(self):
+        """
+        With a max staleness, votes don't force a recompute but edits do.
+        """
+        get_results(self.question.id)
+        record_vote(self.question.id, self.choice.id)
+        with self.assertNumQueries(0):
+            results = get_results(self.question.id)
+        self.assertEqual(results['choices'][0]['votes'], 0)
+        self.question.question_text = 'Edited question.'
+        self.question.save()
+        results = get_results(self.question.id)
+        self.assertEqual(results['question']['question_text'], 'Edited question.')
+        self.assertEqual(results['choices'][0]['votes'], 1)
+
+    def test_results_view_uses_cache(self):
+        """
+        The results page shows the cached totals and refreshes after a vote.
+        """
+        url = reverse('polls:results', args=(self.question.id,))
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Choice One: 0 votes')
+        self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {'choice': self.choice.id})
+        self.assertContains(self.client.get(url), 'Choice One: 1 vote<')
+
+
+class IndexSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_index_is_one_cache_read(self):
+        """
+        Once built, the front page is served without touching the database.
+        """
+        create_question(
+            question_text='Past question.', days=-30, choice='Choice One')
+        self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, 'Past question.')
+
+    def test_new_question_refreshes_index(self):
+        """
+        Adding the first choice of a question puts it on the front page.
+        """
+        question = create_question(question_text='New question.', days=-1)
+        self.assertEqual(get_latest_questions(), [])
+        question.choice_set.create(choice_text='Choice One')
+        self.assertEqual(
+            [q['question_text'] for q in get_latest_questions()],
+            ['New question.'])
+
+    def test_snapshot_expires_at_next_publication(self):
+        """
+        The snapshot is valid until the next future question is published.
+        """
+        future = create_question(
+            question_text='Future question.', days=1, choice='Choice One')
+        snapshot = refresh_latest_questions()
+        self.assertEqual(snapshot['valid_until'], future.pub_date)
+        Question.objects.filter(pk=future.pk).update(
+            pub_date=timezone.now() - datetime.timedelta(seconds=1))
+        cache.set('polls:index', dict(
+            snapshot, valid_until=timezone.now() - datetime.timedelta(seconds=1)))
+        self.assertEqual(
+            [q['question_text'] for q in get_latest_questions()],
+            ['Future question.'])
+
+
+    @override_settings(POLLS_INDEX_CACHE_TTL=60)
+    def test_snapshot_timeout_is_bounded(self):
+        """
+        Without a future question, the snapshot still expires.
+        """
+        create_question(
+            question_text='Past question.', days=-30, choice='Choice One')
+        with mock.patch.object(
+                polls_cache.cache, 'set', wraps=polls_cache.cache.set) as cache_set:
+            refresh_latest_questions()
+        self.assertEqual(cache_set.call_args.args[2], 60)
+        create_question(
+            question_text='Future question.', days=1, choice='Choice Two')
+        with mock.patch.object(
+                polls_cache.cache, 'set', wraps=polls_cache.cache.set) as cache_set:
+            refresh_latest_questions()
+        self.assertEqual(cache_set.call_args.args[2], 60)
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Copies an SQLite database.')
+class LaggingReplicaTests(TransactionTestCase):
+    """
+    Caches rebuilt while the replica lags behind the primary hold the
+    primary's data.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.choice = self.question.choice_set.get()
+        self.addCleanup(pin_to_primary, False)
+
+    def start_replica(self):
+        """
+        Add a replica holding a copy of the primary as it is now.
+        """
+        fd, name = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, name)
+        connection.ensure_connection()
+        with sqlite3.connect(name) as target:
+            connection.connection.backup(target)
+        target.close()
+        connections.settings['replica1'] = connections.configure_settings({
+            'default': {},
+            'replica1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name},
+        })['replica1']
+        self.addCleanup(connections.settings.pop, 'replica1')
+        self.addCleanup(connections.__delitem__, 'replica1')
+        self.addCleanup(lambda: connections['replica1'].close())
+        replicas = override_settings(DATABASE_REPLICAS=['replica1'])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+
+    def test_results(self):
+        self.start_replica()
+        record_vote(self.question.id, self.choice.id)
+        pin_to_primary(False)
+        self.assertEqual(
+            Choice.objects.get(pk=self.choice.pk).votes, 0, 'replica read')
+        self.assertEqual(get_results(self.question.id)['choices'][0]['votes'], 1)
+
+    def test_front_page(self):
+        self.start_replica()
+        create_question(
+            question_text='New question.', days=-1, choice='Choice Two')
+        pin_to_primary(False)
+        self.assertEqual(
+            [q['question_text'] for q in get_latest_questions()],
+            ['New question.', 'Past Question.'])
+
+    def test_cached_pages(self):
+        self.start_replica()
+        self.question.question_text = 'Edited question.'
+        self.question.save()
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'a' * 32
+        url = reverse('polls:detail', args=(self.question.id,))
+        self.assertContains(self.client.get(url), 'Edited question.')
+        self.assertContains(self.client.get(url), 'Edited question.')
+
+
+class ViewQueryCountTests(TestCase):
+    """
+    Each page loads its question and choices in a fixed number of queries,
+    however many choices there are.
+    """
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        for i in range(5):
+            self.question.choice_set.create(choice_text='Choice %d' % i)
+
+    def test_index_queries(self):
+        with self.assertNumQueries(2):
+            self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('polls:index'))
+
+    def test_detail_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('polls:detail', args=(self.question.id,)))
+        self.assertContains(response, 'type="radio"', count=6)
+
+    def test_results_queries(self):
+        url = reverse('polls:results', args=(self.question.id,))
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, '<li>', count=6)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_vote_error_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                reverse('polls:vote', args=(self.question.id,)))
+        self.assertContains(response, 'type="radio"', count=6)
+
+
+class AsyncPollsURLConf:
+    urlpatterns = [
+        path('polls/', include((polls_patterns(async_views), 'polls'))),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncPollsURLConf)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.choice = self.question.choice_set.get()
+
+    def test_index(self):
+        create_question(
+            question_text='Future question.', days=30, choice='Choice Two')
+        response = self.client.get(reverse('polls:index'))
+        self.assertQuerySetEqual(
+            response.context['latest_question_list'], [self.question])
+
+    def test_detail(self):
+        response = self.client.get(
+            reverse('polls:detail', args=(self.question.id,)))
+        self.assertContains(response, 'Choice One')
+        future = create_question(
+            question_text='Future question.', days=5, choice='Choice Two')
+        response = self.client.get(reverse('polls:detail', args=(future.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_results(self):
+        response = self.client.get(
+            reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Choice One: 0 votes')
+        response = self.client.get(
+            reverse('polls:results', args=(self.question.id + 1,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_vote(self):
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {'choice': self.choice.id})
+        self.assertRedirects(
+            response, reverse('polls:results', args=(self.question.id,)))
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 1)
+        self.assertIn('pin_primary', response.cookies)
+
+    def test_vote_without_choice(self):
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)))
+        self.assertContains(response, escape("You didn't select a choice."))
+
+
+class ChangeFeedTests(SimpleTestCase):
+    def test_deltas_are_coalesced_per_tick(self):
+        async def run():
+            feed = ChangeFeed(tick=0.01)
+            subscription = feed.subscribe([1])
+            feed.publish(1, 10)
+            feed.publish(1, 10)
+            feed.publish(1, 11)
+            feed.publish(2, 20)
+            batch = await subscription.get(1)
+            subscription.close()
+            return batch
+        self.assertEqual(asyncio.run(run()), {1: {10: 2, 11: 1}})
+
+    def test_fan_out(self):
+        async def run():
+            feed = ChangeFeed(tick=0.01)
+            first = feed.subscribe([1])
+            second = feed.subscribe([1, 2])
+            feed.publish(1, 10)
+            feed.publish(2, 20)
+            batches = [await first.get(1), await second.get(1)]
+            first.close()
+            second.close()
+            return batches, feed._subscribers
+        batches, subscribers = asyncio.run(run())
+        self.assertEqual(batches, [{1: {10: 1}}, {1: {10: 1}, 2: {20: 1}}])
+        self.assertEqual(subscribers, {})
+
+    def test_get_times_out(self):
+        async def run():
+            feed = ChangeFeed(tick=0.01)
+            subscription = feed.subscribe([1])
+            batch = await subscription.get(0.05)
+            subscription.close()
+            return batch
+        self.assertEqual(asyncio.run(run()), {})
+
+
+@override_settings(POLLS_LIVE_RESULTS_TICK=10)
+class ResultsStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.choice = self.question.choice_set.get()
+
+    async def test_stream(self):
+        response = await self.async_client.get(
+            reverse('polls:results_stream', args=(self.question.id,)))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        events = response.streaming_content
+        self.assertEqual(
+            await anext(events),
+            b'event: snapshot\ndata: {"%d":0}\n\n' % self.choice.id)
+        await sync_to_async(record_vote)(self.question.id, self.choice.id)
+        await sync_to_async(record_vote)(self.question.id, self.choice.id)
+        self.assertEqual(
+            await anext(events),
+            b'event: delta\ndata: {"%d":2}\n\n' % self.choice.id)
+        await events.aclose()
+
+    @override_settings(POLLS_LIVE_RESULTS_HEARTBEAT=0)
+    async def test_keepalive(self):
+        response = await self.async_client.get(
+            reverse('polls:results_stream', args=(self.question.id,)))
+        events = response.streaming_content
+        await anext(events)
+        self.assertEqual(await anext(events), b': keepalive\n\n')
+        await events.aclose()
+
+    async def test_unpublished_question(self):
+        future = await sync_to_async(create_question)(
+            question_text='Future question.', days=5, choice='Choice Two')
+        response = await self.async_client.get(
+            reverse('polls:results_stream', args=(future.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_needs_asgi(self):
+        response = self.client.get(
+            reverse('polls:results_stream', args=(self.question.id,)))
+        self.assertEqual(response.status_code, 501)
+
+
+@override_settings(POLLS_LIVE_RESULTS_TICK=10)
+class ResultsSocketTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.first = create_question(
+            question_text='First.', days=-5, choice='Choice One')
+        self.second = create_question(
+            question_text='Second.', days=-5, choice='Choice Two')
+        self.first_choice = self.first.choice_set.get()
+        self.second_choice = self.second.choice_set.get()
+
+    async def test_deltas_are_batched_across_questions(self):
+        socket = LocalWebSocket(results_socket)
+        self.assertTrue(await socket.connect())
+        await socket.send_json({'subscribe': [self.first.id, self.second.id]})
+        self.assertEqual(await socket.receive_json(1), {'t': 1, 's': {
+            str(self.first.id): {str(self.first_choice.id): 0},
+            str(self.second.id): {str(self.second_choice.id): 0},
+        }})
+        vote = sync_to_async(record_vote)
+        await vote(self.first.id, self.first_choice.id)
+        await vote(self.first.id, self.first_choice.id)
+        await vote(self.second.id, self.second_choice.id)
+        self.assertEqual(await socket.receive_json(1), {'t': 2, 'd': {
+            str(self.first.id): {str(self.first_choice.id): 2},
+            str(self.second.id): {str(self.second_choice.id): 1},
+        }})
+        await socket.send_json({'unsubscribe': [self.first.id]})
+        await vote(self.first.id, self.first_choice.id)
+        await vote(self.second.id, self.second_choice.id)
+        self.assertEqual(await socket.receive_json(1), {'t': 3, 'd': {
+            str(self.second.id): {str(self.second_choice.id): 1},
+        }})
+        await socket.close()
+
+    async def test_snapshot_votes_are_not_counted_twice(self):
+        """
+        Votes already in the snapshot aren't sent again as deltas, even
+        when the feed was holding them for other subscribers.
+        """
+        other = results_feed.subscribe([self.first.id])
+
+        def totals(question_ids):
+            record_vote(self.first.id, self.first_choice.id)
+            return vote_totals(question_ids)
+        socket = LocalWebSocket(results_socket)
+        await socket.connect()
+        with mock.patch('polls.websocket.vote_totals', totals):
+            await socket.send_json({'subscribe': [self.first.id]})
+            self.assertEqual(await socket.receive_json(1), {'t': 1, 's': {
+                str(self.first.id): {str(self.first_choice.id): 1}}})
+        with self.assertRaises(asyncio.TimeoutError):
+            await socket.receive_json(0.1)
+        await sync_to_async(record_vote)(self.first.id, self.first_choice.id)
+        self.assertEqual(await socket.receive_json(1), {'t': 2, 'd': {
+            str(self.first.id): {str(self.first_choice.id): 1}}})
+        await socket.close()
+        other.close()
+
+    async def test_unpublished_questions_are_skipped(self):
+        future = await sync_to_async(create_question)(
+            question_text='Future question.', days=5, choice='Choice Two')
+        socket = LocalWebSocket(results_socket)
+        await socket.connect()
+        await socket.send_json({'subscribe': [future.id, 999]})
+        self.assertEqual(await socket.receive_json(1), {'t': 1, 's': {}})
+        await socket.close()
+
+    @override_settings(POLLS_LIVE_RESULTS_MAX_QUESTIONS=1)
+    async def test_invalid_messages(self):
+        socket = LocalWebSocket(results_socket)
+        await socket.connect()
+        await socket.send_json({'subscribe': ['x']})
+        self.assertEqual(
+            await socket.receive_json(1), {'error': 'Invalid message.'})
+        await socket.send_json({'subscribe': [self.first.id, self.second.id]})
+        self.assertEqual(await socket.receive_json(1), {
+            'error': 'At most 1 questions per connection.'})
+        await socket.close()
+
+
+class JSONAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_question_list(self):
+        past = [create_question(
+                    question_text='Question %d.' % n, days=-n, choice='Choice')
+                for n in range(1, 4)]
+        create_question(question_text='Future question.', days=5, choice='Choice')
+        create_question(question_text='No choices.', days=-1)
+        url = reverse('polls:api_questions')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'limit': 2})
+        data = response.json()
+        self.assertEqual(
+            [question['id'] for question in data['results']],
+            [past[0].id, past[1].id])
+        self.assertEqual(data['next'], url + '?limit=2&offset=2')
+        data = self.client.get(data['next']).json()
+        self.assertEqual(
+            [question['id'] for question in data['results']], [past[2].id])
+        self.assertIsNone(data['next'])
+
+    def test_question_list_validation(self):
+        url = reverse('polls:api_questions')
+        self.assertEqual(self.client.get(url, {'limit': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 1000}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'offset': -1}).status_code, 400)
+
+    def test_question_detail(self):
+        question = create_question(
+            question_text='Past question.', days=-1, choice='Choice One')
+        choice = question.choice_set.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('polls:api_question', args=(question.id,)))
+        data = response.json()
+        self.assertEqual(data['question_text'], 'Past question.')
+        self.assertEqual(
+            data['choices'], [{'id': choice.id, 'choice_text': 'Choice One'}])
+        self.assertEqual(
+            data['results'], reverse('polls:api_results', args=(question.id,)))
+        future = create_question(
+            question_text='Future question.', days=5, choice='Choice Two')
+        response = self.client.get(
+            reverse('polls:api_question', args=(future.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_question_results(self):
+        question = create_question(
+            question_text='Past question.', days=-1, choice='Choice One')
+        choice = question.choice_set.get()
+        url = reverse('polls:api_results', args=(question.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.json()['choices'], [
+            {'id': choice.id, 'choice_text': 'Choice One', 'votes': 0}])
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        record_vote(question.id, choice.id)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['choices'][0]['votes'], 1)
+
+    def test_content_etag(self):
+        question = create_question(
+            question_text='Past question.', days=-1, choice='Choice One')
+        url = reverse('polls:api_question', args=(question.id,))
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+
+class BatchResultsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.questions = [
+            create_question(question_text='Question %d.' % n, days=-n,
+                            choice='Choice %d' % n)
+            for n in range(1, 6)]
+        self.url = reverse('polls:api_results_batch')
+
+    def test_batch(self):
+        future = create_question(
+            question_text='Future question.', days=5, choice='Choice')
+        ids = [question.id for question in self.questions]
+        get_results(ids[0])
+        # One multi-get, then one query for the questions and one for the
+        # choices that aren't cached.
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {
+                'ids': ','.join(map(str, ids + [future.id, ids[0]]))})
+        data = response.json()
+        self.assertEqual([results['id'] for results in data['results']], ids)
+        self.assertEqual(data['results'][1]['choices'], [{
+            'id': self.questions[1].choice_set.get().id,
+            'choice_text': 'Choice 2', 'votes': 0}])
+        self.assertEqual(data['missing'], [future.id])
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {
+                'ids': ','.join(map(str, ids))},
+                HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag(self):
+        question = self.questions[0]
+        params = {'ids': str(question.id)}
+        etag = self.client.get(self.url, params)['ETag']
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        record_vote(question.id, question.choice_set.get().id)
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['results'][0]['choices'][0]['votes'], 1)
+
+    def test_validation(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(
+            self.client.get(self.url, {'ids': '1,x'}).status_code, 400)
+        ids = ','.join(map(str, range(1, 202)))
+        self.assertEqual(self.client.get(self.url, {'ids': ids}).status_code, 400)
+
+
+@override_settings(POLLS_INGEST_TOKENS=['kiosk-token'])
+class VoteIngestionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # No trending or history writes left over from other tests.
+        reset_trending()
+        reset_history_buffer()
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.first = self.question.choice_set.get()
+        self.second = self.question.choice_set.create(choice_text='Choice Two')
+        self.other = create_question(
+            question_text='Other Question.', days=-5, choice='Choice Three')
+        self.third = self.other.choice_set.get()
+
+    def test_ingest_votes(self):
+        q, other = self.question.id, self.other.id
+        records = [
+            (q, self.first.id, 3),
+            (q, self.second.id, 2),
+            (other, self.third.id, 4),
+            (q, self.first.id, 1),
+            (q, self.third.id, 5),
+            (q, self.first.id, 0),
+            ('x', self.first.id, 1),
+            (q, self.first.id),
+            '111',
+            (q, self.first.id, True),
+            (q, self.first.id, 1.0),
+            [str(q), str(self.first.id), '1'],
+            (q, self.first.id, 1001),
+        ]
+        # One query to check the choices, one grouped UPDATE, in a
+        # transaction (a savepoint within the test's).
+        with self.assertNumQueries(4):
+            votes, errors = ingest_votes(records)
+        self.assertEqual(votes, 10)
+        self.assertEqual([index for index, _ in errors], list(range(4, 13)))
+        self.assertEqual(
+            sorted(Choice.objects.values_list('pk', 'votes')),
+            [(self.first.id, 4), (self.second.id, 2), (self.third.id, 4)])
+
+    @override_settings(POLLS_VOTE_MODE='log')
+    def test_ingest_votes_into_the_log(self):
+        votes, errors = ingest_votes([
+            (self.question.id, self.first.id, 3),
+            (self.question.id, self.second.id, 1000)])
+        self.assertEqual((votes, errors), (1003, []))
+        self.assertEqual(Vote.objects.filter(choice=self.first).count(), 3)
+        self.assertEqual(Vote.objects.filter(choice=self.second).count(), 1000)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+
+    def test_ingested_votes_reach_the_results(self):
+        get_results(self.question.id)
+        ingest_votes([(self.question.id, self.first.id, 3)])
+        self.assertEqual(
+            get_results(self.question.id)['choices'][0]['votes'], 3)
+
+    def post(self, data, token='kiosk-token'):
+        return self.client.post(
+            reverse('polls:api_votes'), json.dumps(data),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='Token %s' % token)
+
+    def test_endpoint(self):
+        response = self.post({'votes': [
+            [self.question.id, self.first.id, 3],
+            [self.other.id, self.first.id, 1],
+        ]})
+        self.assertEqual(response.json(), {
+            'votes': 3, 'records': 1, 'errors': [{
+                'index': 1,
+                'error': 'Choice %d is not a choice of question %d.' % (
+                    self.first.id, self.other.id)}]})
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 3)
+
+    def test_endpoint_validation(self):
+        self.assertEqual(self.post({'votes': []}, token='x').status_code, 401)
+        self.assertEqual(self.post({'records': []}).status_code, 400)
+        self.assertEqual(self.post({'votes': 3}).status_code, 400)
+        with override_settings(POLLS_INGEST_MAX_RECORDS=1):
+            response = self.post({'votes': [[1, 1, 1], [1, 1, 1]]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'votes.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('%d,%d,2\n%d,%d,1\n%d,%d,x\n' % (
+                self.question.id, self.first.id,
+                self.question.id, self.second.id,
+                self.question.id, self.first.id))
+        stdout, stderr = StringIO(), StringIO()
+        with self.assertRaisesMessage(CommandError, '1 rows could not'):
+            call_command('ingest_votes', path, '--batch-size', '2',
+                         stdout=stdout, stderr=stderr)
+        self.assertIn('Added 3 votes from 2 rows, skipped 1 rows.',
+                      stdout.getvalue())
+        self.assertIn('Line 3:', stderr.getvalue())
+        self.assertEqual(
+            sorted(self.question.choice_set.values_list('votes', flat=True)),
+            [1, 2])
+
+
+@modify_settings(MIDDLEWARE={'remove': 'polls.middleware.PollsPageCacheMiddleware'})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.choice = self.question.choice_set.get()
+
+    def get(self, name, **headers):
+        return self.client.get(
+            reverse(name, args=(self.question.id,)), **headers)
+
+    def test_results(self):
+        response = self.get('polls:results')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.get('polls:results', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        record_vote(self.question.id, self.choice.id)
+        response = self.get('polls:results', HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Choice One: 1 vote')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail(self):
+        # The first visit sets the CSRF cookie the ETag depends on.
+        self.get('polls:detail')
+        response = self.get('polls:detail')
+        etag = response['ETag']
+        # A Last-Modified date couldn't vary with the CSRF cookie.
+        self.assertNotIn('Last-Modified', response)
+        # Only the question is loaded, not its choices.
+        with self.assertNumQueries(1):
+            response = self.get('polls:detail', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.choice.choice_text = 'Edited choice'
+        self.choice.save()
+        response = self.get('polls:detail', HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Edited choice')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_varies_with_csrf_cookie(self):
+        etag = self.get('polls:detail')['ETag']
+        self.client.cookies['csrftoken'] = 'a' * 32
+        response = self.get('polls:detail', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.client.cookies['csrftoken'] = 'b' * 32
+        response = self.get(
+            'polls:detail', HTTP_IF_MODIFIED_SINCE=http_date(time.time()))
+        self.assertEqual(response.status_code, 200)
+
+    def test_question_edit_changes_results_etag(self):
+        etag = self.get('polls:results')['ETag']
+        self.question.question_text = 'Edited question.'
+        self.question.save()
+        response = self.get('polls:results', HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Edited question.')
+
+    def test_unpublished_question(self):
+        self.question.pub_date = timezone.now() + datetime.timedelta(days=1)
+        self.question.save()
+        response = self.get('polls:detail', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ROOT_URLCONF=AsyncPollsURLConf)
+class AsyncConditionalGetTests(ConditionalGetTests):
+    pass
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.choice = self.question.choice_set.get()
+        self.other = create_question(
+            question_text='Other Question.', days=-5, choice='Choice Two')
+
+    def assertCached(self, response):
+        # Cached pages are served without rendering a template.
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context)
+
+    def assertRendered(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.context)
+
+    def test_index(self):
+        url = reverse('polls:index')
+        response = self.client.get(url)
+        self.assertRendered(response)
+        self.assertEqual(response['Surrogate-Key'], 'polls-index')
+        response = self.client.get(url)
+        self.assertCached(response)
+        self.assertEqual(response['Surrogate-Key'], 'polls-index')
+        self.other.question_text = 'Edited question.'
+        self.other.save()
+        self.assertContains(self.client.get(url), 'Edited question.')
+
+    def test_index_expires_at_next_publication(self):
+        future = create_question(
+            question_text='Soon.', days=0, choice='Choice Three')
+        Question.objects.filter(pk=future.pk).update(
+            pub_date=timezone.now() + datetime.timedelta(seconds=0.3))
+        cache.clear()
+        url = reverse('polls:index')
+        self.assertNotContains(self.client.get(url), 'Soon.')
+        self.assertCached(self.client.get(url))
+        time.sleep(0.3)
+        self.assertContains(self.client.get(url), 'Soon.')
+
+    def test_detail_is_cached_per_csrf_cookie(self):
+        url = reverse('polls:detail', args=(self.question.id,))
+        self.assertRendered(self.client.get(url))
+        self.assertRendered(self.client.get(url))
+        self.assertCached(self.client.get(url))
+        self.client.cookies['csrftoken'] = 'a' * 32
+        self.assertRendered(self.client.get(url))
+
+    def test_purge_only_affected_pages(self):
+        url = reverse('polls:detail', args=(self.question.id,))
+        other_url = reverse('polls:detail', args=(self.other.id,))
+        for _ in range(2):
+            self.client.get(url)
+            self.client.get(other_url)
+        self.choice.choice_text = 'Edited choice'
+        self.choice.save()
+        self.assertContains(self.client.get(url), 'Edited choice')
+        self.assertCached(self.client.get(other_url))
+
+    def test_purge_through_another_cache_instance(self):
+        # Each worker process has its own cache instance: a purge made
+        # through one must reach the pages read through the others.
+        url = reverse('polls:results', args=(self.question.id,))
+        self.client.get(url)
+        self.assertCached(self.client.get(url))
+        other_worker = caches.create_connection('default')
+        self.assertIsNot(other_worker, caches['default'])
+        with mock.patch('polls.cache.cache', other_worker):
+            polls_cache.purge_pages('polls-question-%s' % self.question.id)
+        self.assertRendered(self.client.get(url))
+        self.assertCached(self.client.get(url))
+
+    def test_results_follow_votes(self):
+        url = reverse('polls:results', args=(self.question.id,))
+        self.client.get(url)
+        self.assertCached(self.client.get(url))
+        record_vote(self.question.id, self.choice.id)
+        # Busy results pages are kept for POLLS_PAGE_CACHE_RESULTS_TTL.
+        self.assertContains(self.client.get(url), 'Choice One: 0 votes')
+        with override_settings(POLLS_PAGE_CACHE_RESULTS_TTL=0):
+            self.assertContains(self.client.get(url), 'Choice One: 1 vote')
+
+    def test_voter_gets_fresh_results(self):
+        url = reverse('polls:results', args=(self.question.id,))
+        self.client.get(url)
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {'choice': self.choice.id})
+        self.assertIn('pin_primary', response.cookies)
+        self.assertContains(self.client.get(url), 'Choice One: 1 vote')
+
+    def test_conditional_hit(self):
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_computation(self):
+        flight = SingleFlight()
+        calls = []
+        barrier = threading.Barrier(500)
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        def call(_):
+            barrier.wait()
+            return flight.do('key', compute)
+
+        with ThreadPoolExecutor(max_workers=500) as executor:
+            results = list(executor.map(call, range(500)))
+        self.assertEqual(results, ['value'] * 500)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(flight.in_flight('key'))
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight()
+        started = threading.Event()
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError('boom')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(flight.do, 'key', fail)
+            started.wait()
+            follower = executor.submit(flight.do, 'key', lambda: 'value')
+            for future in (leader, follower):
+                with self.assertRaisesMessage(ValueError, 'boom'):
+                    future.result()
+
+    def test_overlapping_batches(self):
+        flight = SingleFlight()
+        computed = []
+        barrier = threading.Barrier(2)
+
+        def compute(keys):
+            computed.extend(keys)
+            time.sleep(0.1)
+            return {key: key * 10 for key in keys}
+
+        def call(keys):
+            barrier.wait()
+            return flight.do_many(keys, compute)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(call, [[1, 2, 3], [2, 3, 4]]))
+        self.assertEqual(results, [{1: 10, 2: 20, 3: 30}, {2: 20, 3: 30, 4: 40}])
+        self.assertEqual(sorted(computed), [1, 2, 3, 4])
+
+    def test_expires_early(self):
+        now = time.time()
+        self.assertTrue(expires_early(now - 1, cost=0))
+        self.assertFalse(expires_early(now + 60, cost=0.01))
+        self.assertFalse(expires_early(now + 0.001, cost=1, beta=0))
+        early = [expires_early(now + 0.1, cost=0.1) for _ in range(1000)]
+        self.assertTrue(any(early))
+        self.assertFalse(all(early))
+
+
+class ResultsStampedeTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(
+            question_text='Popular question.', days=-1, choice='Choice One')
+        self.choice = self.question.choice_set.get()
+
+    def stampede(self, requests=500):
+        """
+        Ask for the results from `requests` threads at once, and return
+        what they got and the number of times the results were computed.
+        """
+        barrier = threading.Barrier(requests)
+        compute = polls_cache._compute_results
+
+        def slow_compute(versions):
+            time.sleep(0.2)
+            return compute(versions)
+
+        def read(_):
+            barrier.wait()
+            try:
+                return get_results(self.question.id)['choices'][0]['votes']
+            finally:
+                connection.close()
+
+        with mock.patch.object(polls_cache, '_compute_results',
+                               side_effect=slow_compute) as computed:
+            with ThreadPoolExecutor(max_workers=requests) as executor:
+                votes = list(executor.map(read, range(requests)))
+        return votes, computed.call_count
+
+    def test_concurrent_misses_compute_once(self):
+        votes, computations = self.stampede()
+        self.assertEqual(votes, [0] * 500)
+        self.assertEqual(computations, 1)
+
+    def test_stale_while_revalidate(self):
+        get_results(self.question.id)
+        record_vote(self.question.id, self.choice.id)
+        votes, computations = self.stampede()
+        self.assertEqual(computations, 1)
+        # The request refreshing the results gets the new ones, the others
+        # the previous ones meanwhile.
+        self.assertEqual(sorted(set(votes)), [0, 1])
+        self.assertEqual(get_results(self.question.id)['choices'][0]['votes'], 1)
+
+
+class ArchiveViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        questions = [
+            Question(question_text='Question %d.' % n, choice_count=1,
+                     pub_date=now - datetime.timedelta(hours=n // 2))
+            for n in range(45)]
+        Question.objects.bulk_create(questions)
+        create_question(question_text='Future question.', days=5, choice='Choice')
+        create_question(question_text='No choices.', days=-1)
+        # Newest first, questions published at the same time by id.
+        self.expected = list(Question.objects.visible().order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        self.assertEqual(len(self.expected), 45)
+
+    def pages(self):
+        url = reverse('polls:archive')
+        pages = []
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            pages.append(response)
+            cursor = response.context['older_cursor']
+            url = cursor and reverse('polls:archive') + '?before=' + cursor
+        return pages
+
+    def test_older_pages(self):
+        pages = self.pages()
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(
+            [question.id for page in pages
+             for question in page.context['question_list']],
+            self.expected)
+        self.assertIsNone(pages[0].context['newer_cursor'])
+        self.assertNotContains(pages[0], 'Future question.')
+
+    def test_newer_pages(self):
+        second = self.pages()[1]
+        response = self.client.get(
+            reverse('polls:archive'),
+            {'after': second.context['newer_cursor']})
+        self.assertEqual(
+            [question.id for question in response.context['question_list']],
+            self.expected[:20])
+        self.assertIsNone(response.context['newer_cursor'])
+        self.assertEqual(
+            response.context['older_cursor'],
+            self.pages()[0].context['older_cursor'])
+
+    def test_invalid_cursor(self):
+        for cursor in ('x.1', '1.99999999999999999999', '1.-9223372036854775809'):
+            response = self.client.get(reverse('polls:archive'), {'before': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_async(self):
+        with override_settings(ROOT_URLCONF=AsyncPollsURLConf):
+            response = self.client.get(reverse('polls:archive'))
+        self.assertEqual(
+            [question.id for question in response.context['question_list']],
+            self.expected[:20])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.colour = create_question(
+            question_text="What's your favourite colour?", days=-3, choice='Blue')
+        self.colours = create_question(
+            question_text='Favourite colour of the sky, or of the sea?',
+            days=-1, choice='Blue')
+        self.food = create_question(
+            question_text='Favourite food?', days=-2, choice='Pasta')
+        create_question(
+            question_text='Future favourite colour?', days=5, choice='Red')
+
+    def search(self, query, queryset=None):
+        return [question.pk for question in search_questions(query, queryset)]
+
+    def test_tokenize(self):
+        self.assertEqual(
+            tokenize("Où est l'Éléphant? A 2nd try"),
+            {'ou', 'est', 'elephant', '2nd', 'try'})
+
+    def test_ranking(self):
+        # Questions matching more words first, then the newest first.
+        self.assertEqual(
+            self.search('favourite COLOUR', Question.objects.visible()),
+            [self.colours.pk, self.colour.pk, self.food.pk])
+        self.assertEqual(self.search('sky'), [self.colours.pk])
+        self.assertEqual(self.search('colo'), [])
+        self.assertEqual(self.search('?!'), [])
+
+    def test_tokens_follow_edits(self):
+        self.food.question_text = 'Favourite drink?'
+        self.food.save()
+        self.assertEqual(self.search('drink'), [self.food.pk])
+        self.assertEqual(self.search('food'), [])
+        self.food.delete()
+        self.assertFalse(SearchToken.objects.filter(token='drink').exists())
+
+    def test_rebuild_command(self):
+        SearchToken.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_search_index', chunk_size=2, stdout=out)
+        self.assertEqual(out.getvalue(), 'Indexed 4 questions.\n')
+        self.assertEqual(self.search('sky'), [self.colours.pk])
+
+    def test_admin_search(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'))
+        response = self.client.get(
+            reverse('admin:polls_question_changelist'), {'q': 'sky'})
+        self.assertEqual(
+            [question.pk for question in response.context['cl'].result_list],
+            [self.colours.pk])
+
+    def test_api(self):
+        response = self.client.get(
+            reverse('polls:api_search'), {'q': 'favourite colour', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(result['id'], result['rank']) for result in response.json()['results']],
+            [(self.colours.pk, 2), (self.colour.pk, 2)])
+        for params in ({}, {'q': 'colour', 'limit': 0},
+                       {'q': 'colour', 'limit': 51}, {'q': 'colour', 'limit': 'x'}):
+            response = self.client.get(reverse('polls:api_search'), params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_api_without_indexed_words(self):
+        for query in ('a', '?!', '\U0001f308'):
+            response = self.client.get(reverse('polls:api_search'), {'q': query})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {'results': []})
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = autocomplete.PrefixIndex()
+        self.index.add(1, 'Favourite colour?')
+        self.index.add(3, 'Favourite food?')
+        self.index.add(2, 'Colourful flowers or plain ones?')
+
+    def test_candidates(self):
+        self.assertEqual(self.index.candidates('fav', 10), [3, 1])
+        self.assertEqual(self.index.candidates('col', 10), [2, 1])
+        self.assertEqual(self.index.candidates('favourite col', 10), [1])
+        # A complete word matches exactly.
+        self.assertEqual(self.index.candidates('colour ', 10), [1])
+        self.assertEqual(self.index.candidates('F', 10), [3, 2, 1])
+        self.assertEqual(self.index.candidates('f', 1), [3])
+        self.assertEqual(self.index.candidates('f', 10, before=3), [2, 1])
+        self.assertEqual(self.index.candidates('xyz', 10), [])
+        self.assertEqual(self.index.candidates('?', 10), [])
+
+    def test_remove(self):
+        self.index.remove(1)
+        self.assertEqual(self.index.candidates('fav', 10), [3])
+        self.assertEqual(self.index.candidates('colour ', 10), [])
+        self.assertEqual(len(self.index), 7)
+
+    def test_max_questions(self):
+        """
+        Past max_questions, the oldest questions are dropped.
+        """
+        self.index.max_questions = 3
+        self.index.add(4, 'Favourite film?')
+        self.assertEqual(self.index.candidates('fav', 10), [4, 3])
+        self.assertEqual(self.index.candidates('colour', 10), [2])
+        # Too old to make room for.
+        self.index.add(1, 'Favourite colour?')
+        self.assertEqual(self.index.candidates('fav', 10), [4, 3])
+        self.index.remove(3)
+        self.index.add(1, 'Favourite colour?')
+        self.assertEqual(self.index.candidates('fav', 10), [4, 1])
+
+    def test_snapshot(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'autocomplete.snapshot')
+        self.index.save(path)
+        loaded = autocomplete.PrefixIndex.load(path)
+        self.assertEqual(loaded.last_pk, 3)
+        self.assertEqual(loaded.candidates('favourite col', 10), [1])
+        loaded = autocomplete.PrefixIndex.load(path, max_questions=2)
+        self.assertEqual(loaded.candidates('f', 10), [3, 2])
+
+    def test_snapshot_is_data_only(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'autocomplete.snapshot')
+        self.index.save(path)
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        self.assertEqual(
+            (state['format'], state['version']), ('polls-autocomplete', 3))
+        for content in (b'\x80\x05N.', b'[]', b'{"format": "other"}',
+                        json.dumps(dict(state, postings={'x': '!'})).encode()):
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.assertIsNone(autocomplete.PrefixIndex.load(path))
+
+    def test_warm_up(self):
+        autocomplete.reset_index()
+        self.addCleanup(autocomplete.reset_index)
+        index = autocomplete.PrefixIndex()
+        with mock.patch.object(autocomplete, '_load_or_build', return_value=index), \
+                mock.patch.object(autocomplete.PrefixIndex, 'catch_up'):
+            autocomplete.warm_up().join()
+        self.assertIs(autocomplete.loaded_index(), index)
+        autocomplete.reset_index()
+        with mock.patch.object(autocomplete, '_load_or_build', side_effect=OSError), \
+                self.assertLogs('polls.autocomplete', 'ERROR'):
+            autocomplete.warm_up().join()
+        self.assertIsNone(autocomplete.loaded_index())
+
+    def test_concurrent_first_lookups(self):
+        """
+        Lookups made while the index is being loaded wait for it.
+        """
+        autocomplete.reset_index()
+        self.addCleanup(autocomplete.reset_index)
+        loading = threading.Event()
+
+        def catch_up(index):
+            loading.set()
+            time.sleep(0.05)
+        with mock.patch.object(autocomplete, '_load_or_build',
+                               autocomplete.PrefixIndex), \
+                mock.patch.object(autocomplete.PrefixIndex, 'catch_up', catch_up):
+            with ThreadPoolExecutor(1) as executor:
+                first = executor.submit(autocomplete.get_index)
+                loading.wait()
+                self.assertIs(autocomplete.get_index(), first.result())
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        autocomplete.reset_index()
+        self.addCleanup(autocomplete.reset_index)
+        self.colour = create_question(
+            question_text="What's your favourite colour?", days=-3, choice='Blue')
+        self.food = create_question(
+            question_text='Favourite food?', days=-2, choice='Pasta')
+        create_question(
+            question_text='Future favourite colour?', days=5, choice='Red')
+
+    def suggest(self, query, **params):
+        response = self.client.get(
+            reverse('polls:api_autocomplete'), dict(params, q=query))
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.json()['results']]
+
+    def test_suggestions(self):
+        with self.assertNumQueries(3):
+            # Building the index, then catching up with the edits made
+            # while building it, and counting the questions it covers.
+            self.assertEqual(self.suggest('favo'), [self.food.pk, self.colour.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('favourite co'), [self.colour.pk])
+        self.assertEqual(self.suggest('favo', limit=1), [self.food.pk])
+        self.assertEqual(self.suggest(''), [])
+        response = self.client.get(
+            reverse('polls:api_autocomplete'), {'q': 'fav', 'limit': 21})
+        self.assertEqual(response.status_code, 400)
+
+    def test_follows_edits(self):
+        self.suggest('favo')
+        question = create_question(
+            question_text='Favourite film?', days=-1, choice='Alien')
+        self.assertEqual(self.suggest('fil'), [question.pk])
+        question.question_text = 'Best film?'
+        question.save()
+        self.assertEqual(self.suggest('favo'), [self.food.pk, self.colour.pk])
+        question.delete()
+        self.assertEqual(self.suggest('fil'), [])
+
+    def test_follows_choices(self):
+        self.suggest('favo')
+        question = create_question(question_text='Favourite film?', days=-1)
+        self.assertEqual(self.suggest('fil'), [])
+        choice = question.choice_set.create(choice_text='Alien')
+        self.assertEqual(self.suggest('fil'), [question.pk])
+        choice.delete()
+        self.assertEqual(self.suggest('fil'), [])
+
+    def test_catches_up_with_other_processes(self):
+        self.suggest('favo')
+        # Bypasses the signals, as another process would.
+        question = Question.objects.bulk_create([Question(
+            question_text='Favourite film?', choice_count=1,
+            pub_date=timezone.now())])[0]
+        self.assertEqual(self.suggest('fil'), [])
+        with override_settings(POLLS_AUTOCOMPLETE_REFRESH=0):
+            self.assertEqual(self.suggest('fil'), [question.pk])
+        Question.objects.filter(pk=question.pk).update(
+            question_text='Best film?', updated_at=timezone.now())
+        food = self.food.pk
+        with mock.patch('polls.signals.loaded_index', return_value=None):
+            self.food.delete()
+        self.assertEqual(self.suggest('favo'), [question.pk, food, self.colour.pk])
+        with override_settings(POLLS_AUTOCOMPLETE_REFRESH=0):
+            self.assertEqual(self.suggest('favo'), [self.colour.pk])
+            self.assertEqual(self.suggest('fil'), [question.pk])
+
+    def test_snapshot(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'autocomplete.snapshot')
+        out = StringIO()
+        call_command('autocomplete_snapshot', path, stdout=out)
+        self.assertIn('up to question %d' % Question.objects.last().pk,
+                      out.getvalue())
+        question = create_question(
+            question_text='Favourite film?', days=-1, choice='Alien')
+        with override_settings(POLLS_AUTOCOMPLETE_SNAPSHOT=path):
+            self.assertEqual(self.suggest('favourite'),
+                             [question.pk, self.food.pk, self.colour.pk])
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        reset_trending()
+        self.addCleanup(reset_trending)
+        self.questions = [
+            create_question(question_text='Question %d.' % n, days=-1,
+                            choice='Choice')
+            for n in range(3)]
+        self.ids = [question.pk for question in self.questions]
+
+    def board(self, size=10):
+        return TrendingBoard(half_life=3600, size=size, interval=60)
+
+    def test_recent_votes_count_more(self):
+        board = self.board()
+        now = time.time()
+        # Ten votes an hour ago are worth five now.
+        board.record(self.ids[0], 10, now=now - 3600)
+        board.record(self.ids[1], 6, now=now)
+        board.record(self.ids[2], 4, now=now)
+        top = board.top(3, now=now)
+        self.assertEqual([pk for pk, _ in top],
+                         [self.ids[1], self.ids[0], self.ids[2]])
+        # A steady rate r sums up to r / decay.
+        self.assertAlmostEqual(top[0][1], 6 * math.log(2))
+        self.assertEqual(len(board.top(1)), 1)
+
+    def test_board_size(self):
+        board = self.board(size=2)
+        for pk, votes in zip(self.ids, (3, 1, 2)):
+            board.record(pk, votes)
+        self.assertEqual([pk for pk, _ in board.top(5)],
+                         [self.ids[0], self.ids[2]])
+        # A question that dropped off the board comes back with more votes.
+        board.record(self.ids[1], 3)
+        self.assertEqual([pk for pk, _ in board.top(5)],
+                         [self.ids[1], self.ids[0]])
+
+    def test_checkpoint_shares_votes(self):
+        board = self.board()
+        board.record(self.ids[0], 2)
+        board.record(self.ids[1], 1)
+        board.checkpoint()
+        board.record(self.ids[1], 2)
+        board.checkpoint()
+        self.assertEqual(TrendingScore.objects.count(), 2)
+        # Another process sees them, and adds its own.
+        other = self.board()
+        other.record(self.ids[2], 1)
+        self.assertEqual([pk for pk, _ in other.top(3)],
+                         [self.ids[1], self.ids[0], self.ids[2]])
+        self.assertAlmostEqual(
+            dict(other.top(3))[self.ids[1]], 3 * math.log(2), places=2)
+
+    def test_landmark_moves(self):
+        board = self.board()
+        board.record(self.ids[0], 1)
+        board.record(self.ids[1], 10 ** 6)
+        board.checkpoint()
+        # Once votes weigh too much the scores are scaled back, and those
+        # decayed to nearly nothing dropped.
+        RollupState.objects.filter(name='trending').update(
+            position=F('position') - 3600 * 20)
+        with mock.patch('polls.trending.REBASE_AFTER', 10):
+            board.checkpoint()
+        self.assertEqual(list(TrendingScore.objects.values_list(
+            'question_id', flat=True)), [self.ids[1]])
+        self.assertAlmostEqual(
+            TrendingScore.objects.get().score, 10 ** 6 / 2 ** 20, places=3)
+        self.assertAlmostEqual(board.top(1)[0][1], math.log(2) / 2 ** 20 * 10 ** 6,
+                               places=3)
+
+    def test_view(self):
+        for pk, votes in zip(self.ids, (1, 3, 0)):
+            choice = Choice.objects.get(question_id=pk)
+            for _ in range(votes):
+                self.client.post(reverse('polls:vote', args=(pk,)),
+                                 {'choice': choice.pk})
+        response = self.client.get(reverse('polls:trending'))
+        self.assertEqual(
+            [question.pk for question in response.context['question_list']],
+            [self.ids[1], self.ids[0]])
+        self.assertContains(response, '2.1 votes/h')
+        with override_settings(ROOT_URLCONF=AsyncPollsURLConf):
+            response = self.client.get(reverse('polls:trending'))
+        self.assertEqual(len(response.context['question_list']), 2)
+
+
+class VoteHistoryTests(TestCase):
+    def setUp(self):
+        reset_history_buffer()
+        self.addCleanup(reset_history_buffer)
+        self.question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        self.first = self.question.choice_set.get()
+        self.second = self.question.choice_set.create(choice_text='Choice Two')
+        self.now = time.time() // HOUR * HOUR
+
+    def record(self, choice, count, minutes_ago):
+        record_history(self.question.pk, choice.pk, count,
+                       at=self.now - minutes_ago * MINUTE)
+
+    def buckets(self):
+        return sorted(
+            (choice_id, resolution, int(start.timestamp() - self.now), count)
+            for choice_id, resolution, start, count in VoteBucket.objects.values_list(
+                'choice_id', 'resolution', 'start', 'count'))
+
+    def test_votes_are_written_in_batches(self):
+        # The votes all fall in the same minute.
+        clock = mock.patch('polls.history.time', wraps=time)
+        clock.start().time.return_value = self.now + 30.5 * MINUTE
+        self.addCleanup(clock.stop)
+        for _ in range(3):
+            self.client.post(reverse('polls:vote', args=(self.question.pk,)),
+                             {'choice': self.first.pk})
+        services.ingest_votes([(self.question.pk, self.second.pk, 4)])
+        self.assertFalse(VoteBucket.objects.exists())
+        # One query to check the choices, one INSERT of the missing
+        # buckets, one grouped UPDATE, in a savepoint.
+        with self.assertNumQueries(5):
+            get_history_buffer().flush()
+        self.assertEqual(self.buckets(), [
+            (self.first.pk, MINUTE, 30 * MINUTE, 3),
+            (self.second.pk, MINUTE, 30 * MINUTE, 4),
+        ])
+        self.client.post(reverse('polls:vote', args=(self.question.pk,)),
+                         {'choice': self.first.pk})
+        get_history_buffer().flush()
+        self.assertEqual(self.buckets()[0], (self.first.pk, MINUTE, 30 * MINUTE, 4))
+
+    @override_settings(POLLS_VOTE_HISTORY_MINUTES=2, POLLS_VOTE_HISTORY_DAYS=1)
+    def test_compaction(self):
+        self.record(self.first, 1, 10)
+        self.record(self.first, 2, 100)
+        self.record(self.first, 3, 130)
+        self.record(self.second, 4, 170)
+        self.record(self.second, 5, 60 * 25)
+        get_history_buffer().flush()
+        # Minutes before the hour two hours back become hours, hours older
+        # than a day are dropped.
+        self.assertEqual(compact_history(self.now + 30 * MINUTE), (3, 1))
+        self.assertEqual(self.buckets(), [
+            (self.first.pk, MINUTE, -100 * MINUTE, 2),
+            (self.first.pk, MINUTE, -10 * MINUTE, 1),
+            (self.first.pk, HOUR, -3 * HOUR, 3),
+            (self.second.pk, HOUR, -3 * HOUR, 4),
+        ])
+        out = StringIO()
+        call_command('compact_vote_history', stdout=out)
+        self.assertEqual(out.getvalue(),
+                         'Folded 0 minute buckets, dropped 0 hour buckets.\n')
+
+    def history(self, **params):
+        return self.client.get(
+            reverse('polls:api_history', args=(self.question.pk,)), params)
+
+    def test_api_downsamples(self):
+        for minutes_ago in (1, 5, 16, 44, 50):
+            self.record(self.first, 1, minutes_ago)
+        self.record(self.second, 7, 16)
+        get_history_buffer().flush()
+        start = datetime.datetime.fromtimestamp(
+            self.now - HOUR, datetime.timezone.utc)
+        response = self.history(since=start.isoformat(),
+                                until=(start + datetime.timedelta(hours=1)).isoformat(),
+                                points=4)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['step'], 900)
+        self.assertEqual(parse_datetime(data['start']), start)
+        self.assertEqual(data['counts'], [
+            {'id': self.first.pk, 'counts': [1, 1, 1, 2]},
+            {'id': self.second.pk, 'counts': [0, 0, 7, 0]},
+        ])
+        data = self.history(since=start.isoformat(), points=1000).json()
+        self.assertEqual(data['step'], 60)
+        self.assertEqual(sum(data['counts'][0]['counts']), 5)
+        # Past the minute buckets, counts are hourly at least.
+        with override_settings(POLLS_VOTE_HISTORY_MINUTES=2):
+            data = self.history(points=1000).json()
+        self.assertEqual(data['step'], 3600)
+
+    def test_api_clamps_since_to_kept_history(self):
+        self.record(self.first, 2, 5)
+        get_history_buffer().flush()
+        for days in (365, 0):
+            with override_settings(POLLS_VOTE_HISTORY_DAYS=days):
+                response = self.history(since='0001-01-01T00:00:00')
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertGreaterEqual(
+                parse_datetime(data['start']),
+                datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc))
+            self.assertEqual(sum(data['counts'][0]['counts']), 2)
+
+    def test_api_errors(self):
+        self.assertEqual(self.history(since='yesterday').status_code, 400)
+        self.assertEqual(self.history(points=0).status_code, 400)
+        self.assertEqual(self.history(
+            since='2018-10-02T00:00:00', until='2018-10-01T00:00:00').status_code, 400)
+        self.assertEqual(self.history(until='0001-01-01T00:00:00').status_code, 400)
+        future = create_question(question_text='Future.', days=5, choice='Choice')
+        response = self.client.get(reverse('polls:api_history', args=(future.pk,)))
+        self.assertEqual(response.status_code, 404)
+
+
+class VoteHistoryFlushTests(TransactionTestCase):
+    def setUp(self):
+        reset_history_buffer()
+        self.addCleanup(reset_history_buffer)
+
+    @override_settings(POLLS_VOTE_HISTORY_FLUSH=0.01)
+    def test_buffer_flushes_itself(self):
+        """
+        The buffer's thread writes the votes without waiting for more.
+        """
+        question = create_question(
+            question_text='Past Question.', days=-5, choice='Choice One')
+        choice = question.choice_set.get()
+        record_history(question.pk, choice.pk, 2)
+        buffer = get_history_buffer()
+        deadline = time.monotonic() + 5
+        while not buffer.stats()['flushes'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(VoteBucket.objects.get().count, 2)
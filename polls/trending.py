@@ -0,0 +1,195 @@
+"""
+Trending questions, ranked by their recent vote rate.
+
+Each vote adds exp(λ(t - landmark)) to the score of its question, with
+λ = ln 2 / POLLS_TRENDING_HALF_LIFE: a score is the question's votes,
+each weighing half as much every half-life that went by (the "forward
+decay" of Cormode et al.). Scores only grow as votes come in, and the
+order they give stays right as time passes, so nothing ever recomputes
+them from the votes.
+
+Each process keeps the top POLLS_TRENDING_SIZE scores in memory, sorted,
+and adds its votes to them right away. Every POLLS_TRENDING_CHECKPOINT
+seconds it adds them to the TrendingScore rows and reloads the top
+scores, which counts in the votes of the other processes. When the
+weights grow too large, the checkpoint moves the landmark to the present
+and scales every score down accordingly, dropping those close to 0.
+"""
+import bisect
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+
+from .models import Question, RollupState, TrendingScore
+
+logger = logging.getLogger(__name__)
+
+LANDMARK_STATE = 'trending'
+# Move the landmark once votes weigh e**REBASE_AFTER, and then forget the
+# scores worth less than MIN_SCORE votes cast at the new landmark.
+REBASE_AFTER = 100
+MIN_SCORE = 0.001
+
+_trending = None
+_trending_lock = threading.Lock()
+
+
+class TrendingBoard:
+    """
+    The highest trending scores, kept sorted in memory and checkpointed
+    to the TrendingScore table.
+    """
+
+    def __init__(self, half_life, size, interval):
+        self.decay = math.log(2) / half_life
+        self.size = size
+        self.interval = interval
+        # Weights are relative to this landmark, a time.time() timestamp,
+        # which is the process' own until the first checkpoint.
+        self.landmark = int(time.time())
+        self.loaded = False
+        self._scores = {}
+        self._board = []
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._checkpointed = time.monotonic()
+
+    def record(self, question_id, count=1, now=None):
+        """
+        Add `count` votes cast on the question `question_id` at `now`.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            weight = count * math.exp(self.decay * (now - self.landmark))
+            self._pending[question_id] = self._pending.get(question_id, 0) + weight
+            self._set(question_id, self._scores.get(question_id, 0) + weight)
+        if time.monotonic() - self._checkpointed >= self.interval:
+            self.checkpoint(wait=False)
+
+    def top(self, k, now=None):
+        """
+        Return the `k` trending questions, as (question_id, rate) tuples
+        from the highest rate down. The rate is in votes per hour,
+        averaged over the last half-life or so.
+        """
+        if not self.loaded or time.monotonic() - self._checkpointed >= self.interval:
+            self.checkpoint(wait=not self.loaded)
+        now = time.time() if now is None else now
+        with self._lock:
+            scale = self.decay * 3600 * math.exp(-self.decay * (now - self.landmark))
+            return [(question_id, score * scale)
+                    for score, question_id in reversed(self._board[-k:])]
+
+    def _set(self, question_id, score):
+        old = self._scores.get(question_id)
+        if old is not None:
+            i = bisect.bisect_left(self._board, (old, question_id))
+            if i < len(self._board) and self._board[i] == (old, question_id):
+                del self._board[i]
+        # Questions dropping off the board keep their score until the next
+        # checkpoint, in case they get voted for again.
+        self._scores[question_id] = score
+        if len(self._board) < self.size or (score, question_id) > self._board[0]:
+            bisect.insort(self._board, (score, question_id))
+            if len(self._board) > self.size:
+                del self._board[0]
+
+    def checkpoint(self, wait=True):
+        """
+        Add the votes recorded since the last checkpoint to the
+        TrendingScore rows, and reload the top scores from there. Return
+        without doing anything if another thread is already at it, unless
+        `wait` is true.
+        """
+        if not self._checkpoint_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                landmark = self.landmark
+            try:
+                landmark, top = self._write(pending, landmark)
+            except Exception:
+                logger.exception('Trending scores checkpoint failed.')
+                with self._lock:
+                    for question_id, weight in pending.items():
+                        self._pending[question_id] = (
+                            self._pending.get(question_id, 0) + weight)
+                return
+            with self._lock:
+                # Votes recorded meanwhile are relative to the old landmark.
+                scale = math.exp(self.decay * (self.landmark - landmark))
+                self._pending = {
+                    question_id: weight * scale
+                    for question_id, weight in self._pending.items()}
+                self.landmark = landmark
+                self._scores = dict(top)
+                for question_id, weight in self._pending.items():
+                    self._scores[question_id] = (
+                        self._scores.get(question_id, 0) + weight)
+                self._board = sorted(
+                    (score, question_id)
+                    for question_id, score in self._scores.items())[-self.size:]
+                self.loaded = True
+            self._checkpointed = time.monotonic()
+        finally:
+            self._checkpoint_lock.release()
+
+    def _write(self, pending, landmark):
+        now = time.time()
+        with transaction.atomic():
+            state, _ = RollupState.objects.select_for_update().get_or_create(
+                    name=LANDMARK_STATE, defaults={'position': int(now)})
+            if self.decay * (now - state.position) > REBASE_AFTER:
+                scale = math.exp(-self.decay * (int(now) - state.position))
+                TrendingScore.objects.update(score=F('score') * scale)
+                TrendingScore.objects.filter(score__lt=MIN_SCORE).delete()
+                state.position = int(now)
+                state.save(update_fields=['position'])
+            if pending:
+                scale = math.exp(self.decay * (landmark - state.position))
+                question_ids = Question.objects.filter(
+                        pk__in=pending).values_list('pk', flat=True)
+                TrendingScore.objects.bulk_create([
+                    TrendingScore(question_id=question_id, score=0)
+                    for question_id in question_ids], ignore_conflicts=True)
+                whens = [When(pk=question_id, then=Value(weight * scale))
+                         for question_id, weight in pending.items()]
+                TrendingScore.objects.filter(pk__in=pending).update(
+                        score=F('score') + Case(
+                            *whens, default=Value(0.0), output_field=FloatField()))
+            top = list(TrendingScore.objects.order_by('-score').values_list(
+                    'question_id', 'score')[:self.size])
+        return state.position, top
+
+
+def get_trending():
+    """
+    Return the trending board of this process, creating it on first use.
+    """
+    global _trending
+    if _trending is None:
+        with _trending_lock:
+            if _trending is None:
+                _trending = TrendingBoard(
+                    half_life=settings.POLLS_TRENDING_HALF_LIFE,
+                    size=settings.POLLS_TRENDING_SIZE,
+                    interval=settings.POLLS_TRENDING_CHECKPOINT,
+                )
+    return _trending
+
+
+def reset_trending():
+    """
+    Drop the trending board of this process, votes not checkpointed yet
+    included.
+    """
+    global _trending
+    with _trending_lock:
+        _trending = None
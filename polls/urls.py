@@ -1,15 +1,56 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
+
+
+def polls_patterns(pages):
+    """
+    Return the polls URL patterns, with the pages served by the views of
+    the `pages` module (polls.views or polls.async_views).
+    """
+    return [
+        # ex: /polls/
+        path('', pages.IndexView.as_view(), name='index'),
+        # ex: /polls/archive/?before=1539561600000000.42
+        path('archive/', pages.ArchiveView.as_view(), name='archive'),
+        # ex: /polls/trending/
+        path('trending/', pages.TrendingView.as_view(), name='trending'),
+        # ex: /polls/5/
+        path('<int:pk>/', pages.DetailView.as_view(), name='detail'),
+        # ex: /polls/5/results/
+        path('<int:pk>/results/', pages.ResultsView.as_view(), name='results'),
+        # ex: /polls/5/vote/
+        path('<int:question_id>/vote/', pages.vote, name='vote'),
+        # ex: /polls/5/results/stream/
+        path('<int:pk>/results/stream/', async_views.results_stream,
+             name='results_stream'),
+        # ex: /polls/api/questions/?limit=20&offset=40
+        path('api/questions/', api.question_list, name='api_questions'),
+        # ex: /polls/api/questions/5/
+        path('api/questions/<int:pk>/', api.question_detail, name='api_question'),
+        # ex: /polls/api/questions/5/results/
+        path('api/questions/<int:pk>/results/', api.question_results,
+             name='api_results'),
+        # ex: /polls/api/questions/5/history/?since=2018-10-01T00:00:00Z
+        path('api/questions/<int:pk>/history/', api.question_history,
+             name='api_history'),
+        # ex: /polls/api/search/?q=favourite+colour
+        path('api/search/', api.question_search, name='api_search'),
+        # ex: /polls/api/autocomplete/?q=favourite+col
+        path('api/autocomplete/', api.question_autocomplete,
+             name='api_autocomplete'),
+        # ex: /polls/api/results/?ids=4,5,6
+        path('api/results/', api.results_batch, name='api_results_batch'),
+        # ex: /polls/api/votes/
+        path('api/votes/', api.vote_batch, name='api_votes'),
+        # ex: /polls/metrics/vote-buffer/
+        path('metrics/vote-buffer/', views.vote_buffer_stats, name='vote_buffer_stats'),
+        # ex: /polls/metrics/db-pool/
+        path('metrics/db-pool/', views.db_pool_stats, name='db_pool_stats'),
+    ]
+
 
 app_name = 'polls'
-urlpatterns = [
-    # ex: /polls/
-    path('', views.IndexView.as_view(), name='index'),
-    # ex: /polls/5/
-    path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    # ex: /polls/5/results/
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
-    # ex: /polls/5/vote/
-    path('<int:question_id>/vote/', views.vote, name='vote'),
-]
+urlpatterns = polls_patterns(
+        async_views if settings.POLLS_ASYNC_VIEWS else views)
@@ -1,10 +1,27 @@
-from django.utils import timezone
-from django.http import HttpResponseRedirect
+import datetime
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Q, prefetch_related_objects
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import md5
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.http import condition
 
-from .models import Question, Choice
+from django_tutorial.db.pool import pool_stats
+
+from .cache import get_latest_questions, get_results
+from .models import Question, Choice, choices_in_order
+from .services import get_vote_buffer, record_vote
+from .trending import get_trending
+
+ARCHIVE_PAGE_SIZE = 20
+TRENDING_SIZE = 10
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
 
 
 class IndexView(generic.ListView):
@@ -16,51 +33,234 @@ class IndexView(generic.ListView):
         Return the last five published questions (not including those set to be
         published in the future).
         """
-        return Question.objects.filter(
-                pub_date__lte=timezone.now()
-                ).exclude(choice=None).order_by('-pub_date')[:5]
+        return [Question(**question) for question in get_latest_questions()]
+
+
+class ArchiveView(generic.TemplateView):
+    template_name = 'polls/archive.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(archive_page(self.request))
+        return context
+
+
+class TrendingView(generic.ListView):
+    template_name = 'polls/trending.html'
+    context_object_name = 'question_list'
+
+    def get_queryset(self):
+        """
+        Return the published questions getting the most votes lately.
+        """
+        return trending_questions()
+
+
+def trending_questions():
+    """
+    Return the published questions with the highest vote rates, highest
+    first, each with its `rate` in votes per hour.
+
+    The ranking comes from the in-memory trending board, so only the
+    questions shown are read from the database.
+    """
+    rates = dict(get_trending().top(TRENDING_SIZE))
+    questions = Question.objects.visible().filter(pk__in=rates).values(
+            'id', 'question_text', 'pub_date')
+    questions = [Question(**question) for question in questions]
+    for question in questions:
+        question.rate = rates[question.id]
+    questions.sort(key=lambda question: rates[question.id], reverse=True)
+    return questions
+
+
+def archive_page(request):
+    """
+    Return the context of an archive page: the published questions
+    published before the `before` cursor of the request, or after its
+    `after` cursor, newest first, and the cursors of the pages around it.
+
+    Pages are found by seeking to the cursor's (pub_date, id) through an
+    index, so deep pages cost as little as the first one, and questions
+    aren't counted.
+    """
+    before, after = request.GET.get('before'), request.GET.get('after')
+    if after is not None:
+        pub_date, pk = decode_cursor(after)
+        questions = list(Question.objects.visible().filter(
+                Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__gt=pk),
+                pub_date__gte=pub_date).order_by('pub_date', 'id').values(
+                'id', 'question_text', 'pub_date')[:ARCHIVE_PAGE_SIZE + 1])
+        newer = len(questions) > ARCHIVE_PAGE_SIZE
+        questions = questions[:ARCHIVE_PAGE_SIZE][::-1]
+        older = bool(questions)
+    else:
+        questions = Question.objects.visible()
+        if before is not None:
+            pub_date, pk = decode_cursor(before)
+            # Bounding the visibility filter by the cursor lets the
+            # database start its index range scan right there.
+            questions = Question.objects.visible(
+                    min(pub_date, timezone.now())).filter(
+                    Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk))
+        questions = list(questions.order_by('-pub_date', '-id').values(
+                'id', 'question_text', 'pub_date')[:ARCHIVE_PAGE_SIZE + 1])
+        older = len(questions) > ARCHIVE_PAGE_SIZE
+        questions = questions[:ARCHIVE_PAGE_SIZE]
+        newer = before is not None and bool(questions)
+    return {
+        'question_list': [Question(**question) for question in questions],
+        'older_cursor': encode_cursor(questions[-1]) if older else None,
+        'newer_cursor': encode_cursor(questions[0]) if newer else None,
+    }
+
 
+def encode_cursor(question):
+    """
+    Return the archive cursor pointing at `question`, a dict with its
+    pub_date and id.
+    """
+    pub_date = question['pub_date'].astimezone(datetime.timezone.utc)
+    return '%d.%d' % (
+        (pub_date - _EPOCH) // datetime.timedelta(microseconds=1),
+        question['id'])
 
+
+def decode_cursor(cursor):
+    """
+    Return the (pub_date, id) an archive cursor points at.
+    """
+    try:
+        microseconds, pk = map(int, cursor.split('.'))
+        if not -2 ** 63 <= pk < 2 ** 63:
+            # Out of the range of any primary key, the database would
+            # overflow comparing it.
+            raise OverflowError(pk)
+        return _EPOCH + datetime.timedelta(microseconds=microseconds), pk
+    except (ValueError, OverflowError):
+        raise Http404('Invalid archive cursor')
+
+
+def visible_question(request, pk):
+    """
+    Return the published question `pk`, without its choices, or None.
+    It's loaded once per request.
+    """
+    if not hasattr(request, '_polls_question'):
+        request._polls_question = Question.objects.visible().filter(
+                pk=pk).first()
+    return request._polls_question
+
+
+def cached_results(request, pk):
+    """
+    Return get_results(pk), read from the cache once per request.
+    """
+    if not hasattr(request, '_polls_results'):
+        request._polls_results = get_results(pk)
+    return request._polls_results
+
+
+def detail_etag(request, pk):
+    """
+    The ETag of a question's page: its publication date, last edit, and
+    the visitor's CSRF cookie, since the page's form embeds a token for it.
+    The page has no Last-Modified date, which couldn't vary with the cookie.
+    """
+    question = visible_question(request, pk)
+    if question is None:
+        return None
+    return _etag('detail', pk, question.pub_date, question.updated_at,
+                 request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+
+
+def results_etag(request, pk):
+    """
+    The ETag of a question's results page: its publication date, last
+    edit and results version, all known from the results cache entry.
+    """
+    results = cached_results(request, pk)
+    if results is None:
+        return None
+    question = results['question']
+    return _etag('results', pk, question['pub_date'],
+                 question.get('updated_at'), results['version'])
+
+
+def _etag(*parts):
+    return md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+@method_decorator(condition(etag_func=detail_etag), name='get')
 class DetailView(generic.DetailView):
     model = Question
     template_name = 'polls/detail.html'
 
-    def get_queryset(self):
+    def get_object(self, queryset=None):
         """
-        Excludes any questions that aren't published yet.
+        Load the question, unless it isn't published yet, and then its
+        choices in one more query.
         """
-        return Question.objects.filter(
-                pub_date__lte=timezone.now()
-                ).exclude(choice=None)
+        question = visible_question(self.request, self.kwargs['pk'])
+        if question is None:
+            raise Http404('No question found matching the query')
+        prefetch_related_objects([question], choices_in_order())
+        return question
 
 
+@method_decorator(condition(etag_func=results_etag), name='get')
 class ResultsView(generic.DetailView):
     model = Question
     template_name = 'polls/results.html'
 
-    def get_queryset(self):
+    def get_object(self, queryset=None):
         """
-        Excludes any questions that aren't published yet.
+        Load the question and its vote totals from the results cache.
+        Questions that aren't published yet aren't found.
         """
-        return Question.objects.filter(
-                pub_date__lte=timezone.now()
-                ).exclude(choice=None)
+        results = cached_results(self.request, self.kwargs['pk'])
+        if results is None:
+            raise Http404('No question found matching the query')
+        self.choices = results['choices']
+        return Question(**results['question'])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['choices'] = self.choices
+        return context
 
 
 def vote(request, question_id):
-    question = get_object_or_404(Question, pk=question_id)
     try:
-        selected_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
+        record_vote(question_id, request.POST['choice'],
+                    voter_key=request.session.session_key or '')
+    except (KeyError, ValueError, Choice.DoesNotExist):
         # Redisplay the question voting form.
+        question = get_object_or_404(
+                Question.objects.with_choices(), pk=question_id)
         return render(request, 'polls/detail.html', {
             'question': question,
             'error_message': "You didn't select a choice.",
         })
     else:
-        selected_choice.votes += 1
-        selected_choice.save()
         # Always return an HttpResponseRedirect after successfully dealing
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.
-        return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+        return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
+
+
+@staff_member_required
+def vote_buffer_stats(request):
+    """
+    Report the depth and flush latency of this process' vote buffer.
+    """
+    return JsonResponse(get_vote_buffer().stats())
+
+
+@staff_member_required
+def db_pool_stats(request):
+    """
+    Report the checkouts, waits and reconnects of this process' database
+    connection pools.
+    """
+    return JsonResponse(pool_stats())
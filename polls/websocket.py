@@ -0,0 +1,184 @@
+"""
+The live results WebSocket, a plain ASGI application mounted by
+django_tutorial.asgi at /polls/ws/results/.
+
+Clients send JSON text frames::
+
+    {"subscribe": [1, 2, 3]}
+    {"unsubscribe": [2]}
+
+and get, for the questions they just subscribed to, a snapshot of the
+choice totals, then one frame per tick with the votes cast since the
+previous one across all their questions::
+
+    {"t": 1, "s": {"1": {"10": 4, "11": 0}, "3": {"30": 7}}}
+    {"t": 2, "d": {"1": {"10": 2}, "3": {"30": 1}}}
+
+`t` numbers the frames of a connection. A snapshot of every subscribed
+question is sent again every POLLS_LIVE_RESULTS_RESYNC seconds, to catch
+up with votes recorded by other processes, and with those cast while the
+previous snapshot was taken.
+"""
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .cache import get_many_results
+from .changefeed import results_feed
+
+PATH = '/polls/ws/results/'
+
+
+async def results_socket(scope, receive, send):
+    """
+    Serve one live results WebSocket connection.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+    await ResultsConnection(send).run(receive)
+
+
+class ResultsConnection:
+
+    def __init__(self, send):
+        self.send = send
+        self.subscription = results_feed.subscribe([])
+        self.seq = 0
+        self._send_lock = asyncio.Lock()
+
+    async def run(self, receive):
+        sender = asyncio.get_running_loop().create_task(self._send_deltas())
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    return
+                if message['type'] == 'websocket.receive':
+                    await self.handle(message.get('text') or message.get('bytes'))
+        finally:
+            sender.cancel()
+            self.subscription.close()
+
+    async def handle(self, text):
+        try:
+            request = json.loads(text)
+            subscribe = [int(pk) for pk in request.get('subscribe', ())]
+            unsubscribe = [int(pk) for pk in request.get('unsubscribe', ())]
+        except (AttributeError, TypeError, ValueError):
+            await self.send_frame({'error': 'Invalid message.'})
+            return
+        self.subscription.remove(unsubscribe)
+        new = set(subscribe) - self.subscription.question_ids
+        limit = settings.POLLS_LIVE_RESULTS_MAX_QUESTIONS
+        if len(self.subscription.question_ids) + len(new) > limit:
+            await self.send_frame({
+                'error': 'At most %d questions per connection.' % limit})
+            return
+        if new:
+            await self.send_snapshot(new, subscribe=True)
+
+    async def _send_deltas(self):
+        synced = time.monotonic()
+        while True:
+            timeout = max(0, synced + settings.POLLS_LIVE_RESULTS_RESYNC -
+                          time.monotonic())
+            batch = await self.subscription.get(timeout)
+            if batch:
+                await self.send_frame({'d': batch})
+            if time.monotonic() - synced >= settings.POLLS_LIVE_RESULTS_RESYNC:
+                question_ids = set(self.subscription.question_ids)
+                if question_ids:
+                    await self.send_snapshot(question_ids)
+                synced = time.monotonic()
+
+    async def send_snapshot(self, question_ids, subscribe=False):
+        """
+        Send the vote totals of `question_ids`, first subscribing to the
+        visible ones if `subscribe` is set.
+
+        The deltas of the votes published until the snapshot is sent are
+        dropped, as it may count them already: votes cast while it's
+        taken only show up at the next resync, rather than twice. The
+        snapshot is sent before any delta of newly subscribed questions.
+        """
+        snapshot = await sync_to_async(vote_totals)(question_ids)
+        async with self._send_lock:
+            # Hand the votes pending in the feed to the subscribers before
+            # subscribing, so they don't reach this one.
+            results_feed.flush()
+            if subscribe:
+                self.subscription.add(snapshot)
+            self.subscription.drop(question_ids)
+            await self._send_frame({'s': snapshot})
+
+    async def send_frame(self, frame):
+        async with self._send_lock:
+            await self._send_frame(frame)
+
+    async def _send_frame(self, frame):
+        if 'error' not in frame:
+            self.seq += 1
+            frame = dict(frame, t=self.seq)
+        await self.send({
+            'type': 'websocket.send',
+            'text': json.dumps(frame, separators=(',', ':')),
+        })
+
+
+def vote_totals(question_ids):
+    """
+    Return a dict mapping the ids of the visible questions out of
+    `question_ids` to dicts of their choice ids to vote totals.
+    """
+    totals = {
+        question_id: {
+            choice['id']: choice['votes'] for choice in results['choices']}
+        for question_id, results in get_many_results(list(question_ids)).items()}
+    close_old_connections()
+    return totals
+
+
+class LocalWebSocket:
+    """
+    A WebSocket client talking to an ASGI application in the same event
+    loop through in-memory queues, for tests and local load tests.
+    """
+
+    def __init__(self, application, path=PATH):
+        self.application = application
+        self.path = path
+        self._incoming = asyncio.Queue()
+        self._outgoing = asyncio.Queue()
+        self._task = None
+
+    async def connect(self):
+        scope = {
+            'type': 'websocket', 'asgi': {'version': '3.0'}, 'scheme': 'ws',
+            'path': self.path, 'raw_path': self.path.encode(),
+            'query_string': b'', 'root_path': '', 'headers': [],
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            'subprotocols': [],
+        }
+        self._task = asyncio.get_running_loop().create_task(self.application(
+                scope, self._incoming.get, self._outgoing.put))
+        await self._incoming.put({'type': 'websocket.connect'})
+        message = await self._outgoing.get()
+        return message['type'] == 'websocket.accept'
+
+    async def send_json(self, data):
+        await self._incoming.put({
+            'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self, timeout=None):
+        message = await asyncio.wait_for(self._outgoing.get(), timeout)
+        return json.loads(message['text'])
+
+    async def close(self):
+        await self._incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self._task